@@ -0,0 +1,121 @@
+'''
+    Compares parsing serialized blocks with fastbtc.block against decoding verbosity 2 JSON.
+
+    Real blocks are read from benchmarks/fixtures as pairs recorded from a node:
+        bitcoin-cli getblock <hash> 0 > benchmarks/fixtures/<hash>.hex
+        bitcoin-cli getblock <hash> 2 > benchmarks/fixtures/<hash>.json
+    Without fixtures a synthetic block of segwit transactions is used.
+
+    python -m benchmarks.bench_block [--txs 3000] [--rounds 5]
+'''
+import os
+import sys
+import time
+import orjson
+import argparse
+from fastbtc.block import Block, COIN
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def synthetic_block(txs:int) -> tuple:
+    '''Returns the hex and an equivalent verbosity 2 style JSON of a block of P2WPKH spends'''
+    header = bytes(80)
+    body = []
+    for n in range(txs):
+        prevout = n.to_bytes(32, 'little') + (n % 4).to_bytes(4, 'little')
+        inputs = b"\x01" + prevout + b"\x00" + b"\xfd\xff\xff\xff"
+        outputs = b"\x02" + b"".join(
+            (10_000 + n).to_bytes(8, 'little') + b"\x16\x00\x14" + bytes([n % 256]) * 20 for _ in range(2)
+        )
+        witness = b"\x02\x48" + b"\x30" * 72 + b"\x21" + b"\x02" * 33
+        body.append(b"\x02\x00\x00\x00\x00\x01" + inputs + outputs + witness + b"\x00\x00\x00\x00")
+    raw = header + b"\xfd" + txs.to_bytes(2, 'little') + b"".join(body)
+    block = Block(raw)
+    verbose = {
+        "hash": block.hash,
+        "height": 0,
+        "tx": [
+            {
+                "txid": tx.txid, "hash": tx.wtxid, "version": tx.version, "size": tx.size,
+                "vsize": tx.vsize, "weight": tx.weight, "locktime": tx.locktime,
+                "vin": [
+                    {
+                        "txid": txin.txid, "vout": txin.vout, "scriptSig": {"asm": "", "hex": ""},
+                        "txinwitness": [bytes(item).hex() for item in txin.witness], "sequence": txin.sequence,
+                    }
+                    for txin in tx.inputs
+                ],
+                "vout": [
+                    {
+                        "value": out.value / COIN, "n": n,
+                        "scriptPubKey": {
+                            "asm": f"0 {bytes(out.scriptpubkey[2:]).hex()}", "hex": bytes(out.scriptpubkey).hex(),
+                            "address": "bc1q" + "q" * 38, "type": "witness_v0_keyhash",
+                        },
+                    }
+                    for n, out in enumerate(tx.outputs)
+                ],
+                "hex": bytes(tx.raw).hex(),
+            }
+            for tx in block.transactions
+        ],
+    }
+    return raw.hex(), orjson.dumps(verbose)
+
+
+def fixtures() -> list:
+    '''Returns (name, hex, json bytes) of the recorded blocks'''
+    found = []
+    if os.path.isdir(FIXTURES):
+        for name in sorted(os.listdir(FIXTURES)):
+            if name.endswith(".hex") and os.path.exists(os.path.join(FIXTURES, name[:-4] + ".json")):
+                with open(os.path.join(FIXTURES, name)) as hexfile:
+                    hexstring = hexfile.read().strip()
+                with open(os.path.join(FIXTURES, name[:-4] + ".json"), "rb") as jsonfile:
+                    found.append((name[:-4], hexstring, jsonfile.read()))
+    return found
+
+
+def measure(function, rounds:int) -> float:
+    '''Returns the best time of function over rounds'''
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv:list=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--txs", type=int, default=3000, help="transactions in the synthetic block")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    blocks = fixtures() or [("synthetic", *synthetic_block(args.txs))]
+    results = {}
+    for name, hexstring, verbose in blocks:
+        def binary_txids():
+            return [tx.txid for tx in Block.from_hex(hexstring)]
+
+        def binary_outputs():
+            return sum(out.value for tx in Block.from_hex(hexstring) for out in tx.outputs)
+
+        def json_txids():
+            return [tx["txid"] for tx in orjson.loads(verbose)["tx"]]
+
+        results[name] = {
+            "hex_bytes": len(hexstring),
+            "json_bytes": len(verbose),
+            "binary_txids_s": measure(binary_txids, args.rounds),
+            "binary_outputs_s": measure(binary_outputs, args.rounds),
+            "json_txids_s": measure(json_txids, args.rounds),
+        }
+    sys.stdout.write(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode() + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    main()
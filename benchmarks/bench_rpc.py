@@ -0,0 +1,217 @@
+'''
+    Measures calls per second, p50/p99 latency and peak RSS of BitcoinRPC methods and of the main.py endpoints
+    under concurrent load, against the fake bitcoind of benchmarks.fakebitcoind.
+
+    The fake node runs in the same process unless --node points at one started apart, which keeps its CPU time
+    out of the measurements:
+        python -m benchmarks.fakebitcoind --port 18332 &
+        python -m benchmarks.bench_rpc --node 127.0.0.1:18332
+
+    Results are written as JSON with the commit they were measured at, and compared with an earlier run:
+        python -m benchmarks.bench_rpc --output before.json
+        python -m benchmarks.bench_rpc --output after.json --compare before.json
+
+    python -m benchmarks.bench_rpc [--calls 2000] [--concurrency 32] [--latency 0.0005] [--only getblock]
+'''
+import sys
+import time
+import httpx
+import orjson
+import asyncio
+import platform
+import resource
+import argparse
+import subprocess
+import main
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.lanes import Lanes
+from benchmarks.fakebitcoind import FakeBitcoind
+
+
+def peak_rss() -> float:
+    '''Returns the peak resident set size of the process in MiB'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def commit() -> str:
+    '''Returns the checked out commit, None outside of a git checkout'''
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(latencies:list, fraction:float) -> float:
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+
+async def measure(call, calls:int, concurrency:int) -> dict:
+    '''Awaits call(n) for n in range(calls) from concurrency workers, returns the throughput and latencies'''
+    latencies = []
+    errors = 0
+    numbers = iter(range(calls))
+
+    async def worker():
+        nonlocal errors
+        for n in numbers:
+            start = time.perf_counter()
+            try:
+                reply = await call(n)
+            except Exception:
+                errors += 1
+            else:
+                errors += isinstance(reply, dict) and "code" in reply and "message" in reply
+            latencies.append(time.perf_counter() - start)
+
+    rss = peak_rss()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "calls": calls,
+        "errors": errors,
+        "calls_per_s": round(calls / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "peak_rss_mb": round(peak_rss(), 1),
+        "rss_growth_mb": round(peak_rss() - rss, 1),
+    }
+
+
+def client_scenarios(rpc:BitcoinRPC, height:int, txids:list) -> dict:
+    '''Returns name -> (call of n, share of --calls) of the BitcoinRPC methods measured'''
+    blockhash = FakeBitcoind.blockhash
+    return {
+        "getblockcount": (lambda n: rpc.getblockcount(), 1),
+        "getblockhash": (lambda n: rpc.getblockhash(n % height), 1),
+        "getblockheader": (lambda n: rpc.getblockheader(blockhash(n % height)), 1),
+        "getmempoolentry": (lambda n: rpc.getmempoolentry(txids[n % len(txids)]), 1),
+        "getblock_raw": (lambda n: rpc.getblock(blockhash(n % height), 1, raw=True), 1 / 4),
+        "getblock": (lambda n: rpc.getblock(blockhash(n % height), 1), 1 / 4),
+        "getblock_verbose": (lambda n: rpc.getblock(blockhash(n % height), 2), 1 / 20),
+        "getblockparsed": (lambda n: rpc.getblockparsed(blockhash(n % height)), 1 / 20),
+        "getblockparsed_rest": (lambda n: rpc.getblockparsed(blockhash(n % height), rest=True), 1 / 20),
+        "getpeerinfo": (lambda n: rpc.getpeerinfo(), 1 / 4),
+        "getrawmempool": (lambda n: rpc.getrawmempool(), 1 / 50),
+        "getrawmempool_verbose": (lambda n: rpc.getrawmempool(True), 1 / 50),
+        "getrawmempool_typed": (lambda n: rpc.getrawmempool(True, typed=True), 1 / 50),
+        "call_many_1000": (lambda n: rpc.call_many([("getblockhash", [h % height]) for h in range(n, n + 1000)]), 1 / 100),
+    }
+
+
+def endpoint_scenarios(client:httpx.AsyncClient, height:int, txids:list) -> dict:
+    '''Returns name -> (call of n, share of --calls) of the main.py endpoints measured'''
+    blockhash = FakeBitcoind.blockhash
+
+    async def get(path:str):
+        reply = await client.get(path)
+        body = await reply.aread()
+        if reply.status_code != 200:
+            raise RuntimeError(f"{path} answered {reply.status_code}")
+        # RPC errors are answered with a 200 too, only those are decoded to be counted
+        return orjson.loads(body) if body.startswith(b'{"code":') else None
+
+    return {
+        "/rpc/getblockcount": (lambda n: get("/rpc/getblockcount"), 1),
+        "/rpc/getblockhash": (lambda n: get(f"/rpc/getblockhash/{n % height}"), 1),
+        "/rpc/getmempoolentry": (lambda n: get(f"/rpc/getmempoolentry/{txids[n % len(txids)]}"), 1),
+        "/rpc/getblock": (lambda n: get(f"/rpc/getblock/{blockhash(n % height)}?verbosity=1"), 1 / 4),
+        "/rpc/getblock_verbose": (lambda n: get(f"/rpc/getblock/{blockhash(n % height)}?verbosity=2"), 1 / 20),
+        "/rpc/getpeerinfo": (lambda n: get("/rpc/getpeerinfo"), 1 / 4),
+        "/rpc/getrawmempool": (lambda n: get("/rpc/getrawmempool"), 1 / 50),
+        "/rpc/bulk/getblockhash": (lambda n: get(f"/rpc/bulk/getblockhash?start=0&stop={height - 1}"), 1 / 100),
+    }
+
+
+async def run(args:argparse.Namespace) -> dict:
+    node = None
+    if args.node is None:
+        node = await FakeBitcoind(args.height, args.latency).start()
+        address = ("127.0.0.1", node.port)
+    else:
+        host, port = args.node.rsplit(":", 1)
+        address = (host, int(port))
+    results = {
+        "meta": {
+            "commit": commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "node": "in process" if node is not None else args.node,
+            **{key: value for key, value in vars(args).items() if key not in ("output", "compare", "node")},
+        },
+        "client": {},
+        "endpoints": {},
+    }
+    try:
+        async with BitcoinRPC("user", "pass", *address, lanes=Lanes()) as rpc:
+            height = await rpc.getblockcount()
+            txids = (await rpc.getrawmempool())[:10_000]
+            if node is not None:
+                # errors start once the chain and mempool used by the scenarios are known
+                node.error_rate, node.busy_rate = args.error_rate, args.busy_rate
+            for name, (call, share) in client_scenarios(rpc, height, txids).items():
+                if not args.only or any(only in name for only in args.only):
+                    results["client"][name] = await measure(call, max(int(args.calls * share), 1), args.concurrency)
+                    print(f"client {name}: {results['client'][name]}", file=sys.stderr)
+
+            main.rpc, serving = rpc, main.rpc
+            try:
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                    for name, (call, share) in endpoint_scenarios(client, height, txids).items():
+                        if not args.only or any(only in name for only in args.only):
+                            results["endpoints"][name] = await measure(call, max(int(args.calls * share), 1), args.concurrency)
+                            print(f"endpoint {name}: {results['endpoints'][name]}", file=sys.stderr)
+            finally:
+                main.rpc = serving
+    finally:
+        if node is not None:
+            await node.stop()
+    return results
+
+
+def compare(results:dict, baseline:dict) -> dict:
+    '''Returns the relative change of calls per second and p99 latency of every scenario measured in both runs'''
+    changes = {}
+    for group in ("client", "endpoints"):
+        for name, result in results[group].items():
+            before = baseline.get(group, {}).get(name)
+            if before:
+                changes[f"{group} {name}"] = {
+                    "calls_per_s": round(result["calls_per_s"] / before["calls_per_s"] - 1, 3),
+                    "p99_ms": round(result["p99_ms"] / before["p99_ms"] - 1, 3) if before["p99_ms"] else None,
+                }
+    return changes
+
+
+def main(argv:list=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000, help="calls of the cheapest scenarios, heavier ones make fewer")
+    parser.add_argument("--concurrency", type=int, default=32, help="calls in flight at once")
+    parser.add_argument("--height", type=int, default=1000, help="height of the in process fake chain")
+    parser.add_argument("--latency", type=float, default=0, help="seconds the in process fake node adds to every request")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of calls the in process fake node fails")
+    parser.add_argument("--busy-rate", type=float, default=0, help="fraction of requests the in process fake node rejects with 503")
+    parser.add_argument("--node", help="host:port of a fake bitcoind started apart")
+    parser.add_argument("--only", nargs="*", help="run the scenarios whose name contains one of these")
+    parser.add_argument("--output", help="file the results are written to as JSON")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    if args.compare:
+        with open(args.compare, "rb") as baseline:
+            results["compare"] = {"baseline": args.compare, **compare(results, orjson.loads(baseline.read()))}
+    output = orjson.dumps(results, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as outfile:
+            outfile.write(output)
+    sys.stdout.write(output.decode() + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+'''
+    Local bitcoind replaying recorded fixtures, so the client path can be benchmarked without a node or network.
+
+    Fixtures are read from benchmarks/fixtures when recorded from a node:
+        bitcoin-cli getblock <hash> 0 > benchmarks/fixtures/<hash>.hex
+        bitcoin-cli getblock <hash> 2 > benchmarks/fixtures/<hash>.json
+        bitcoin-cli getrawmempool true > benchmarks/fixtures/mempool.json
+        bitcoin-cli getpeerinfo > benchmarks/fixtures/peerinfo.json
+    Anything missing is synthesized. Every height of the fake chain serves one of the blocks in turn.
+
+    python -m benchmarks.fakebitcoind [--port 8332] [--latency 0.001] [--error-rate 0.01] [--busy-rate 0.01]
+'''
+import os
+import orjson
+import asyncio
+import argparse
+from benchmarks.bench_block import FIXTURES, fixtures, synthetic_block
+from tests.fakenode import FakeNode, Raw, RPCError
+
+
+BLOCK_SIZES = (100, 1000, 3000)         # transactions of the synthetic blocks
+MEMPOOL_SIZE = 50_000                   # transactions of the synthetic mempool
+PEERS = 125                             # peers of the synthetic peer list
+CHAIN_HEIGHT = 1000                     # height of the fake chain
+
+
+def load(name:str):
+    '''Returns the decoded fixture file, None if it wasn't recorded'''
+    path = os.path.join(FIXTURES, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as jsonfile:
+        return orjson.loads(jsonfile.read())
+
+
+def synthetic_mempool(size:int) -> dict:
+    '''Returns a verbose getrawmempool of size transactions, every tenth spending the one before'''
+    mempool = {}
+    previous = None
+    for n in range(size):
+        txid = (n + 1).to_bytes(32, 'big').hex()
+        fee = (1000 + n % 5000) / 1e8
+        mempool[txid] = {
+            "vsize": 141, "weight": 561, "time": 1_700_000_000 + n, "height": 800_000,
+            "descendantcount": 1, "descendantsize": 141, "ancestorcount": 1, "ancestorsize": 141,
+            "wtxid": txid, "fees": {"base": fee, "modified": fee, "ancestor": fee, "descendant": fee},
+            "depends": [previous] if previous is not None and n % 10 else [], "spentby": [],
+            "bip125-replaceable": False, "unbroadcast": False,
+        }
+        previous = txid
+    return mempool
+
+
+def synthetic_peers(count:int) -> list:
+    '''Returns a getpeerinfo of count peers'''
+    return [
+        {
+            "id": n, "addr": f"10.0.{n // 256}.{n % 256}:8333", "addrbind": "10.0.0.1:8333", "network": "ipv4",
+            "services": "0000000000000409", "servicesnames": ["NETWORK", "WITNESS", "NETWORK_LIMITED"],
+            "relaytxes": True, "lastsend": 1_700_000_000, "lastrecv": 1_700_000_000, "last_transaction": 0,
+            "last_block": 0, "bytessent": 1_000_000 + n, "bytesrecv": 5_000_000 + n, "conntime": 1_699_000_000,
+            "timeoffset": 0, "pingtime": 0.05, "minping": 0.04, "version": 70016,
+            "subver": "/Satoshi:25.0.0/", "inbound": n >= 10, "bip152_hb_to": False, "bip152_hb_from": False,
+            "startingheight": 800_000, "presynced_headers": -1, "synced_headers": 800_000,
+            "synced_blocks": 800_000, "inflight": [], "addr_relay_enabled": True, "addr_processed": 1000,
+            "addr_rate_limited": 0, "permissions": [], "minfeefilter": 0.00001,
+            "bytessent_per_msg": {"ping": 320, "pong": 320}, "bytesrecv_per_msg": {"ping": 320, "pong": 320},
+            "connection_type": "outbound-full-relay" if n < 10 else "inbound",
+        }
+        for n in range(count)
+    ]
+
+
+class FakeBitcoind(FakeNode):
+    '''FakeNode answering the chain, mempool and network calls from fixtures, replies are serialized once upfront'''
+    def __init__(self, height:int=CHAIN_HEIGHT, latency:float=0, error_rate:float=0, busy_rate:float=0,
+                 seed:int=0) -> None:
+        super().__init__(latency=latency, error_rate=error_rate, busy_rate=busy_rate, seed=seed)
+        self.height = height
+        self.blocks = []                # per block: verbosity 0, 1 and 2 replies
+        binary = []
+        for name, hexstring, verbose in fixtures() or [(f"synthetic{txs}", *synthetic_block(txs)) for txs in BLOCK_SIZES]:
+            summary = orjson.loads(verbose)
+            summary["tx"] = [tx["txid"] for tx in summary["tx"]]
+            self.blocks.append((Raw(orjson.dumps(hexstring)), Raw(orjson.dumps(summary)), Raw(verbose)))
+            binary.append(bytes.fromhex(hexstring))
+        for n in range(height + 1):
+            self.rest[f"block/{self.blockhash(n)}.bin"] = binary[n % len(binary)]
+        entries = load("mempool.json") or synthetic_mempool(MEMPOOL_SIZE)
+        self.entries = {txid: Raw(orjson.dumps(entry)) for txid, entry in entries.items()}
+        self.mempool = Raw(orjson.dumps(list(entries)))
+        self.mempool_verbose = Raw(orjson.dumps(entries))
+        self.mempool_size = len(entries)
+        self.mempool_bytes = sum(entry["vsize"] for entry in entries.values())
+        del entries
+        self.peers = Raw(orjson.dumps(load("peerinfo.json") or synthetic_peers(PEERS)))
+        for method in (
+            "getblockcount", "getbestblockhash", "getblockhash", "getblockheader", "getblock", "getblockchaininfo",
+            "getrawmempool", "getmempoolentry", "getmempoolinfo", "getpeerinfo", "getnettotals",
+        ):
+            self.methods[method] = getattr(self, method)
+
+    @staticmethod
+    def blockhash(height:int) -> str:
+        return height.to_bytes(32, 'big').hex()
+
+    def block(self, blockhash:str) -> tuple:
+        '''Returns the replies of the block served at a height or hash'''
+        height = blockhash if isinstance(blockhash, int) else int(blockhash, 16)
+        if not 0 <= height <= self.height:
+            raise RPCError(-5, "Block not found")
+        return self.blocks[height % len(self.blocks)]
+
+    def getblockcount(self) -> int:
+        return self.height
+
+    def getbestblockhash(self) -> str:
+        return self.blockhash(self.height)
+
+    def getblockhash(self, height:int) -> str:
+        if not 0 <= height <= self.height:
+            raise RPCError(-8, "Block height out of range")
+        return self.blockhash(height)
+
+    def getblockheader(self, blockhash:str, verbose:bool=True):
+        self.block(blockhash)
+        height = int(blockhash, 16)
+        if verbose is False:
+            return bytes(80).hex()
+        return {
+            "hash": blockhash, "confirmations": self.height - height + 1, "height": height, "version": 0x20000000,
+            "versionHex": "20000000", "merkleroot": "00" * 32, "time": 1_700_000_000 + height * 600,
+            "mediantime": 1_700_000_000 + height * 600, "nonce": 0, "bits": "17053894", "difficulty": 1.0,
+            "chainwork": height.to_bytes(32, 'big').hex(), "nTx": 1,
+            "previousblockhash": self.blockhash(height - 1) if height else None,
+        }
+
+    def getblock(self, blockhash:str, verbosity:int=1) -> Raw:
+        return self.block(blockhash)[1 if verbosity is None else min(verbosity, 2)]
+
+    def getblockchaininfo(self) -> dict:
+        return {
+            "chain": "main", "blocks": self.height, "headers": self.height,
+            "bestblockhash": self.blockhash(self.height), "difficulty": 1.0, "verificationprogress": 1.0,
+            "initialblockdownload": False, "size_on_disk": 600_000_000_000, "pruned": False, "warnings": "",
+        }
+
+    def getrawmempool(self, verbose:bool=False, mempool_sequence:bool=False):
+        if mempool_sequence and not verbose:
+            return {"txids": orjson.loads(self.mempool), "mempool_sequence": 1}
+        return self.mempool_verbose if verbose else self.mempool
+
+    def getmempoolentry(self, txid:str) -> Raw:
+        entry = self.entries.get(txid)
+        if entry is None:
+            raise RPCError(-5, "Transaction not in mempool")
+        return entry
+
+    def getmempoolinfo(self) -> dict:
+        return {
+            "loaded": True, "size": self.mempool_size, "bytes": self.mempool_bytes, "usage": self.mempool_bytes * 4,
+            "total_fee": 1.0, "maxmempool": 300_000_000, "mempoolminfee": 0.00001, "minrelaytxfee": 0.00001,
+            "incrementalrelayfee": 0.00001, "unbroadcastcount": 0, "fullrbf": False,
+        }
+
+    def getpeerinfo(self) -> Raw:
+        return self.peers
+
+    def getnettotals(self) -> dict:
+        return {"totalbytesrecv": 5_000_000_000, "totalbytessent": 1_000_000_000, "timemillis": 1_700_000_000_000}
+
+
+async def serve(args:argparse.Namespace) -> None:
+    node = FakeBitcoind(args.height, args.latency, args.error_rate, args.busy_rate)
+    await node.start(args.port)
+    print(f"fake bitcoind at height {node.height} listening on 127.0.0.1:{node.port}", flush=True)
+    await asyncio.Event().wait()
+
+
+def main(argv:list=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8332)
+    parser.add_argument("--height", type=int, default=CHAIN_HEIGHT)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of calls answered with an error")
+    parser.add_argument("--busy-rate", type=float, default=0, help="fraction of requests rejected with 503")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
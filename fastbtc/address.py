@@ -0,0 +1,91 @@
+from typing import List, Optional, Tuple
+from fastbtc.block import sha256d
+
+
+BASE58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+BECH32 = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+BECH32_CONST = 1                        # checksum constant of witness version 0
+BECH32M_CONST = 0x2bc830a3              # checksum constant of witness versions 1 to 16
+
+# base58check version bytes of P2PKH and P2SH addresses, mainnet then testnet/signet/regtest
+P2PKH_VERSIONS = (0x00, 0x6f)
+P2SH_VERSIONS = (0x05, 0xc4)
+SEGWIT_HRPS = ("bc", "tb", "bcrt")
+
+
+def base58check_decode(address:str) -> bytes:
+    '''Returns the payload of a base58check string, raises ValueError if it isn't one'''
+    number = 0
+    for char in address:
+        digit = BASE58.find(char)
+        if digit < 0:
+            raise ValueError(f"Invalid base58 character {char!r}")
+        number = number * 58 + digit
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    data = b"\x00" * (len(address) - len(address.lstrip("1"))) + data
+    if len(data) < 5 or sha256d(data[:-4])[:4] != data[-4:]:
+        raise ValueError("Invalid base58 checksum")
+    return data[:-4]
+
+
+def bech32_polymod(values:List[int]) -> int:
+    generator = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+    check = 1
+    for value in values:
+        top = check >> 25
+        check = (check & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            check ^= generator[i] if (top >> i) & 1 else 0
+    return check
+
+
+def convertbits(data:List[int], frombits:int, tobits:int) -> Optional[bytes]:
+    '''Regroups 5 bit groups into bytes, None if the padding is invalid'''
+    acc = bits = 0
+    out = []
+    for value in data:
+        acc = (acc << frombits) | value
+        bits += frombits
+        while bits >= tobits:
+            bits -= tobits
+            out.append((acc >> bits) & ((1 << tobits) - 1))
+    if bits >= frombits or (acc << (tobits - bits)) & ((1 << tobits) - 1):
+        return None
+    return bytes(out)
+
+
+def segwit_decode(address:str) -> Tuple[int, bytes]:
+    '''Returns the witness version and program of a bech32/bech32m address, raises ValueError if it isn't one'''
+    if address.lower() != address and address.upper() != address:
+        raise ValueError("Mixed case bech32 address")
+    address = address.lower()
+    hrp, _, data = address.rpartition("1")
+    if hrp not in SEGWIT_HRPS or len(data) < 7 or any(char not in BECH32 for char in data):
+        raise ValueError("Invalid bech32 address")
+    values = [BECH32.index(char) for char in data]
+    expanded = [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+    const = bech32_polymod(expanded + values)
+    version = values[0]
+    if const != (BECH32_CONST if version == 0 else BECH32M_CONST):
+        raise ValueError("Invalid bech32 checksum")
+    program = convertbits(values[1:-6], 5, 8)
+    if program is None or version > 16 or not 2 <= len(program) <= 40 or (version == 0 and len(program) not in (20, 32)):
+        raise ValueError("Invalid witness program")
+    return version, program
+
+
+def scriptpubkey(address:str) -> bytes:
+    '''Returns the output script paying to a P2PKH, P2SH or segwit address, raises ValueError for anything else'''
+    if address[:2].lower() in ("bc", "tb") and "1" in address:
+        version, program = segwit_decode(address)
+        return bytes([version + 0x50 if version else 0, len(program)]) + program
+    payload = base58check_decode(address)
+    if len(payload) == 21 and payload[0] in P2PKH_VERSIONS:
+        return b"\x76\xa9\x14" + payload[1:] + b"\x88\xac"
+    if len(payload) == 21 and payload[0] in P2SH_VERSIONS:
+        return b"\xa9\x14" + payload[1:] + b"\x87"
+    raise ValueError("Unknown address version")
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
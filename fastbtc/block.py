@@ -0,0 +1,306 @@
+import hashlib
+from typing import Iterator, List, Optional, Tuple, Union
+
+
+HEADER_SIZE = 80
+COIN = 100_000_000                      # satoshis per bitcoin
+
+
+def sha256d(data:Union[bytes, memoryview]) -> bytes:
+    '''Returns the double SHA256 of data'''
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def read_varint(view:memoryview, pos:int) -> Tuple[int, int]:
+    '''Returns the CompactSize integer at pos and the position following it'''
+    prefix = view[pos]
+    if prefix < 0xfd:
+        return prefix, pos + 1
+    size = 2 if prefix == 0xfd else 4 if prefix == 0xfe else 8
+    return int.from_bytes(view[pos + 1:pos + 1 + size], 'little'), pos + 1 + size
+
+
+def read_bytes(view:memoryview, pos:int) -> Tuple[memoryview, int]:
+    '''Returns the length prefixed bytes at pos and the position following them'''
+    size, pos = read_varint(view, pos)
+    return view[pos:pos + size], pos + size
+
+
+def hash_hex(view:Union[bytes, memoryview]) -> str:
+    '''Returns a hash in the byte order used by RPC'''
+    return bytes(view)[::-1].hex()
+
+
+class BlockHeader:
+    '''80 byte block header, fields are decoded on access'''
+    __slots__ = ("raw", "_hash")
+
+    def __init__(self, raw:Union[bytes, memoryview]) -> None:
+        self.raw = memoryview(raw)[:HEADER_SIZE]
+        self._hash = None
+
+    @classmethod
+    def from_hex(cls, hexstring:str) -> 'BlockHeader':
+        return cls(bytes.fromhex(hexstring))
+
+    @property
+    def hash(self) -> str:
+        if self._hash is None:
+            self._hash = hash_hex(sha256d(self.raw))
+        return self._hash
+
+    @property
+    def version(self) -> int:
+        return int.from_bytes(self.raw[0:4], 'little', signed=True)
+
+    @property
+    def previousblockhash(self) -> str:
+        return hash_hex(self.raw[4:36])
+
+    @property
+    def merkleroot(self) -> str:
+        return hash_hex(self.raw[36:68])
+
+    @property
+    def time(self) -> int:
+        return int.from_bytes(self.raw[68:72], 'little')
+
+    @property
+    def bits(self) -> str:
+        return bytes(self.raw[72:76])[::-1].hex()
+
+    @property
+    def nonce(self) -> int:
+        return int.from_bytes(self.raw[76:80], 'little')
+
+    @property
+    def target(self) -> int:
+        bits = int.from_bytes(self.raw[72:76], 'little')
+        return (bits & 0xffffff) << (8 * ((bits >> 24) - 3))
+
+
+class TxIn:
+    '''Transaction input, a view into the serialized transaction'''
+    __slots__ = ("prevout", "scriptsig", "sequence", "witness")
+
+    def __init__(self, prevout:memoryview, scriptsig:memoryview, sequence:int) -> None:
+        self.prevout = prevout          # 32 byte txid followed by 4 byte output index
+        self.scriptsig = scriptsig
+        self.sequence = sequence
+        self.witness = []               # witness stack items
+
+    @property
+    def txid(self) -> str:
+        return hash_hex(self.prevout[:32])
+
+    @property
+    def vout(self) -> int:
+        return int.from_bytes(self.prevout[32:36], 'little')
+
+    @property
+    def is_coinbase(self) -> bool:
+        return self.vout == 0xffffffff and not any(self.prevout[:32])
+
+
+class TxOut:
+    '''Transaction output, a view into the serialized transaction'''
+    __slots__ = ("value", "scriptpubkey")
+
+    def __init__(self, value:int, scriptpubkey:memoryview) -> None:
+        self.value = value              # satoshis
+        self.scriptpubkey = scriptpubkey
+
+
+class Transaction:
+    '''
+        Serialized transaction. Only its boundaries are found when it is created,
+        inputs, outputs and witnesses are decoded on first access and txid/wtxid are hashed on demand.
+    '''
+    __slots__ = ("raw", "witness_start", "_inputs", "_outputs", "_txid", "_wtxid")
+
+    def __init__(self, raw:Union[bytes, memoryview], witness_start:Optional[int]=None) -> None:
+        self.raw = memoryview(raw)
+        self.witness_start = witness_start      # offset of the witnesses, None without them
+        self._inputs = None
+        self._outputs = None
+        self._txid = None
+        self._wtxid = None
+
+    @classmethod
+    def from_bytes(cls, data:Union[bytes, memoryview]) -> 'Transaction':
+        view = memoryview(data)
+        tx, end = cls.parse(view, 0)
+        if end != len(view):
+            raise ValueError(f"{len(view) - end} trailing bytes after transaction")
+        return tx
+
+    @classmethod
+    def from_hex(cls, hexstring:str) -> 'Transaction':
+        return cls.from_bytes(bytes.fromhex(hexstring))
+
+    @classmethod
+    def parse(cls, view:memoryview, start:int) -> Tuple['Transaction', int]:
+        '''Finds the boundaries of the transaction at start, returning it and the position following it'''
+        pos = start + 4
+        segwit = view[pos] == 0 and view[pos + 1] != 0
+        if segwit:
+            pos += 2
+        count, pos = read_varint(view, pos)
+        for _ in range(count):
+            size, pos = read_varint(view, pos + 36)
+            pos += size + 4
+        count, pos = read_varint(view, pos)
+        for _ in range(count):
+            size, pos = read_varint(view, pos + 8)
+            pos += size
+        witness_start = None
+        if segwit:
+            witness_start = pos - start
+            inputs, _ = read_varint(view, start + 6)
+            for _ in range(inputs):
+                items, pos = read_varint(view, pos)
+                for _ in range(items):
+                    size, pos = read_varint(view, pos)
+                    pos += size
+        pos += 4
+        if pos > len(view):
+            raise ValueError("Transaction is truncated")
+        return cls(view[start:pos], witness_start), pos
+
+    def decode(self) -> None:
+        '''Decodes inputs, outputs and witnesses'''
+        view = self.raw
+        pos = 6 if self.witness_start is not None else 4
+        count, pos = read_varint(view, pos)
+        inputs = []
+        for _ in range(count):
+            prevout = view[pos:pos + 36]
+            scriptsig, pos = read_bytes(view, pos + 36)
+            inputs.append(TxIn(prevout, scriptsig, int.from_bytes(view[pos:pos + 4], 'little')))
+            pos += 4
+        count, pos = read_varint(view, pos)
+        outputs = []
+        for _ in range(count):
+            value = int.from_bytes(view[pos:pos + 8], 'little')
+            scriptpubkey, pos = read_bytes(view, pos + 8)
+            outputs.append(TxOut(value, scriptpubkey))
+        if self.witness_start is not None:
+            for txin in inputs:
+                items, pos = read_varint(view, pos)
+                for _ in range(items):
+                    item, pos = read_bytes(view, pos)
+                    txin.witness.append(item)
+        self._inputs = inputs
+        self._outputs = outputs
+
+    @property
+    def inputs(self) -> List[TxIn]:
+        if self._inputs is None:
+            self.decode()
+        return self._inputs
+
+    @property
+    def outputs(self) -> List[TxOut]:
+        if self._outputs is None:
+            self.decode()
+        return self._outputs
+
+    @property
+    def version(self) -> int:
+        return int.from_bytes(self.raw[0:4], 'little', signed=True)
+
+    @property
+    def locktime(self) -> int:
+        return int.from_bytes(self.raw[-4:], 'little')
+
+    @property
+    def is_segwit(self) -> bool:
+        return self.witness_start is not None
+
+    @property
+    def is_coinbase(self) -> bool:
+        return len(self.inputs) == 1 and self.inputs[0].is_coinbase
+
+    @property
+    def txid(self) -> str:
+        if self._txid is None:
+            if self.witness_start is None:
+                self._txid = self.wtxid
+            else:
+                raw = self.raw
+                stripped = b"".join((raw[:4], raw[6:self.witness_start], raw[-4:]))
+                self._txid = hash_hex(sha256d(stripped))
+        return self._txid
+
+    @property
+    def wtxid(self) -> str:
+        if self._wtxid is None:
+            self._wtxid = hash_hex(sha256d(self.raw))
+        return self._wtxid
+
+    @property
+    def size(self) -> int:
+        return len(self.raw)
+
+    @property
+    def weight(self) -> int:
+        if self.witness_start is None:
+            return 4 * len(self.raw)
+        # marker, flag and witnesses count once, everything else four times
+        stripped = len(self.raw) - 2 - (len(self.raw) - 4 - self.witness_start)
+        return 3 * stripped + len(self.raw)
+
+    @property
+    def vsize(self) -> int:
+        return (self.weight + 3) // 4
+
+
+class Block:
+    '''Serialized block, transactions are located on first access and decoded lazily'''
+    __slots__ = ("raw", "header", "_transactions")
+
+    def __init__(self, raw:Union[bytes, memoryview]) -> None:
+        self.raw = memoryview(raw)
+        self.header = BlockHeader(self.raw)
+        self._transactions = None
+
+    @classmethod
+    def from_hex(cls, hexstring:str) -> 'Block':
+        return cls(bytes.fromhex(hexstring))
+
+    def __iter__(self) -> Iterator[Transaction]:
+        '''Yields the transactions, locating them as they are reached'''
+        if self._transactions is not None:
+            yield from self._transactions
+            return
+        view = self.raw
+        count, pos = read_varint(view, HEADER_SIZE)
+        for _ in range(count):
+            tx, pos = Transaction.parse(view, pos)
+            yield tx
+
+    def __len__(self) -> int:
+        return read_varint(self.raw, HEADER_SIZE)[0]
+
+    @property
+    def transactions(self) -> List[Transaction]:
+        if self._transactions is None:
+            self._transactions = list(self)
+        return self._transactions
+
+    @property
+    def hash(self) -> str:
+        return self.header.hash
+
+    @property
+    def size(self) -> int:
+        return len(self.raw)
+
+    @property
+    def weight(self) -> int:
+        return HEADER_SIZE * 4 + sum(tx.weight for tx in self.transactions) \
+            + 4 * (read_varint(self.raw, HEADER_SIZE)[1] - HEADER_SIZE)
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
@@ -0,0 +1,200 @@
+import orjson
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+from fastbtc.events import EventBus
+
+
+BROADCAST_INTERVAL = 5.0                # seconds between fetches of a topic
+BROADCAST_QUEUE_SIZE = 1                # frames buffered per subscriber
+BROADCAST_KEYFRAME_INTERVAL = 12        # frames between full snapshots of a delta encoded topic
+
+
+class Broadcaster:
+    '''
+        Fetches a topic once, serializes it once and pushes the same frame to every subscriber.
+        Each subscriber gets a bounded queue, one that can't keep up either skips to the latest frame
+        (policy "latest") or is disconnected (policy "disconnect") instead of holding back the others.
+        The topic is fetched every interval seconds while it has subscribers, and right away when one of
+        the given events is published on the bus.
+    '''
+    def __init__(self, fetch:Callable[[], Awaitable], interval:float=BROADCAST_INTERVAL,
+                 maxsize:int=BROADCAST_QUEUE_SIZE, policy:str="latest",
+                 bus:Optional[EventBus]=None, events:Tuple[str, ...]=()) -> None:
+        assert policy in ["latest", "disconnect"]
+        self.fetch = fetch
+        self.interval = interval
+        self.maxsize = maxsize
+        self.policy = policy
+        self.bus = bus
+        self.events = events
+        self.subscribers = set()
+        self.frame = None       # latest serialized frame
+        self.resync = None      # builds the frame for new and lagging subscribers when one first needs it
+        self.task = None
+        self.stats = {"frames": 0, "dropped": 0, "disconnected": 0}
+
+    def subscribe(self) -> asyncio.Queue:
+        '''Returns a queue receiving every frame, starting with the latest one'''
+        queue = asyncio.Queue(self.maxsize)
+        if self.latest() is not None:
+            queue.put_nowait(self.frame)
+        self.subscribers.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return queue
+
+    def unsubscribe(self, queue:asyncio.Queue) -> None:
+        '''Stops delivering frames to queue, fetching stops with the last subscriber'''
+        self.subscribers.discard(queue)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def publish(self, frame:bytes, resync:Optional[Callable[[], bytes]]=None) -> None:
+        '''Pushes frame to every subscriber without waiting on any of them. New subscribers and those that
+        skipped frames get the frame returned by resync instead, if given, which is only built if one does.'''
+        self.frame = frame
+        self.resync = resync
+        self.stats["frames"] += 1
+        for queue in list(self.subscribers):
+            if queue.full():
+                queue.get_nowait()
+                if self.policy == "disconnect":
+                    self.subscribers.discard(queue)
+                    self.stats["disconnected"] += 1
+                    queue.put_nowait(None)
+                    continue
+                self.stats["dropped"] += 1
+                queue.put_nowait(self.latest())
+                continue
+            queue.put_nowait(frame)
+
+    def latest(self) -> Optional[bytes]:
+        '''Returns the frame for new and lagging subscribers, building it from resync the first time'''
+        if self.resync is not None:
+            self.frame = self.resync()
+            self.resync = None
+        return self.frame
+
+    async def refresh(self) -> None:
+        '''Fetches and publishes the topic once'''
+        try:
+            data = await self.fetch()
+            frame = orjson.dumps(data)
+        except Exception as exc:
+            logging.warning(f"broadcast fetch failed: {exc!r}")
+            return
+        self.publish(frame)
+
+    async def run(self) -> None:
+        '''Refreshes the topic every interval, or upon events from the bus'''
+        wakeup = self.bus.subscribe(*self.events) if self.bus is not None and self.events else None
+        try:
+            while True:
+                await self.refresh()
+                if wakeup is None:
+                    await asyncio.sleep(self.interval)
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.get(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        except Exception:
+            # nothing will be published anymore, end the streams instead of leaving them waiting
+            logging.exception("broadcast stopped")
+            self.disconnect()
+        finally:
+            if wakeup is not None:
+                self.bus.unsubscribe(wakeup, *self.events)
+
+    def disconnect(self) -> None:
+        '''Ends the stream of every subscriber'''
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self.stats["disconnected"] += len(self.subscribers)
+        self.subscribers.clear()
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        '''Yields frames until the subscriber is disconnected for falling behind, or fetching stopped'''
+        queue = self.subscribe()
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(queue)
+
+    async def close(self) -> None:
+        '''Stops fetching'''
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+class DeltaBroadcaster(Broadcaster):
+    '''
+        Broadcaster of a list of objects identified by their key field, which sends what changed since the last fetch:
+            {"type": "key", "seq": 7, "items": [...]}
+            {"type": "delta", "seq": 8, "added": [...], "removed": [keys], "changed": [{key: ..., field: value}]}
+        Changed objects only carry the fields that differ, a field that disappeared is sent as null. New subscribers
+        start with a keyframe, as do subscribers that skipped frames, and one is sent to all every keyframe_interval
+        frames. Failed fetches (RPC errors) are sent as is and followed by a keyframe.
+    '''
+    def __init__(self, fetch:Callable[[], Awaitable], key:str="id",
+                 keyframe_interval:int=BROADCAST_KEYFRAME_INTERVAL, **kwargs) -> None:
+        super().__init__(fetch, **kwargs)
+        self.key = key
+        self.keyframe_interval = keyframe_interval
+        self.items = None       # key -> object of the last fetch, None until a keyframe is due
+        self.sequence = 0
+        self.stats["keyframes"] = 0
+
+    async def refresh(self) -> None:
+        '''Fetches the topic and publishes its changes, or a keyframe'''
+        try:
+            data = await self.fetch()
+            items = {item[self.key]: item for item in data} if isinstance(data, list) else None
+        except Exception as exc:
+            logging.warning(f"broadcast fetch failed: {exc!r}")
+            return
+        if items is None:
+            self.items = None
+            self.publish(orjson.dumps(data))
+            return
+        self.sequence += 1
+        sequence = self.sequence
+        # only serialized when due, or when a subscriber needs to resync
+        keyframe = lambda: orjson.dumps({"type": "key", "seq": sequence, "items": data})
+        if self.items is None or self.sequence % self.keyframe_interval == 0:
+            self.stats["keyframes"] += 1
+            self.items = items
+            self.publish(keyframe())
+            return
+        frame = orjson.dumps({"type": "delta", "seq": self.sequence, **self.diff(self.items, items)})
+        self.items = items
+        self.publish(frame, keyframe)
+
+    def diff(self, old:Dict[object, dict], new:Dict[object, dict]) -> dict:
+        '''Returns the objects added, the keys removed and the fields changed from old to new'''
+        changed = []
+        for key, item in new.items():
+            previous = old.get(key)
+            if previous is None or previous == item:
+                continue
+            fields = {field: value for field, value in item.items() if field not in previous or previous[field] != value}
+            fields.update((field, None) for field in previous if field not in item)
+            changed.append({self.key: key, **fields})
+        return {
+            "added": [item for key, item in new.items() if key not in old],
+            "removed": [key for key in old if key not in new],
+            "changed": changed,
+        }
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
@@ -0,0 +1,229 @@
+import orjson
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+from fastbtc.diskcache import DiskCache
+
+
+CACHE_MAX_BYTES = 64 * 2**20            # memory budget of content addressed results
+CACHE_TIP_MAX_BYTES = 8 * 2**20         # memory budget of results scoped to the chain tip
+CACHE_CONFIRMATIONS = 6                 # blocks with fewer confirmations are only cached until the tip changes
+CACHE_TIP_INTERVAL = 1.0                # seconds between getbestblockhash checks of the tip
+
+# results that never change for the same params
+IMMUTABLE_METHODS = frozenset({"getblock", "getblockheader", "getrawtransaction", "decodescript"})
+# immutable results addressed by a hash, worth keeping across restarts
+DISK_METHODS = frozenset({"getblock", "getblockheader", "getrawtransaction"})
+# results that only change when a block is connected or disconnected
+TIP_METHODS = frozenset({"getblockcount", "getblockchaininfo", "getdifficulty", "getmininginfo", "getblockhash"})
+
+
+def estimate_size(value:Any) -> int:
+    '''Returns the approximate number of bytes held by an RPC result'''
+    if isinstance(value, (dict, list)):
+        return len(orjson.dumps(value))
+    if isinstance(value, str):
+        return len(value)
+    return 32
+
+
+class LRUCache:
+    '''Least recently used mapping bounded by the estimated size of its values'''
+    def __init__(self, max_bytes:int) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.evictions = 0
+        self.entries = OrderedDict()    # key -> (value, size)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key:Hashable) -> bool:
+        return key in self.entries
+
+    def get(self, key:Hashable, default:Any=None) -> Any:
+        '''Returns the value for key and marks it as most recently used'''
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key:Hashable, value:Any, size:int) -> None:
+        '''Stores value under key, evicting least recently used entries beyond the budget'''
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self.entries[key] = (value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.nbytes -= evicted
+            self.evictions += 1
+
+    def pop(self, key:Hashable) -> Any:
+        '''Removes key and returns its value'''
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        self.nbytes -= entry[1]
+        return entry[0]
+
+    def clear(self) -> None:
+        '''Removes all entries'''
+        self.entries.clear()
+        self.nbytes = 0
+
+
+class ResponseCache:
+    '''
+        Two tier cache of RPC results.
+        Content addressed results (blocks and headers by hash, transactions by txid and blockhash, scripts)
+        are kept in a size bounded LRU. Results depending on the chain tip are kept until the best block changes.
+        With a DiskCache, immutable blocks, headers and transactions are also written to disk and read back
+        on a miss, so they outlive the process.
+    '''
+    def __init__(self, max_bytes:int=CACHE_MAX_BYTES, tip_max_bytes:int=CACHE_TIP_MAX_BYTES,
+                 confirmations:int=CACHE_CONFIRMATIONS, tip_interval:float=CACHE_TIP_INTERVAL,
+                 disk:DiskCache=None) -> None:
+        self.immutable = LRUCache(max_bytes)
+        self.disk = disk
+        self.tip = LRUCache(tip_max_bytes)
+        self.confirmations = confirmations
+        self.tip_interval = tip_interval    # seconds between tip checks, 0 to always check
+        self.tip_checked = float('-inf')    # loop time of the last tip check
+        self.tip_hash = None
+        self.height = None
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(method:str, params:list) -> Tuple[str, bytes]:
+        '''Returns the cache key of the given call'''
+        return (method, orjson.dumps(params if params else []))
+
+    @staticmethod
+    def raw_key(method:str, params:list) -> Tuple[str, bytes, str]:
+        '''Returns the cache key of the undecoded JSON of a call'''
+        return (method, orjson.dumps(params if params else []), "raw")
+
+    @staticmethod
+    def disk_key(key:Tuple[str, bytes]) -> bytes:
+        '''Returns the key of a call in the disk cache'''
+        return key[0].encode() + b" " + key[1]
+
+    def cacheable(self, method:str, params:list) -> bool:
+        '''Returns whether results of the given call may be cached'''
+        if method == "getrawtransaction":
+            # only lookups by blockhash are content addressed
+            return params is not None and len(params) > 2 and params[2] is not None
+        return method in IMMUTABLE_METHODS or method in TIP_METHODS
+
+    def is_immutable(self, method:str, params:list, result:Any=None) -> bool:
+        '''Returns whether the result of the given call stays valid across tip changes'''
+        if method == "getblockhash":
+            return self.height is not None and params[0] <= self.height - self.confirmations
+        if method not in IMMUTABLE_METHODS:
+            return False
+        if isinstance(result, dict) and result.get("confirmations", self.confirmations) < self.confirmations:
+            # recent blocks may still be reorganized or gain a nextblockhash
+            return False
+        return True
+
+    def get(self, method:str, params:list) -> Tuple[bool, Any]:
+        '''Returns (hit, result) for the given call'''
+        key = self.key(method, params)
+        entry = self.immutable.get(key)
+        if entry is None:
+            entry = self.tip.get(key)
+        if entry is None:
+            result = self.lookup_raw(method, params)
+            if result is not None:
+                entry = (orjson.loads(result), self.height)
+        if entry is None and self.disk is not None and method in DISK_METHODS:
+            hit, result, height = self.disk.get(self.disk_key(key))
+            if hit:
+                entry = (result, height)
+                self.immutable.put(key, entry, estimate_size(result))
+        if entry is None:
+            self.stats["misses"] += 1
+            return False, None
+        self.stats["hits"] += 1
+        result, height = entry
+        if isinstance(result, dict) and "confirmations" in result and height != self.height \
+                and height is not None and self.height is not None:
+            result = {**result, "confirmations": result["confirmations"] + self.height - height}
+        return True, result
+
+    def lookup_raw(self, method:str, params:list) -> Optional[bytes]:
+        key = self.raw_key(method, params)
+        result = self.immutable.get(key)
+        return result if result is not None else self.tip.get(key)
+
+    def get_raw(self, method:str, params:list) -> Optional[bytes]:
+        '''Returns the undecoded JSON stored by put_raw for the given call, None if there is none'''
+        result = self.lookup_raw(method, params)
+        if result is not None:
+            self.stats["hits"] += 1
+        return result
+
+    def put_raw(self, method:str, params:list, result:bytes, tip_hash:Optional[str]=None) -> None:
+        '''Stores the undecoded JSON of a successful result as is, sized by its length. Only a JSON string is known
+        to be immutable without decoding it, objects may carry confirmations and are kept until the tip changes.'''
+        immutable = result[:1] == b'"' and self.is_immutable(method, params)
+        if not immutable and tip_hash != self.tip_hash:
+            return
+        tier = self.immutable if immutable else self.tip
+        tier.put(self.raw_key(method, params), bytes(result), len(result))
+
+    def put(self, method:str, params:list, result:Any, tip_hash:Optional[str]=None) -> None:
+        '''Stores the successful result of the given call in its tier.
+        tip_hash is the best block when the call was made, tip scoped results are dropped if it changed since.'''
+        immutable = self.is_immutable(method, params, result)
+        stale = tip_hash != self.tip_hash
+        self.observe(method, result)
+        if not immutable and stale:
+            return
+        tier = self.immutable if immutable else self.tip
+        key = self.key(method, params)
+        tier.put(key, (result, self.height), estimate_size(result))
+        if immutable and self.disk is not None and method in DISK_METHODS:
+            self.disk.put(self.disk_key(key), result, self.height)
+
+    def observe(self, method:str, result:Any) -> None:
+        '''Keeps the known tip height up to date from results that carry it'''
+        if method == "getblockcount" and isinstance(result, int):
+            self.height = result
+        elif method == "getblockchaininfo" and isinstance(result, dict):
+            self.set_tip(result.get("bestblockhash"), result.get("blocks"))
+
+    def set_tip(self, blockhash:Optional[str], height:Optional[int]=None) -> None:
+        '''Records the best block, invalidating tip scoped results when it changed'''
+        if blockhash is None:
+            return
+        if blockhash != self.tip_hash:
+            self.tip.clear()
+            self.tip_hash = blockhash
+        if height is not None:
+            self.height = height
+
+    def warm(self) -> int:
+        '''Loads the results written to disk last into the LRU, up to its budget. Returns the number loaded.'''
+        loaded = 0
+        if self.disk is None:
+            return loaded
+        for key, result, height in self.disk.recent():
+            size = estimate_size(result)
+            if self.immutable.nbytes + size > self.immutable.max_bytes:
+                break
+            method, _, params = key.partition(b" ")
+            self.immutable.put((method.decode(), params), (result, height), size)
+            loaded += 1
+        return loaded
+
+    def clear(self) -> None:
+        '''Removes all cached results'''
+        self.immutable.clear()
+        self.tip.clear()
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
@@ -0,0 +1,129 @@
+import math
+import orjson
+import asyncio
+from typing import Optional
+from fastbtc.lanes import Lanes
+from fastbtc.metrics import Metrics
+
+
+DEADLINE_HEADER = b"x-request-timeout"  # seconds the client is willing to wait, overrides the route's timeout
+DEADLINE_MAX = 3600.0                   # longest timeout a client may ask for
+ROUTE_TIMEOUT = 30.0                    # seconds a route may take unless listed below
+
+# path prefix -> seconds allowed to the routes calling slow methods, None for no deadline
+ROUTE_TIMEOUTS = {
+    "/rpc/verifychain": 600.0,
+    "/rpc/getblockstats": 120.0,
+    "/rpc/getchaintxstats": 120.0,
+    "/rpc/getblock/": 60.0,
+    "/rpc/bulk/": None,                 # streamed, each call is bounded by its own timeout instead
+}
+
+
+def route_timeout(scope:dict) -> Optional[float]:
+    '''Returns the seconds an HTTP request may take, from its X-Request-Timeout header or its path'''
+    for name, value in scope.get("headers", ()):
+        if name == DEADLINE_HEADER:
+            try:
+                timeout = float(value)
+            except ValueError:
+                break
+            if timeout > 0 and not math.isnan(timeout):
+                return min(timeout, DEADLINE_MAX)
+            break
+    for prefix, timeout in ROUTE_TIMEOUTS.items():
+        if scope["path"].startswith(prefix):
+            return timeout
+    return ROUTE_TIMEOUT
+
+
+class Deadlines:
+    '''
+        ASGI middleware giving each HTTP request a deadline, which bounds the calls its handler makes to the node
+        (see lanes.DEADLINE). A handler still running when the deadline passes is cancelled and answered with a 504,
+        one whose client disconnects is cancelled right away, which abandons its requests in flight to the node.
+        A response already streaming when the deadline passes is left to finish.
+    '''
+    def __init__(self, app, metrics:Metrics=None) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.stats = {"cancelled": 0, "timeouts": 0}
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timeout = route_timeout(scope)
+        messages = asyncio.Queue()
+        started = finished = False
+
+        async def send_state(message:dict) -> None:
+            nonlocal started, finished
+            if message["type"] == "http.response.start":
+                started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished = True
+            await send(message)
+
+        async def listen() -> None:
+            # the handler reads the request body from the queue while the listener waits for a disconnect
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        with Lanes.options(timeout=timeout):
+            handler = asyncio.ensure_future(self.app(scope, messages.get, send_state))
+        listener = asyncio.ensure_future(listen())
+        try:
+            done, _ = await asyncio.wait({handler, listener}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if handler not in done and (started and listener not in done or finished):
+                # streaming past the deadline, or sent and about to return
+                done, _ = await asyncio.wait({handler, listener}, return_when=asyncio.FIRST_COMPLETED)
+            if handler in done or finished:
+                try:
+                    return await handler
+                except asyncio.TimeoutError:
+                    if started:
+                        raise
+                    await self.timed_out(scope, send, timeout)
+            elif listener in done:
+                await self.abandon(handler)
+                self.count(scope, "cancelled")
+            else:
+                await self.abandon(handler)
+                await self.timed_out(scope, send, timeout)
+        finally:
+            listener.cancel()
+            if not handler.done():
+                handler.cancel()
+
+    @staticmethod
+    async def abandon(task:asyncio.Task) -> None:
+        '''Cancels task and waits for it to unwind'''
+        task.cancel()
+        await asyncio.wait({task})
+        if not task.cancelled():
+            # retrieved, it is of no use once the request was abandoned
+            task.exception()
+
+    async def timed_out(self, scope:dict, send, timeout:float) -> None:
+        '''Answers a request whose deadline passed with a 504'''
+        self.count(scope, "timeouts")
+        body = orjson.dumps({"detail": f"Deadline of {timeout:g} seconds exceeded"})
+        await send({
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    def count(self, scope:dict, outcome:str) -> None:
+        self.stats[outcome] += 1
+        if self.metrics is not None:
+            metrics = self.metrics.route(getattr(scope.get("route"), "path", "unmatched"))
+            setattr(metrics, outcome, getattr(metrics, outcome) + 1)
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
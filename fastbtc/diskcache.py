@@ -0,0 +1,228 @@
+import os
+import mmap
+import time
+import zlib
+import fcntl
+import struct
+import orjson
+import logging
+from typing import Any, Iterator, Optional, Tuple
+
+
+CACHE_DIR = os.getenv("FASTBTC_CACHE_DIR")      # directory of the persistent response cache, disabled if unset
+DISK_CACHE_MAX_BYTES = 2**30            # log files kept before the oldest one is evicted
+DISK_CACHE_SEGMENT_BYTES = 64 * 2**20   # size at which a log file is sealed and a new one started
+DISK_CACHE_LEVEL = 3                    # zlib compression level of the results
+DISK_CACHE_REFRESH = 1.0                # seconds between scans of the logs written by another process, on a miss
+
+# record header: crc32 of key and payload, payload length, key length, tip height when cached (-1 if unknown)
+RECORD = struct.Struct("<IIHi")
+# index entry of a sealed log: payload offset, payload length, key length, height, followed by the key
+ENTRY = struct.Struct("<QIHi")
+
+
+class DiskCache:
+    '''
+        Persistent cache of content addressed RPC results, shared by the processes serving the same directory.
+            <sequence>.log   append-only records: header, key (method and JSON params), zlib compressed JSON result
+            <sequence>.idx   keys and payload offsets of a sealed log, so opening it doesn't read the payloads
+            lock             held by the one process writing, the others only read
+        Logs are memory-mapped for reads, the oldest is deleted once all of them exceed max_bytes.
+        A torn record at the end of a log, left by a crash, ends it and is overwritten by the writer.
+    '''
+    def __init__(self, path:str, max_bytes:int=DISK_CACHE_MAX_BYTES, segment_bytes:int=DISK_CACHE_SEGMENT_BYTES) -> None:
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.index = {}                 # key -> (sequence, payload offset, payload length, height)
+        self.scanned = {}               # sequence -> bytes of its log indexed
+        self.maps = {}                  # sequence -> mmap of its log
+        self.log = None                 # file appended to, None when read-only
+        self.sequence = None            # sequence of the log appended to
+        self.refreshed = float('-inf')
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self.lock = open(os.path.join(path, "lock"), "a+b")
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.readonly = False
+        except BlockingIOError:
+            # another process writes, this one follows its logs
+            self.readonly = True
+        self.refresh()
+        if not self.readonly:
+            sequences = self.sequences()
+            sequence = sequences[-1] if sequences else 0
+            self.open(sequence)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def nbytes(self) -> int:
+        '''Bytes of the logs'''
+        return sum(self.scanned.values())
+
+    def log_path(self, sequence:int) -> str:
+        return os.path.join(self.path, f"{sequence:08d}.log")
+
+    def idx_path(self, sequence:int) -> str:
+        return os.path.join(self.path, f"{sequence:08d}.idx")
+
+    def sequences(self) -> list:
+        return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith(".log"))
+
+    ######## INDEX ########
+    def refresh(self) -> None:
+        '''Indexes the logs written since the last refresh and forgets the evicted ones'''
+        self.refreshed = time.monotonic()
+        sequences = self.sequences()
+        for sequence in set(self.scanned) - set(sequences):
+            self.forget(sequence)
+        for sequence in sequences:
+            if sequence not in self.scanned and os.path.exists(self.idx_path(sequence)):
+                self.load(sequence)
+            else:
+                self.scan(sequence)
+
+    def load(self, sequence:int) -> None:
+        '''Indexes a sealed log from its index file'''
+        with open(self.idx_path(sequence), "rb") as file:
+            data = file.read()
+        position = 0
+        while position < len(data):
+            offset, length, keylength, height = ENTRY.unpack_from(data, position)
+            position += ENTRY.size
+            self.index[data[position:position + keylength]] = (sequence, offset, length, height)
+            position += keylength
+        self.scanned[sequence] = os.path.getsize(self.log_path(sequence))
+
+    def scan(self, sequence:int) -> None:
+        '''Indexes the records appended to a log since it was last scanned, up to a torn one'''
+        position = self.scanned.get(sequence, 0)
+        try:
+            size = os.path.getsize(self.log_path(sequence))
+        except FileNotFoundError:
+            return
+        if size <= position:
+            return
+        data = self.map(sequence, size)
+        while position + RECORD.size <= size:
+            crc, length, keylength, height = RECORD.unpack_from(data, position)
+            start = position + RECORD.size
+            end = start + keylength + length
+            if end > size or zlib.crc32(data[start:end]) != crc:
+                break
+            self.index[bytes(data[start:start + keylength])] = (sequence, start + keylength, length, height)
+            position = end
+        self.scanned[sequence] = position
+
+    def forget(self, sequence:int) -> None:
+        '''Drops the entries of an evicted log'''
+        self.index = {key: entry for key, entry in self.index.items() if entry[0] != sequence}
+        self.scanned.pop(sequence, None)
+        mapped = self.maps.pop(sequence, None)
+        if mapped is not None:
+            mapped.close()
+
+    def map(self, sequence:int, size:int) -> mmap.mmap:
+        '''Returns a read-only map of a log covering at least size bytes'''
+        mapped = self.maps.get(sequence)
+        if mapped is None or len(mapped) < size:
+            if mapped is not None:
+                mapped.close()
+            with open(self.log_path(sequence), "rb") as file:
+                mapped = self.maps[sequence] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    ######## READS ########
+    def get(self, key:bytes) -> Tuple[bool, Any, Optional[int]]:
+        '''Returns (hit, result, tip height when it was cached) for key'''
+        entry = self.index.get(key)
+        if entry is None and self.readonly and time.monotonic() - self.refreshed >= DISK_CACHE_REFRESH:
+            self.refresh()
+            entry = self.index.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return False, None, None
+        try:
+            result = self.read(entry)
+        except FileNotFoundError:
+            # evicted by the writer since the last refresh
+            self.forget(entry[0])
+            self.stats["misses"] += 1
+            return False, None, None
+        self.stats["hits"] += 1
+        return True, result, entry[3] if entry[3] >= 0 else None
+
+    def read(self, entry:Tuple[int, int, int, int]) -> Any:
+        sequence, offset, length, _ = entry
+        data = self.map(sequence, offset + length)
+        return orjson.loads(zlib.decompress(data[offset:offset + length]))
+
+    def recent(self) -> Iterator[Tuple[bytes, Any, Optional[int]]]:
+        '''Yields (key, result, height) of every entry, most recently written first'''
+        entries = sorted(self.index.items(), key=lambda item: item[1][:2], reverse=True)
+        for key, entry in entries:
+            yield key, self.read(entry), entry[3] if entry[3] >= 0 else None
+
+    ######## WRITES ########
+    def open(self, sequence:int) -> None:
+        '''Appends to the log with the given sequence, cutting a torn record off its end'''
+        self.scanned[sequence] = self.scanned.get(sequence, 0)
+        self.log = open(self.log_path(sequence), "ab")
+        self.log.truncate(self.scanned[sequence])
+        self.sequence = sequence
+
+    def put(self, key:bytes, result:Any, height:Optional[int]=None) -> None:
+        '''Appends a result unless key is cached already or the cache is read-only'''
+        if self.readonly or key in self.index:
+            return
+        payload = zlib.compress(orjson.dumps(result), DISK_CACHE_LEVEL)
+        height = -1 if height is None else height
+        record = RECORD.pack(zlib.crc32(key + payload), len(payload), len(key), height) + key + payload
+        position = self.scanned[self.sequence]
+        self.log.write(record)
+        self.log.flush()
+        self.index[key] = (self.sequence, position + RECORD.size + len(key), len(payload), height)
+        self.scanned[self.sequence] = position + len(record)
+        self.stats["writes"] += 1
+        if self.scanned[self.sequence] >= self.segment_bytes:
+            self.seal()
+        while self.nbytes > self.max_bytes and len(self.scanned) > 1:
+            self.evict()
+
+    def seal(self) -> None:
+        '''Writes the index file of the current log and starts the next one'''
+        entries = [(key, entry) for key, entry in self.index.items() if entry[0] == self.sequence]
+        data = b"".join(ENTRY.pack(offset, length, len(key), height) + key for key, (_, offset, length, height) in entries)
+        path = self.idx_path(self.sequence)
+        with open(path + ".tmp", "wb") as file:
+            file.write(data)
+        os.replace(path + ".tmp", path)
+        self.log.close()
+        self.open(self.sequence + 1)
+
+    def evict(self) -> None:
+        '''Deletes the oldest log'''
+        oldest = min(self.scanned)
+        logging.debug(f"disk cache evicting log {oldest}")
+        if os.path.exists(self.idx_path(oldest)):
+            os.remove(self.idx_path(oldest))
+        os.remove(self.log_path(oldest))
+        self.forget(oldest)
+        self.stats["evictions"] += 1
+
+    def close(self) -> None:
+        '''Closes the logs and releases the writer lock'''
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        for mapped in self.maps.values():
+            mapped.close()
+        self.maps = {}
+        self.lock.close()
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
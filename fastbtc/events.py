@@ -0,0 +1,48 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, AsyncIterator, Optional, Tuple
+
+
+EVENT_QUEUE_SIZE = 256                  # events buffered per subscriber before the oldest is dropped
+
+
+class EventBus:
+    '''Fans out published events to the subscribers of each topic'''
+    def __init__(self, maxsize:int=EVENT_QUEUE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.subscribers = defaultdict(set)     # topic -> subscriber queues
+        self.dropped = 0
+
+    def subscribe(self, *topics:str, maxsize:Optional[int]=None) -> asyncio.Queue:
+        '''Returns a queue receiving (topic, event) for every event published on the given topics.
+        maxsize overrides the bus default, 0 for subscribers that can't afford to lose events.'''
+        queue = asyncio.Queue(self.maxsize if maxsize is None else maxsize)
+        for topic in topics:
+            self.subscribers[topic].add(queue)
+        return queue
+
+    def unsubscribe(self, queue:asyncio.Queue, *topics:str) -> None:
+        '''Stops delivering events of the given topics to queue'''
+        for topic in topics:
+            self.subscribers[topic].discard(queue)
+
+    def publish(self, topic:str, event:Any) -> None:
+        '''Delivers event to the subscribers of topic, a subscriber that fell behind loses its oldest event'''
+        for queue in self.subscribers.get(topic, ()):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait((topic, event))
+
+    async def listen(self, *topics:str) -> AsyncIterator[Tuple[str, Any]]:
+        '''Yields (topic, event) for the events published on the given topics'''
+        queue = self.subscribe(*topics)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.unsubscribe(queue, *topics)
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
@@ -0,0 +1,298 @@
+import os
+import mmap
+import array
+import asyncio
+import bisect
+import struct
+import logging
+from typing import List, Optional, Union
+from fastbtc.block import BlockHeader, HEADER_SIZE, sha256d
+
+
+HEADERS_DIR = os.getenv("FASTBTC_HEADERS_DIR")    # directory of the local header store, disabled if unset
+HEADERS_CONFIRMATIONS = 6               # heights closer to the tip are still asked to the node
+HEADERS_SYNC_BATCH = 2000               # headers fetched per pair of JSON-RPC batches
+HEADERS_RETRY = 5.0                     # seconds before retrying a failed sync
+HEADERS_MERGE = 10_000                  # recent hashes kept in a dict before merging into the sorted index
+HASH_SIZE = 32
+
+
+class HeaderStore:
+    '''
+        Local, append only store of the best chain's block headers.
+            headers.dat  80 byte headers indexed by height, memory-mapped
+            hashes.dat   32 byte block hashes indexed by height, memory-mapped
+            index.dat    sorted 8 byte hash prefixes and their heights, rebuilt if out of date
+        Lookups by hash bisect the sorted prefixes and verify the full hash, so the whole mainnet
+        chain takes about 12 bytes of memory per block on top of the mapped files.
+    '''
+    def __init__(self, path:str) -> None:
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.headers_file = self.open("headers.dat")
+        self.hashes_file = self.open("hashes.dat")
+        self.headers = None             # mmap of headers.dat
+        self.hashes = None              # mmap of hashes.dat
+        self.count = 0                  # complete headers in both files
+        self.prefixes = array.array('Q')
+        self.heights = array.array('I')
+        self.recent = {}                # hash prefix -> height, not merged into the sorted index yet
+        # a write cut short by a crash is ignored here and trimmed by the next sync, the writer may be appending
+        self.remap()
+        self.load_index()
+
+    def open(self, name:str):
+        path = os.path.join(self.path, name)
+        return open(path, "r+b" if os.path.exists(path) else "w+b")
+
+    @staticmethod
+    def size(file) -> int:
+        return os.fstat(file.fileno()).st_size
+
+    @property
+    def height(self) -> int:
+        '''Height of the stored tip, -1 when empty'''
+        return self.count - 1
+
+    def __len__(self) -> int:
+        return self.height + 1
+
+    def remap(self) -> None:
+        '''Maps the files again after they changed size'''
+        for mapped in (self.headers, self.hashes):
+            if mapped is not None:
+                mapped.close()
+        self.headers = self.hashes = None
+        self.count = min(self.size(self.headers_file) // HEADER_SIZE, self.size(self.hashes_file) // HASH_SIZE)
+        if self.count:
+            self.headers = mmap.mmap(self.headers_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.hashes = mmap.mmap(self.hashes_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def truncate(self, count:int) -> None:
+        '''Keeps the first count headers'''
+        for mapped in (self.headers, self.hashes):
+            if mapped is not None:
+                mapped.close()
+        self.headers = self.hashes = None
+        self.headers_file.truncate(count * HEADER_SIZE)
+        self.hashes_file.truncate(count * HASH_SIZE)
+        self.recent = {prefix: height for prefix, height in self.recent.items() if height < count}
+        self.remap()
+
+    def reload(self) -> None:
+        '''Maps the headers another process appended or rolled back since the last reload. The last
+        HEADERS_CONFIRMATIONS are indexed again, they may have been replaced by a reorg.'''
+        count = self.count
+        self.remap()
+        self.recent = {prefix: height for prefix, height in self.recent.items() if height < self.count}
+        for height in range(max(min(count, self.count) - HEADERS_CONFIRMATIONS, 0), self.count):
+            self.recent[struct.unpack_from('<Q', self.hashes, height * HASH_SIZE)[0]] = height
+        if len(self.recent) > HEADERS_MERGE:
+            self.merge_index()
+
+    ######## INDEX ########
+    def load_index(self) -> None:
+        '''Loads the sorted hash index from disk, rebuilding it when it doesn't cover the stored headers'''
+        path = os.path.join(self.path, "index.dat")
+        if os.path.exists(path):
+            with open(path, "rb") as index:
+                count = struct.unpack('<Q', index.read(8))[0]
+                if count == len(self):
+                    self.prefixes.frombytes(index.read(8 * count))
+                    self.heights.frombytes(index.read(4 * count))
+                    return
+        self.rebuild_index()
+
+    def rebuild_index(self) -> None:
+        '''Sorts the prefixes of every stored hash'''
+        pairs = sorted(
+            (prefix, height)
+            for height, (prefix,) in enumerate(struct.iter_unpack('<Q24x', self.hashes or b''))
+        )
+        self.prefixes = array.array('Q', (prefix for prefix, _ in pairs))
+        self.heights = array.array('I', (height for _, height in pairs))
+        self.recent = {}
+
+    def merge_index(self) -> None:
+        '''Merges recent hashes into the sorted index, dropping entries no longer in the chain'''
+        pairs = sorted(
+            [(prefix, height) for prefix, height in zip(self.prefixes, self.heights) if self.valid(prefix, height)]
+            + list(self.recent.items())
+        )
+        self.prefixes = array.array('Q', (prefix for prefix, _ in pairs))
+        self.heights = array.array('I', (height for _, height in pairs))
+        self.recent = {}
+
+    def save_index(self) -> None:
+        '''Writes the sorted index so the next start doesn't rebuild it'''
+        self.merge_index()
+        path = os.path.join(self.path, "index.dat")
+        with open(path + ".tmp", "wb") as index:
+            index.write(struct.pack('<Q', len(self.prefixes)))
+            index.write(self.prefixes.tobytes())
+            index.write(self.heights.tobytes())
+        os.replace(path + ".tmp", path)
+
+    def valid(self, prefix:int, height:int) -> bool:
+        '''Returns whether the stored hash at height still has the given prefix'''
+        return height <= self.height and struct.unpack_from('<Q', self.hashes, height * HASH_SIZE)[0] == prefix
+
+    ######## LOOKUPS ########
+    def hash_at(self, height:int) -> Optional[bytes]:
+        '''Returns the hash in internal byte order at height'''
+        if height < 0 or height > self.height:
+            return None
+        return self.hashes[height * HASH_SIZE:(height + 1) * HASH_SIZE]
+
+    def header_at(self, height:int) -> Optional[BlockHeader]:
+        '''Returns the header at height'''
+        if height < 0 or height > self.height:
+            return None
+        return BlockHeader(self.headers[height * HEADER_SIZE:(height + 1) * HEADER_SIZE])
+
+    def height_of(self, blockhash:str) -> Optional[int]:
+        '''Returns the height of the block with the given hash if it is in the stored chain'''
+        try:
+            digest = bytes.fromhex(blockhash)[::-1]
+        except ValueError:
+            return None
+        if len(digest) != HASH_SIZE:
+            return None
+        prefix = struct.unpack_from('<Q', digest)[0]
+        height = self.recent.get(prefix)
+        if height is not None and self.hash_at(height) == digest:
+            return height
+        i = bisect.bisect_left(self.prefixes, prefix)
+        while i < len(self.prefixes) and self.prefixes[i] == prefix:
+            height = self.heights[i]
+            if self.hash_at(height) == digest:
+                return height
+            i += 1
+        return None
+
+    def blockhash(self, height:int) -> Optional[str]:
+        '''Returns the hash of the block at height, as getblockhash does'''
+        digest = self.hash_at(height)
+        return digest[::-1].hex() if digest is not None else None
+
+    def blockheader(self, blockhash:str) -> Optional[str]:
+        '''Returns the serialized header of the block with the given hash, as getblockheader does when not verbose'''
+        height = self.height_of(blockhash)
+        return self.headers[height * HEADER_SIZE:(height + 1) * HEADER_SIZE].hex() if height is not None else None
+
+    ######## UPDATES ########
+    def extend(self, headers:List[Union[bytes, str]]) -> int:
+        '''Appends headers following the stored tip, stopping at the first that doesn't link to it.
+        Returns the number of headers appended.'''
+        tip = self.hash_at(self.height)
+        raw_headers, hashes = [], []
+        for header in headers:
+            raw = bytes.fromhex(header) if isinstance(header, str) else bytes(header)
+            if len(raw) != HEADER_SIZE or (tip is not None and raw[4:36] != tip):
+                break
+            tip = sha256d(raw)
+            raw_headers.append(raw)
+            hashes.append(tip)
+        if not raw_headers:
+            return 0
+        height = self.height
+        self.headers_file.seek(0, os.SEEK_END)
+        self.headers_file.write(b"".join(raw_headers))
+        self.headers_file.flush()
+        self.hashes_file.seek(0, os.SEEK_END)
+        self.hashes_file.write(b"".join(hashes))
+        self.hashes_file.flush()
+        for offset, digest in enumerate(hashes, start=height + 1):
+            self.recent[struct.unpack_from('<Q', digest)[0]] = offset
+        self.remap()
+        if len(self.recent) > HEADERS_MERGE:
+            self.merge_index()
+        return len(raw_headers)
+
+    async def fork_height(self, rpc) -> int:
+        '''Returns the highest stored height that is still in the node's best chain'''
+        tip = self.blockhash(self.height)
+        if tip is None:
+            return -1
+        # asked without the cache or the store itself, whose answers are what is being checked
+        chaintips = await rpc.call("getchaintips", use_cache=False)
+        for chaintip in chaintips if isinstance(chaintips, list) else []:
+            if chaintip.get('hash') == tip and chaintip.get('status') != 'active':
+                # the stored tip is on a branch that is no longer active
+                return chaintip['height'] - chaintip['branchlen']
+        if await rpc.call("getblockhash", [self.height], use_cache=False) == tip:
+            return self.height
+        # the stored chain ends inside a stale branch, bisect to the last common block
+        low, high = -1, self.height
+        while high - low > 1:
+            middle = (low + high) // 2
+            if await rpc.call("getblockhash", [middle], use_cache=False) == self.blockhash(middle):
+                low = middle
+            else:
+                high = middle
+        return low
+
+    async def sync(self, rpc, batch:int=HEADERS_SYNC_BATCH) -> int:
+        '''Rolls back headers no longer in the node's best chain and appends new ones.
+        Returns the number of headers appended.'''
+        if (self.size(self.headers_file), self.size(self.hashes_file)) != (self.count * HEADER_SIZE, self.count * HASH_SIZE):
+            # cut short by a crash while appending
+            self.truncate(self.count)
+        async with rpc.pinned():
+            fork = await self.fork_height(rpc)
+            if fork < self.height:
+                logging.info(f"header store rolling back from {self.height} to {fork}")
+                self.truncate(fork + 1)
+            appended = 0
+            tip = await rpc.call("getblockcount", use_cache=False)
+            while isinstance(tip, int) and self.height < tip:
+                heights = range(self.height + 1, min(tip, self.height + batch) + 1)
+                hashes = await rpc.call_many([("getblockhash", [height]) for height in heights])
+                hashes = [blockhash for blockhash in hashes if isinstance(blockhash, str)]
+                headers = await rpc.call_many([("getblockheader", [blockhash, False]) for blockhash in hashes])
+                added = self.extend([header for header in headers if isinstance(header, str)])
+                appended += added
+                if added < len(heights):
+                    # the chain changed while syncing
+                    fork = await self.fork_height(rpc)
+                    if fork == self.height and added == 0:
+                        break
+                    self.truncate(fork + 1)
+                    tip = await rpc.call("getblockcount", use_cache=False)
+            return appended
+
+    async def follow(self, rpc, bus) -> None:
+        '''Syncs now and whenever a block notification is received, a failed sync is retried every HEADERS_RETRY'''
+        queue = bus.subscribe("hashblock", "gap")
+        try:
+            while True:
+                timeout = None
+                try:
+                    await self.sync(rpc)
+                except Exception as exc:
+                    logging.warning(f"header sync failed: {exc!r}")
+                    timeout = HEADERS_RETRY
+                try:
+                    await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                # one sync catches up with every block notified meanwhile
+                while not queue.empty():
+                    queue.get_nowait()
+        finally:
+            bus.unsubscribe(queue, "hashblock", "gap")
+
+    def close(self) -> None:
+        '''Saves the index and closes the files'''
+        if self.headers_file.closed:
+            return
+        self.save_index()
+        for mapped in (self.headers, self.hashes):
+            if mapped is not None:
+                mapped.close()
+        self.headers_file.close()
+        self.hashes_file.close()
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
@@ -0,0 +1,135 @@
+import re
+import gzip
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import Response
+from fastbtc.cache import LRUCache
+
+try:
+    import brotli
+except ImportError:     # brotli is optional, without it br is not offered
+    brotli = None
+try:
+    import zstandard
+except ImportError:     # zstandard is optional, without it zstd is not offered
+    zstandard = None
+
+
+HTTP_CACHE_MAX_BYTES = 128 * 2**20      # memory budget of the response bodies kept, all encodings together
+HTTP_COMPRESS_MIN_BYTES = 1024          # smaller bodies are sent as is
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"                 # may be stored, but has to be revalidated with its ETag before use
+HASH = re.compile("[0-9a-f]{64}")
+
+# content codings by preference, given the same quality
+ENCODINGS: Dict[str, Callable[[bytes], bytes]] = {}
+if zstandard is not None:
+    ENCODINGS["zstd"] = zstandard.ZstdCompressor(level=10).compress
+if brotli is not None:
+    ENCODINGS["br"] = lambda body: brotli.compress(body, quality=6)
+ENCODINGS["gzip"] = lambda body: gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def negotiate(accept:Optional[str]) -> Optional[str]:
+    '''Returns the preferred content coding allowed by an Accept-Encoding header, None for the identity'''
+    if not accept:
+        return None
+    qualities = {}
+    for item in accept.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    best, chosen = 0.0, None
+    for coding in ENCODINGS:
+        quality = qualities.get(coding, qualities.get("*", 0.0))
+        if quality > best:
+            best, chosen = quality, coding
+    return chosen
+
+
+def etag(*parts) -> Optional[str]:
+    '''Returns a strong ETag made of parts, None if the first one should be a hash and isn't'''
+    if not HASH.fullmatch(str(parts[0])):
+        return None
+    return '"' + ".".join(str(part) for part in parts) + '"'
+
+
+def variant(etag:str, encoding:Optional[str]) -> str:
+    '''Returns the ETag of an encoded variant, strong ETags have to differ between content codings'''
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def matches(header:Optional[str], etag:str) -> bool:
+    '''Returns whether an If-None-Match header matches any variant of etag'''
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return any(variant(etag, encoding) in tags for encoding in (None, *ENCODINGS))
+
+
+class HTTPCache:
+    '''
+        Validators and encoded bodies of responses whose content is addressed by a hash.
+        A request carrying a matching If-None-Match is answered with a 304 before anything is fetched, otherwise
+        the body is fetched once per ETag and kept with each content coding it was compressed to in a size
+        bounded LRU, so later hits are served without asking the node or compressing again.
+    '''
+    def __init__(self, max_bytes:int=HTTP_CACHE_MAX_BYTES, min_size:int=HTTP_COMPRESS_MIN_BYTES) -> None:
+        self.bodies = LRUCache(max_bytes)      # (etag, accepted encoding) -> (body, content coding applied)
+        self.min_size = min_size
+        self.stats = {"not_modified": 0, "hits": 0, "misses": 0, "compressed": 0}
+
+    async def respond(self, request:Request, etag:Optional[str], immutable:bool,
+                      fetch:Callable[[], Awaitable[Tuple[bool, bytes]]], media_type:str="application/json") -> Response:
+        '''Answers request with the body fetch returns along with whether it is a result, validated by etag if one
+        is given. Bodies of RPC errors are sent without validators and never kept.'''
+        encoding = negotiate(request.headers.get("accept-encoding"))
+        if etag is None:
+            _, body = await fetch()
+            body, coding = self.compress(bytes(body), encoding)
+            headers = {"Content-Encoding": coding, "Vary": "Accept-Encoding"} if coding else {}
+            return Response(body, media_type=media_type, headers=headers)
+        headers = {"ETag": etag, "Cache-Control": IMMUTABLE if immutable else REVALIDATE, "Vary": "Accept-Encoding"}
+        if matches(request.headers.get("if-none-match"), etag):
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        entry = self.bodies.get((etag, encoding))
+        if entry is None:
+            self.stats["misses"] += 1
+            identity = self.bodies.get((etag, None))
+            if identity is None:
+                ok, body = await fetch()
+                body = bytes(body)
+                if not ok:
+                    return Response(body, media_type=media_type)
+                identity = (body, None)
+                self.bodies.put((etag, None), identity, len(body))
+            entry = self.compress(identity[0], encoding)
+            self.bodies.put((etag, encoding), entry, len(entry[0]))
+        else:
+            self.stats["hits"] += 1
+        body, coding = entry
+        if coding:
+            headers["Content-Encoding"] = coding
+            headers["ETag"] = variant(etag, coding)
+        return Response(body, media_type=media_type, headers=headers)
+
+    def compress(self, body:bytes, encoding:Optional[str]) -> Tuple[bytes, Optional[str]]:
+        '''Returns body compressed to encoding and the coding applied, None if it isn't worth it'''
+        if not encoding or len(body) < self.min_size:
+            return body, None
+        self.stats["compressed"] += 1
+        return ENCODINGS[encoding](body), encoding
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
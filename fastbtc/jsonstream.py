@@ -0,0 +1,129 @@
+import re
+import orjson
+from typing import Any, List, Tuple
+
+
+# structural characters, when nested below the split container commas and colons don't matter
+TOKENS = re.compile(rb'["\[\]{},:]')
+NESTED_TOKENS = re.compile(rb'["\[\]{}]')
+STRING_END = re.compile(rb'["\\]')
+WHITESPACE = b" \t\r\n"
+
+
+class Frame:
+    '''Container being scanned'''
+    __slots__ = ("kind", "key", "expecting_key")
+
+    def __init__(self, kind:int) -> None:
+        self.kind = kind                        # ord('{') or ord('[')
+        self.key = None                         # key of the member being scanned, for objects
+        self.expecting_key = kind == ord('{')
+
+
+class JSONSplitter:
+    '''
+        Incrementally splits the JSON container found at path into its elements, so a huge document
+        can be decoded one element at a time from the chunks it is received in.
+        path holds the object keys leading from the root to the container, e.g. ("result", "tx").
+        Arrays yield their decoded items, objects yield (key, value) members.
+        Only the element being scanned is buffered once the container has been reached.
+    '''
+    def __init__(self, path:Tuple[str, ...]) -> None:
+        self.path = [key.encode() for key in path]
+        self.depth = len(path) + 1              # stack depth inside the container
+        self.buffer = bytearray()
+        self.pos = 0                            # next byte to scan
+        self.stack = []
+        self.in_string = False
+        self.key_start = None                   # start of a key being scanned above the container
+        self.element_start = None               # start of the element being scanned in the container
+        self.kind = None                        # kind of the container once found
+        self.found = False
+        self.done = False
+
+    def feed(self, data:bytes) -> List[Any]:
+        '''Scans data and returns the elements of the container completed by it'''
+        self.buffer += data
+        if self.done:
+            return []
+        buffer = self.buffer
+        stack = self.stack
+        elements = []
+        pos = self.pos
+        while True:
+            if self.in_string:
+                match = STRING_END.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                end = match.start()
+                if buffer[end] == 0x5c:         # backslash escapes the next byte
+                    if end + 1 >= len(buffer):
+                        pos = end
+                        break
+                    pos = end + 2
+                    continue
+                if self.key_start is not None:
+                    stack[-1].key = bytes(buffer[self.key_start:end])
+                    self.key_start = None
+                self.in_string = False
+                pos = end + 1
+                continue
+            tokens = NESTED_TOKENS if len(stack) > self.depth else TOKENS
+            match = tokens.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            char = buffer[match.start()]
+            pos = match.end()
+            if char == 0x22:                    # "
+                self.in_string = True
+                if stack and len(stack) < self.depth and stack[-1].expecting_key:
+                    self.key_start = pos
+            elif char == 0x7b or char == 0x5b:  # { [
+                stack.append(Frame(char))
+                if len(stack) == self.depth and [frame.key for frame in stack[:-1]] == self.path:
+                    self.found = True
+                    self.kind = char
+                    self.element_start = pos
+            elif char == 0x7d or char == 0x5d:  # } ]
+                if len(stack) == self.depth and self.element_start is not None:
+                    self.emit(elements, match.start())
+                    self.element_start = None
+                    self.done = True
+                    break
+                stack.pop()
+            elif char == 0x2c:                  # ,
+                if len(stack) == self.depth and self.element_start is not None:
+                    self.emit(elements, match.start())
+                    self.element_start = pos
+                if stack[-1].kind == 0x7b:
+                    stack[-1].expecting_key = True
+            elif char == 0x3a:                  # :
+                stack[-1].expecting_key = False
+        self.pos = pos
+        self.compact()
+        return elements
+
+    def emit(self, elements:List[Any], end:int) -> None:
+        '''Decodes the element between element_start and end'''
+        element = self.buffer[self.element_start:end]
+        if not element.strip(WHITESPACE):
+            return
+        if self.kind == 0x7b:
+            member = orjson.loads(b"{" + element + b"}")
+            elements.append(next(iter(member.items())))
+        else:
+            elements.append(orjson.loads(element))
+
+    def compact(self) -> None:
+        '''Drops the scanned bytes of elements already returned'''
+        if self.element_start is None or self.element_start == 0:
+            return
+        del self.buffer[:self.element_start]
+        self.pos -= self.element_start
+        self.element_start = 0
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
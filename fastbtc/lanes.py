@@ -0,0 +1,156 @@
+import heapq
+import asyncio
+import itertools
+import contextlib
+import contextvars
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+
+# calls admitted at once per lane, the sum should stay below the node's rpcworkqueue
+LANE_LIMITS = {
+    "cheap": 16,                        # lookups answered from memory or a single index read
+    "heavy": 2,                         # calls walking blocks, the UTXO set or the whole mempool
+    "batch": 4,                         # JSON-RPC batches
+}
+
+HEAVY_METHODS = frozenset({
+    "verifychain", "getblockstats", "getchaintxstats", "gettxoutsetinfo", "scantxoutset",
+    "gettxoutproof", "getnetworkhashps", "getmempoolancestors", "getmempooldescendants",
+})
+
+# priority of the calls made by the current task, higher is admitted first
+PRIORITY = contextvars.ContextVar("priority", default=0)
+# loop time by which the calls made by the current task must be admitted, None to wait indefinitely
+DEADLINE = contextvars.ContextVar("deadline", default=None)
+
+
+def deadline(timeout:Optional[float]=None) -> Optional[float]:
+    '''Returns the loop time by which a call taking at most timeout seconds must finish, capped by the current deadline'''
+    current = DEADLINE.get()
+    if timeout is None:
+        return current
+    own = asyncio.get_running_loop().time() + timeout
+    return own if current is None else min(current, own)
+
+
+def classify(method:str, params:list=None) -> str:
+    '''Returns the lane of a call from its cost'''
+    params = params or []
+    if method in HEAVY_METHODS:
+        return "heavy"
+    if method == "getblock" and len(params) > 1 and params[1] is not None and params[1] >= 2:
+        return "heavy"
+    if method == "getrawmempool" and params and params[0]:
+        return "heavy"
+    return "cheap"
+
+
+class Lane:
+    '''Admits at most limit calls at once, the others wait by priority then arrival until their deadline'''
+    def __init__(self, name:str, limit:int) -> None:
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.waiters = []               # heap of (-priority, arrival, future)
+        self.arrivals = itertools.count()
+        self.stats = {"admitted": 0, "expired": 0, "retried": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    @property
+    def depth(self) -> int:
+        '''Calls waiting for admission'''
+        return sum(1 for *_, future in self.waiters if not future.done())
+
+    async def acquire(self, priority:int=0, deadline:Optional[float]=None) -> None:
+        '''Waits for a slot, raises asyncio.TimeoutError if the deadline passes first'''
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if deadline is not None and deadline <= start:
+            self.stats["expired"] += 1
+            raise asyncio.TimeoutError(f"deadline passed before admission to the {self.name} lane")
+        if self.active < self.limit and not self.depth:
+            self.active += 1
+            self.stats["admitted"] += 1
+            return
+        future = loop.create_future()
+        heapq.heappush(self.waiters, (-priority, next(self.arrivals), future))
+        try:
+            await asyncio.wait_for(future, None if deadline is None else deadline - start)
+        except BaseException as exc:
+            if future.done() and not future.cancelled():
+                # admitted just as the wait was abandoned, hand the slot over
+                self.release()
+            else:
+                future.cancel()
+            if isinstance(exc, asyncio.TimeoutError):
+                self.stats["expired"] += 1
+            raise
+        waited = loop.time() - start
+        self.stats["admitted"] += 1
+        self.stats["wait_total"] += waited
+        self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+
+    def release(self) -> None:
+        '''Frees a slot, passing it to the first waiter still waiting'''
+        while self.waiters:
+            *_, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class Lanes:
+    '''
+        Admission control in front of the node's RPC work queue. Calls are classified by cost into lanes,
+        each with its own concurrency limit, so cheap calls are not queued behind heavy ones.
+        Priority and deadline are taken from the calling task's context, see options().
+    '''
+    def __init__(self, limits:Dict[str, int]=LANE_LIMITS) -> None:
+        self.lanes = {name: Lane(name, limit) for name, limit in limits.items()}
+
+    def __getitem__(self, name:str) -> Lane:
+        return self.lanes[name]
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, name:str, deadline:Optional[float]=None) -> AsyncIterator[Lane]:
+        '''Holds a slot of the named lane, admitted by deadline or the current one'''
+        lane = self.lanes[name]
+        await lane.acquire(PRIORITY.get(), DEADLINE.get() if deadline is None else deadline)
+        try:
+            yield lane
+        finally:
+            lane.release()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def options(priority:Optional[int]=None, timeout:Optional[float]=None) -> Iterator[None]:
+        '''Sets the priority, and a deadline timeout seconds from now, of the calls made within'''
+        tokens = []
+        if priority is not None:
+            tokens.append((PRIORITY, PRIORITY.set(priority)))
+        if timeout is not None:
+            deadline = asyncio.get_running_loop().time() + timeout
+            current = DEADLINE.get()
+            tokens.append((DEADLINE, DEADLINE.set(deadline if current is None else min(current, deadline))))
+        try:
+            yield
+        finally:
+            for var, token in reversed(tokens):
+                var.reset(token)
+
+    def stats(self) -> Dict[str, dict]:
+        '''Returns the limit, active calls, queue depth and wait times of every lane'''
+        return {
+            name: {
+                "limit": lane.limit,
+                "active": lane.active,
+                "depth": lane.depth,
+                **lane.stats,
+                "wait_avg": lane.stats["wait_total"] / lane.stats["admitted"] if lane.stats["admitted"] else 0.0,
+            }
+            for name, lane in self.lanes.items()
+        }
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Set, Union
+from fastbtc.block import COIN
+from fastbtc.events import EventBus
+from fastbtc.zmqsub import SequenceEvent
+
+
+NOT_IN_MEMPOOL = {"code": -5, "message": "Transaction not in mempool"}
+MEMPOOL_BACKOFF = 1.0                   # seconds before retrying a failed resync, doubled on each failure
+MEMPOOL_BACKOFF_MAX = 60.0              # longest wait between resyncs
+
+
+class MempoolEntry:
+    '''Mempool transaction, fees in satoshis. Ancestor and descendant totals are derived from the graph.'''
+    __slots__ = ("wtxid", "vsize", "weight", "time", "height", "fee", "modifiedfee",
+                 "replaceable", "unbroadcast", "parents", "children")
+
+    def __init__(self, entry:dict) -> None:
+        fees = entry['fees']
+        self.wtxid = entry.get('wtxid')
+        self.vsize = entry['vsize']
+        self.weight = entry.get('weight')
+        self.time = entry['time']
+        self.height = entry['height']
+        self.fee = round(fees['base'] * COIN)
+        self.modifiedfee = round(fees['modified'] * COIN)
+        self.replaceable = entry.get('bip125-replaceable')
+        self.unbroadcast = entry.get('unbroadcast')
+        self.parents = set()            # txids of in-mempool transactions this one spends
+        self.children = set()           # txids of in-mempool transactions spending this one
+
+
+class MempoolMirror:
+    '''
+        Replica of the node's mempool kept as a graph of MempoolEntry, answering getrawmempool,
+        getmempoolentry, getmempoolancestors and getmempooldescendants without asking the node.
+        It is bootstrapped from getrawmempool with mempool_sequence and then follows the added (A) and
+        removed (R) sequence notifications. Transactions mined by a connected block (C) are dropped
+        using the block's txids. A skipped mempool_sequence, or a ZMQ gap, triggers a resync which
+        only fetches the entries that are not mirrored already.
+    '''
+    def __init__(self) -> None:
+        self.entries = {}               # txid -> MempoolEntry
+        self.sequence = None            # mempool_sequence of the last applied change
+        self.absent = set()             # txids announced as added but gone by the time they were fetched
+        self.synced = False
+        self.stats = {"added": 0, "removed": 0, "resyncs": 0}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, txid:str) -> bool:
+        return txid in self.entries
+
+    ######## UPDATES ########
+    def add(self, txid:str, entry:dict) -> None:
+        '''Mirrors a transaction and links it to its in-mempool parents and children'''
+        if txid in self.entries:
+            return
+        mirrored = MempoolEntry(entry)
+        self.entries[txid] = mirrored
+        for parent in entry.get('depends', ()):
+            if parent in self.entries:
+                mirrored.parents.add(parent)
+                self.entries[parent].children.add(txid)
+        for child in entry.get('spentby', ()):
+            if child in self.entries:
+                mirrored.children.add(child)
+                self.entries[child].parents.add(txid)
+        self.stats["added"] += 1
+
+    def remove(self, txid:str) -> bool:
+        '''Drops a transaction and its links, returns whether it was mirrored'''
+        entry = self.entries.pop(txid, None)
+        if entry is None:
+            return False
+        for parent in entry.parents:
+            self.entries[parent].children.discard(txid)
+        for child in entry.children:
+            self.entries[child].parents.discard(txid)
+        self.stats["removed"] += 1
+        return True
+
+    async def fetch(self, rpc, txids:List[str]) -> Dict[str, dict]:
+        '''Returns the entries of the txids still in the node's mempool, fetched in batches'''
+        if not txids:
+            return {}
+        entries = await rpc.call_many([("getmempoolentry", [txid]) for txid in txids])
+        return {txid: entry for txid, entry in zip(txids, entries) if isinstance(entry, dict) and 'vsize' in entry}
+
+    async def resync(self, rpc) -> None:
+        '''Brings the mirror in line with the node's mempool, fetching only the entries it lacks'''
+        async with rpc.pinned():
+            reply = await rpc.call("getrawmempool", [False, True], use_cache=False)
+            if not isinstance(reply, dict) or 'txids' not in reply:
+                logging.warning(f"mempool resync failed: {reply}")
+                self.synced = False
+                return
+            missing = [txid for txid in reply['txids'] if txid not in self.entries]
+            fetched = await self.fetch(rpc, missing)
+        current = set(reply['txids'])
+        for txid in [txid for txid in self.entries if txid not in current]:
+            self.remove(txid)
+        for txid, entry in fetched.items():
+            self.add(txid, entry)
+        self.sequence = reply['mempool_sequence']
+        self.absent.clear()
+        self.synced = True
+        self.stats["resyncs"] += 1
+
+    async def apply(self, rpc, events:List[SequenceEvent]) -> None:
+        '''Applies sequence notifications in order, resyncing when one was missed'''
+        added = [
+            event.hash for event in events
+            if event.label == 'A' and event.mempool_sequence > self.sequence
+        ]
+        fetched = await self.fetch(rpc, added)
+        for event in events:
+            if event.label in ('A', 'R'):
+                if event.mempool_sequence <= self.sequence:
+                    continue    # already part of the snapshot
+                if event.mempool_sequence != self.sequence + 1:
+                    logging.warning(f"mempool sequence skipped from {self.sequence} to {event.mempool_sequence}")
+                    await self.resync(rpc)
+                    return
+                self.sequence = event.mempool_sequence
+                if event.label == 'A':
+                    if event.hash in fetched:
+                        self.add(event.hash, fetched[event.hash])
+                    else:
+                        self.absent.add(event.hash)
+                else:
+                    self.remove(event.hash)
+                    self.absent.discard(event.hash)
+            elif event.label == 'C':
+                block = await rpc.getblock(event.hash, 1)
+                if not isinstance(block, dict) or 'tx' not in block:
+                    await self.resync(rpc)
+                    return
+                # transactions mined by the block bump mempool_sequence without R notifications
+                for txid in block['tx']:
+                    if self.remove(txid) or txid in self.absent:
+                        self.absent.discard(txid)
+                        self.sequence += 1
+
+    async def follow(self, rpc, bus:EventBus) -> None:
+        '''Bootstraps the mirror and applies sequence notifications until cancelled.
+        A failed update marks the mirror out of sync, so calls go to the node until a resync succeeds.'''
+        queue = bus.subscribe("sequence", "gap", maxsize=0)
+        # resynced once subscribed, so no event is missed between the snapshot and the notifications
+        self.synced = False
+        backoff = MEMPOOL_BACKOFF
+        try:
+            while True:
+                if not self.synced:
+                    # the snapshot taken now already reflects every event received so far
+                    while not queue.empty():
+                        queue.get_nowait()
+                    try:
+                        await self.resync(rpc)
+                    except Exception as exc:
+                        logging.warning(f"mempool resync failed: {exc!r}")
+                        self.synced = False
+                    if not self.synced:
+                        await asyncio.sleep(backoff)
+                        backoff = min(backoff * 2, MEMPOOL_BACKOFF_MAX)
+                        continue
+                    backoff = MEMPOOL_BACKOFF
+                events = [await queue.get()]
+                while not queue.empty():
+                    events.append(queue.get_nowait())
+                if any(topic == "gap" and event.topic == "sequence" for topic, event in events):
+                    self.synced = False
+                    continue
+                try:
+                    await self.apply(rpc, [event for topic, event in events if topic == "sequence"])
+                except Exception as exc:
+                    logging.warning(f"mempool update failed: {exc!r}")
+                    self.synced = False
+        finally:
+            bus.unsubscribe(queue, "sequence", "gap")
+
+    ######## LOOKUPS ########
+    def walk(self, txid:str, links:str) -> Set[str]:
+        '''Returns the txids reachable from txid through the parents or children links'''
+        found = set()
+        stack = [txid]
+        while stack:
+            for linked in getattr(self.entries[stack.pop()], links):
+                if linked not in found:
+                    found.add(linked)
+                    stack.append(linked)
+        return found
+
+    def entry(self, txid:str) -> dict:
+        '''Returns the entry of txid in the format of getmempoolentry'''
+        entry = self.entries[txid]
+        ancestors = [self.entries[ancestor] for ancestor in self.walk(txid, "parents")] + [entry]
+        descendants = [self.entries[descendant] for descendant in self.walk(txid, "children")] + [entry]
+        return {
+            "vsize": entry.vsize,
+            "weight": entry.weight,
+            "time": entry.time,
+            "height": entry.height,
+            "descendantcount": len(descendants),
+            "descendantsize": sum(descendant.vsize for descendant in descendants),
+            "ancestorcount": len(ancestors),
+            "ancestorsize": sum(ancestor.vsize for ancestor in ancestors),
+            "wtxid": entry.wtxid,
+            "fees": {
+                "base": entry.fee / COIN,
+                "modified": entry.modifiedfee / COIN,
+                "ancestor": sum(ancestor.modifiedfee for ancestor in ancestors) / COIN,
+                "descendant": sum(descendant.modifiedfee for descendant in descendants) / COIN,
+            },
+            "depends": sorted(entry.parents),
+            "spentby": sorted(entry.children),
+            "bip125-replaceable": entry.replaceable,
+            "unbroadcast": entry.unbroadcast,
+        }
+
+    def entries_of(self, txids:Iterable[str], verbose:bool) -> Union[list, dict]:
+        '''Returns the txids, or their entries keyed by txid if verbose'''
+        return {txid: self.entry(txid) for txid in txids} if verbose else list(txids)
+
+    def getrawmempool(self, verbose:bool=False, mempool_sequence:bool=False) -> Union[list, dict]:
+        '''Returns the mirrored txids, as getrawmempool does'''
+        if verbose and mempool_sequence:
+            return {"code": -8, "message": "Verbose results cannot contain mempool sequence values."}
+        if mempool_sequence:
+            return {"txids": list(self.entries), "mempool_sequence": self.sequence}
+        return self.entries_of(self.entries, verbose)
+
+    def getmempoolentry(self, txid:str) -> dict:
+        '''Returns the entry of txid, as getmempoolentry does'''
+        if txid not in self.entries:
+            return NOT_IN_MEMPOOL
+        return self.entry(txid)
+
+    def getmempoolancestors(self, txid:str, verbose:bool=False) -> Union[list, dict]:
+        '''Returns the in-mempool ancestors of txid, as getmempoolancestors does'''
+        if txid not in self.entries:
+            return NOT_IN_MEMPOOL
+        return self.entries_of(self.walk(txid, "parents"), verbose)
+
+    def getmempooldescendants(self, txid:str, verbose:bool=False) -> Union[list, dict]:
+        '''Returns the in-mempool descendants of txid, as getmempooldescendants does'''
+        if txid not in self.entries:
+            return NOT_IN_MEMPOOL
+        return self.entries_of(self.walk(txid, "children"), verbose)
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
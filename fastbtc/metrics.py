@@ -0,0 +1,191 @@
+import time
+import bisect
+from typing import Iterable, List, Tuple
+
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    '''Fixed bucket histogram, counts are kept per bucket and summed up when rendered'''
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets:Tuple[float, ...]=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name:str, labels:str) -> Iterable[str]:
+        '''Yields the Prometheus text lines of the histogram'''
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class MethodMetrics:
+    '''Counters of a single RPC method, allocated once and updated in place'''
+    __slots__ = ("latency", "decode", "inflight", "calls", "errors", "cancelled", "timeouts", "sent", "received")
+
+    def __init__(self) -> None:
+        self.latency = Histogram()      # seconds per call, including cache hits and coalesced calls
+        self.decode = Histogram()       # seconds spent decoding replies
+        self.inflight = 0
+        self.calls = 0
+        self.errors = 0                 # calls answered with an error
+        self.cancelled = 0              # calls abandoned by their caller, e.g. on a client disconnect
+        self.timeouts = 0               # calls that outlasted their deadline
+        self.sent = 0                   # request body bytes
+        self.received = 0               # reply body bytes
+
+
+class RouteMetrics:
+    '''Handler timings of a single HTTP route'''
+    __slots__ = ("latency", "errors", "cancelled", "timeouts")
+
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.errors = 0                 # responses with a 5xx status
+        self.cancelled = 0              # requests whose client disconnected before the response
+        self.timeouts = 0               # requests answered with a 504 once their deadline passed
+
+
+class Metrics:
+    '''
+        Registry of per method and per route metrics rendered in the Prometheus text format.
+        Entries of known methods are created upfront, so recording a call only updates existing counters.
+    '''
+    def __init__(self, methods:Iterable[str]=()) -> None:
+        self.methods = {method: MethodMetrics() for method in methods}
+        self.routes = {}
+
+    def method(self, name:str) -> MethodMetrics:
+        '''Returns the metrics of an RPC method'''
+        metrics = self.methods.get(name)
+        if metrics is None:
+            metrics = self.methods[name] = MethodMetrics()
+        return metrics
+
+    def route(self, path:str) -> RouteMetrics:
+        '''Returns the metrics of an HTTP route'''
+        metrics = self.routes.get(path)
+        if metrics is None:
+            metrics = self.routes[path] = RouteMetrics()
+        return metrics
+
+    def render(self, rpc=None) -> str:
+        '''Returns every metric in the Prometheus text format, with the cache, lane and connection usage of rpc'''
+        lines = []
+        methods = [(f'method="{name}"', metrics) for name, metrics in self.methods.items() if metrics.calls or metrics.sent]
+        self.histograms(lines, "fastbtc_rpc_duration_seconds", "RPC call latency", methods, "latency")
+        self.histograms(lines, "fastbtc_rpc_decode_seconds", "RPC reply JSON decode time", methods, "decode")
+        self.samples(lines, "fastbtc_rpc_inflight", "gauge", "RPC calls in flight",
+                     [(labels, metrics.inflight) for labels, metrics in methods])
+        self.samples(lines, "fastbtc_rpc_calls_total", "counter", "RPC calls",
+                     [(labels, metrics.calls) for labels, metrics in methods])
+        self.samples(lines, "fastbtc_rpc_errors_total", "counter", "RPC calls answered with an error",
+                     [(labels, metrics.errors) for labels, metrics in methods])
+        self.samples(lines, "fastbtc_rpc_cancelled_total", "counter", "RPC calls abandoned by their caller",
+                     [(labels, metrics.cancelled) for labels, metrics in methods])
+        self.samples(lines, "fastbtc_rpc_timeouts_total", "counter", "RPC calls that outlasted their deadline",
+                     [(labels, metrics.timeouts) for labels, metrics in methods])
+        self.samples(lines, "fastbtc_rpc_sent_bytes_total", "counter", "RPC request bytes",
+                     [(labels, metrics.sent) for labels, metrics in methods])
+        self.samples(lines, "fastbtc_rpc_received_bytes_total", "counter", "RPC reply bytes",
+                     [(labels, metrics.received) for labels, metrics in methods])
+        routes = [(f'route="{path}"', metrics) for path, metrics in self.routes.items()]
+        self.histograms(lines, "fastbtc_http_duration_seconds", "HTTP handler latency", routes, "latency")
+        self.samples(lines, "fastbtc_http_errors_total", "counter", "HTTP responses with a 5xx status",
+                     [(labels, metrics.errors) for labels, metrics in routes])
+        self.samples(lines, "fastbtc_http_cancelled_total", "counter", "HTTP requests whose client disconnected first",
+                     [(labels, metrics.cancelled) for labels, metrics in routes])
+        self.samples(lines, "fastbtc_http_timeouts_total", "counter", "HTTP requests answered with a 504 at their deadline",
+                     [(labels, metrics.timeouts) for labels, metrics in routes])
+        if rpc is not None:
+            self.client(lines, rpc)
+        return "\n".join(lines) + "\n"
+
+    def client(self, lines:List[str], rpc) -> None:
+        '''Appends the cache, coalescing, lane and connection metrics of rpc'''
+        if rpc.cache is not None:
+            self.samples(lines, "fastbtc_cache_hits_total", "counter", "Response cache hits", [("", rpc.cache.stats["hits"])])
+            self.samples(lines, "fastbtc_cache_misses_total", "counter", "Response cache misses", [("", rpc.cache.stats["misses"])])
+            if rpc.cache.disk is not None:
+                self.samples(lines, "fastbtc_disk_cache_hits_total", "counter", "Response cache misses answered from disk",
+                             [("", rpc.cache.disk.stats["hits"])])
+                self.samples(lines, "fastbtc_disk_cache_bytes", "gauge", "Bytes of the disk cache logs",
+                             [("", rpc.cache.disk.nbytes)])
+        self.samples(lines, "fastbtc_coalesced_total", "counter", "Calls sharing the reply of an identical call in flight",
+                     [("", rpc.coalesce_stats["merged"])])
+        if rpc.lanes is not None:
+            lanes = [(f'lane="{name}"', stats) for name, stats in rpc.lanes.stats().items()]
+            for key, name, kind, help in (
+                ("limit", "fastbtc_lane_limit", "gauge", "Calls admitted at once"),
+                ("active", "fastbtc_lane_active", "gauge", "Calls admitted and not finished"),
+                ("depth", "fastbtc_lane_depth", "gauge", "Calls waiting for admission"),
+                ("admitted", "fastbtc_lane_admitted_total", "counter", "Calls admitted"),
+                ("expired", "fastbtc_lane_expired_total", "counter", "Calls whose deadline passed before admission"),
+                ("retried", "fastbtc_lane_retried_total", "counter", "Requests retried after a 503"),
+                ("wait_total", "fastbtc_lane_wait_seconds_total", "counter", "Seconds spent waiting for admission"),
+            ):
+                self.samples(lines, name, kind, help, [(labels, stats[key]) for labels, stats in lanes])
+        connections = [(f'node="{name}"', usage) for name, usage in rpc.connections().items()]
+        self.samples(lines, "fastbtc_connections_in_use", "gauge", "Connections to the node in use",
+                     [(labels, in_use) for labels, (in_use, _) in connections])
+        self.samples(lines, "fastbtc_connections_limit", "gauge", "Connections allowed to the node",
+                     [(labels, limit) for labels, (_, limit) in connections])
+
+    @staticmethod
+    def samples(lines:List[str], name:str, kind:str, help:str, samples:List[Tuple[str, float]]) -> None:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}" for labels, value in samples)
+
+    @staticmethod
+    def histograms(lines:List[str], name:str, help:str, entries:List[Tuple[str, object]], attr:str) -> None:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, metrics in entries:
+            lines.extend(getattr(metrics, attr).render(name, labels))
+
+
+class RouteTimer:
+    '''ASGI middleware recording the time each HTTP route takes to respond, by route template'''
+    def __init__(self, app, metrics:Metrics) -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_status(message:dict) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            metrics = self.metrics.route(getattr(route, "path", "unmatched"))
+            metrics.latency.observe(time.perf_counter() - start)
+            if status >= 500:
+                metrics.errors += 1
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
@@ -1,7 +1,29 @@
 import os
+import time
+import logging
 import orjson
+import asyncio
 import aiohttp
-from typing import List, Union
+import inspect
+import contextlib
+import itertools
+import contextvars
+import collections
+from typing import AsyncIterator, Callable, Coroutine, Dict, List, NamedTuple, Optional, Tuple, Union
+from fastbtc.cache import ResponseCache
+from fastbtc.events import EventBus
+from fastbtc.jsonstream import JSONSplitter
+from fastbtc.block import Block, Transaction
+from fastbtc.headers import HeaderStore, HEADERS_CONFIRMATIONS
+from fastbtc.mempool import MempoolMirror
+from fastbtc.lanes import Lanes, classify, deadline, DEADLINE, PRIORITY
+from fastbtc.metrics import Metrics
+from fastbtc.utxo import UTXOIndex
+from fastbtc.txindex import TxIndex
+from fastbtc.shared import SharedState
+from fastbtc import structs
+from fastbtc.address import scriptpubkey
+from yarl import URL
 
 
 RPC_USER = os.getenv("BTC_RPC_USER")    # rpcuser from bitcoin.conf
@@ -10,12 +32,115 @@ RPC_HOST = "127.0.0.1"                  # rpcbind from bitcoin.conf
 RPC_PORT = 8332                         # rpcport from bitcoin.conf
 RPC_SCHEME = 'http'                     # currently only HTTP is supported
 RPC_URL = f"{RPC_SCHEME}://{RPC_USER}:{RPC_PASS}@{RPC_HOST}:{RPC_PORT}"
+RPC_BATCH_SIZE = 1000                   # max calls sent in a single JSON-RPC batch
+RPC_BATCH_CONCURRENCY = 4               # max batch chunks in flight, keep below rpcthreads
+RPC_STREAM_CHUNK = 2**16                # bytes read at a time when streaming replies
+RPC_RETRIES = 4                         # retries of a request rejected with 503 because the work queue is full
+RPC_BACKOFF = 0.05                      # seconds before the first retry, doubled on each one
+RPC_PREFETCH = 8                        # blocks fetched ahead by iter_blocks
+RPC_REORG_DEPTH = 100                   # blocks iter_blocks remembers, to disconnect them on a reorg
+RPC_FOLLOW_INTERVAL = 5.0               # seconds between tip checks of iter_blocks following the tip without a bus
+RPC_TIMEOUT = 300.0                     # seconds a call may take unless listed below, or given a sooner deadline
+
+# seconds allowed to the calls that can legitimately take longer than RPC_TIMEOUT
+RPC_TIMEOUTS = {
+    "verifychain": 3600.0,
+    "gettxoutsetinfo": 3600.0,
+    "scantxoutset": 3600.0,
+}
+
+# layout of a successful bitcoind reply, used to slice the result out without decoding it
+RAW_PREFIX = b'{"result":'
+RAW_NULL_PREFIX = b'{"result":null'
+RAW_SUFFIX = b',"error":null,"id":null}'
+
+# read only methods whose identical in-flight calls share a single request to the node
+RPC_COALESCE_METHODS = frozenset({
+    "listbanned", "getaddednodeinfo", "getconnectioncount", "getnetworkinfo", "getnettotals",
+    "getnodeaddresses", "getpeerinfo", "getmemoryinfo", "uptime",
+    "getmininginfo", "getnetworkhashps", "getblockchaininfo", "getdifficulty", "getbestblockhash",
+    "getblockcount", "getblockhash", "getblockheader", "getblock", "getblockstats", "getchaintips",
+    "getchaintxstats", "getaddressinfo", "getrawtransaction", "gettxout", "gettxoutproof",
+    "verifytxoutproof", "validateaddress", "decodescript", "decoderawtransaction",
+    "getmempoolinfo", "getrawmempool", "getmempoolentry", "getmempoolancestors", "getmempooldescendants",
+    "getwalletinfo", "getbalance", "getbalances",
+})
+
+
+class RPCError(Exception):
+    '''Error replied by the RPC server, raised where results can't be returned in its place'''
+    def __init__(self, error:dict) -> None:
+        super().__init__(error.get('message'))
+        self.code = error.get('code')
+        self.message = error.get('message')
+
+
+class BlockDisconnected(NamedTuple):
+    '''Yielded by iter_blocks for a block it yielded before that left the best chain'''
+    height: int
+    hash: str
+
+
+def result_slice(body:bytes) -> Optional[memoryview]:
+    '''Returns a view of the result in a raw reply without decoding it, or None if the reply has an error
+    or an unexpected layout'''
+    end = len(body)
+    while end and body[end - 1] in b" \t\r\n":
+        end -= 1
+    if body.startswith(RAW_PREFIX) and body.endswith(RAW_SUFFIX, 0, end):
+        return memoryview(body)[len(RAW_PREFIX):end - len(RAW_SUFFIX)]
+    return None
+
+
+def decode_result(body:bytes) -> Union[memoryview, bytes]:
+    '''Returns the JSON of the result, or of the error, of a raw reply by decoding it, typed as raw calls return them'''
+    reply = orjson.loads(body)
+    return orjson.dumps(reply['error']) if reply['error'] else memoryview(orjson.dumps(reply['result']))
+
+
+def raw_ok(body:Union[memoryview, bytes]) -> bool:
+    '''Returns whether the JSON returned by a raw call is its result rather than its error. Results are returned as
+    memoryviews and errors as bytes, told apart where the reply is parsed rather than by their content.'''
+    return isinstance(body, memoryview)
+
+
+def client_timeout(deadline:float) -> aiohttp.ClientTimeout:
+    '''Returns the aiohttp timeout of a request that has to finish by the loop time deadline'''
+    remaining = deadline - asyncio.get_running_loop().time()
+    if remaining <= 0:
+        raise asyncio.TimeoutError("deadline passed before the request was sent")
+    return aiohttp.ClientTimeout(total=remaining)
+
+
+def decode_typed(body:bytes, decode:Callable, *args):
+    '''Decodes the JSON of a raw result with decode, e.g. straight into structs, an error into a dict as usual'''
+    if bytes(body[:8]) == b'{"code":':
+        return orjson.loads(body)
+    return decode(body, *args)
 
 
 class BitcoinRPC:
-    def __init__(self, username:str, password:str, host:str, port:int, scheme:str='http') -> None:
-        self.session = aiohttp.ClientSession(trust_env=True, json_serialize=orjson.dumps)
+    def __init__(self, username:str, password:str, host:str, port:int, scheme:str='http',
+                 batch_size:int=RPC_BATCH_SIZE, coalesce:bool=True, cache:ResponseCache=None,
+                 headers:HeaderStore=None, mempool:MempoolMirror=None, lanes:Lanes=None,
+                 metrics:Metrics=None, utxo:UTXOIndex=None, txindex:TxIndex=None,
+                 shared:SharedState=None) -> None:
+        self._session = None
         self.url = f"{scheme}://{username}:{password}@{host}:{port}"
+        self.rest_url = f"{scheme}://{host}:{port}/rest"     # requires rest=1 in bitcoin.conf
+        self.batch_size = batch_size
+        self.coalesce = coalesce
+        self.inflight = {}      # (method, params) -> task shared by identical calls
+        self.waiting = collections.Counter()    # shared task -> callers still awaiting it
+        self.coalesce_stats = {"calls": 0, "merged": 0}
+        self.cache = cache
+        self.headers = headers  # local header store answering block hashes and headers
+        self.mempool = mempool  # local mempool mirror answering mempool queries once synced
+        self.lanes = lanes      # admission control by call cost
+        self.metrics = metrics  # per method latency, sizes, decode time and errors
+        self.utxo = utxo        # local address index answering balances once synced
+        self.txindex = txindex  # local txid index locating confirmed transactions
+        self.shared = shared    # snapshots published by the process polling the node for all workers
 
     async def __aenter__(self) -> 'BitcoinRPC':
         '''Upon entry if being used as context manager'''
@@ -25,9 +150,70 @@ class BitcoinRPC:
         '''Upon exit if being used as context manager'''
         await self.close()
 
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        '''ClientSession, created on first use so the client can be built outside of a running loop'''
+        if self._session is None:
+            self._session = aiohttp.ClientSession(trust_env=True, json_serialize=orjson.dumps)
+        return self._session
+
     async def close(self):
         '''Close the ClientSession'''
-        await self.session.close()
+        if self._session is not None:
+            await self._session.close()
+
+    def connections(self) -> Dict[str, Tuple[int, int]]:
+        '''Returns the connections in use and the connection limit of the session, by node'''
+        if self._session is None:
+            return {}
+        connector = self._session.connector
+        url = URL(self.url)
+        return {f"{url.host}:{url.port}": (len(getattr(connector, '_acquired', ())), connector.limit)}
+
+    def __post__(self, data:bytes, timeout:aiohttp.ClientTimeout):
+        '''Posts a JSON-RPC request body to the server, returns the reply context manager'''
+        return self.session.post(self.url, data=data, timeout=timeout)
+
+    def __rest__(self, path:str):
+        '''Sends a GET to the REST interface, returns the reply context manager'''
+        return self.session.get(f"{self.rest_url}/{path}", timeout=client_timeout(deadline(RPC_TIMEOUT)))
+
+    @contextlib.asynccontextmanager
+    async def __send__(self, data:bytes, lane:str, timeout:float=RPC_TIMEOUT) -> AsyncIterator[aiohttp.ClientResponse]:
+        '''Posts data once admitted to the lane, retrying with backoff while the node's work queue is full.
+        The request is abandoned with asyncio.TimeoutError after timeout seconds, or sooner at the current deadline.'''
+        until = deadline(timeout)
+        async with self.lanes.acquire(lane, until) if self.lanes is not None else contextlib.nullcontext():
+            for attempt in itertools.count():
+                async with self.__post__(data, client_timeout(until)) as reply:
+                    if reply.status != 503 or attempt == RPC_RETRIES:
+                        yield reply
+                        return
+                if self.lanes is not None:
+                    self.lanes[lane].stats["retried"] += 1
+                await asyncio.sleep(RPC_BACKOFF * 2**attempt)
+
+    @contextlib.asynccontextmanager
+    async def pinned(self) -> AsyncIterator['BitcoinRPC']:
+        '''Sends the calls made within to the same node, for sequences that depend on the chain tip.
+        A single node client always does.'''
+        yield self
+
+    def __pin__(self):
+        '''Returns the node the calls of the current task are pinned to, None if they aren't'''
+        return None
+
+    def __decode__(self, method:str, data:bytes, body:bytes):
+        '''Decodes a reply body, recording its size and decode time'''
+        if self.metrics is None:
+            return orjson.loads(body)
+        metrics = self.metrics.method(method)
+        metrics.sent += len(data)
+        metrics.received += len(body)
+        start = time.perf_counter()
+        reply = orjson.loads(body)
+        metrics.decode.observe(time.perf_counter() - start)
+        return reply
 
     async def __rpc__(self, method:str, params:list=None):
         '''Sends formatted RPC to server and returns JSON reply'''
@@ -35,13 +221,296 @@ class BitcoinRPC:
             "method": method,
             "params": params if params else [],
         }
-        async with self.session.post(self.url, data=orjson.dumps(command)) as reply:
-            return (await reply.json())
+        data = orjson.dumps(command)
+        async with self.__send__(data, classify(method, params), RPC_TIMEOUTS.get(method, RPC_TIMEOUT)) as reply:
+            body = await reply.read()
+        return self.__decode__(method, data, body)
   
-    async def call(self, method:str, params:list=None):
-        '''Returns the result from the RPC server using the given method and params'''
+    async def __rpc_raw__(self, method:str, params:list=None) -> bytes:
+        '''Sends formatted RPC to server and returns the undecoded reply body'''
+        command = {
+            "method": method,
+            "params": params if params else [],
+        }
+        data = orjson.dumps(command)
+        async with self.__send__(data, classify(method, params), RPC_TIMEOUTS.get(method, RPC_TIMEOUT)) as reply:
+            body = await reply.read()
+        if self.metrics is not None:
+            metrics = self.metrics.method(method)
+            metrics.sent += len(data)
+            metrics.received += len(body)
+        return body
+
+    async def __rpc_batch__(self, commands:List[dict]) -> Union[list, dict]:
+        '''Sends a JSON-RPC batch to server and returns the JSON reply array'''
+        data = orjson.dumps(commands)
+        timeout = max(RPC_TIMEOUTS.get(command["method"], RPC_TIMEOUT) for command in commands)
+        async with self.__send__(data, "batch", timeout) as reply:
+            body = await reply.read()
+        return self.__decode__("batch", data, body)
+
+    async def __request__(self, method:str, params:list=None, use_cache:bool=True, raw:bool=False):
+        '''Sends a single call and returns its result, or its error. Successful results are cached if enabled.'''
+        tip_hash = self.cache.tip_hash if self.cache is not None else None
+        if raw:
+            body = await self.__rpc_raw__(method, params)
+            result = result_slice(body)
+            if result is None and self.metrics is not None and not body.startswith(RAW_NULL_PREFIX):
+                self.metrics.method(method).errors += 1
+            if result is not None and use_cache and self.cache is not None and self.cache.cacheable(method, params):
+                self.cache.put_raw(method, params, result, tip_hash)
+            return result if result is not None else decode_result(body)
         reply = await self.__rpc__(method, params)
-        return reply['error'] if reply['error'] else reply['result']
+        if reply['error']:
+            if self.metrics is not None:
+                self.metrics.method(method).errors += 1
+            return reply['error']
+        if use_cache and self.cache is not None and self.cache.cacheable(method, params):
+            self.cache.put(method, params, reply['result'], tip_hash)
+        return reply['result']
+
+    async def __check_tip__(self) -> None:
+        '''Invalidates tip scoped cache entries if the best block changed since the last check'''
+        now = asyncio.get_running_loop().time()
+        if now - self.cache.tip_checked < self.cache.tip_interval:
+            return
+        self.cache.tip_checked = now
+        if self.shared is not None:
+            info = self.shared.get("getblockchaininfo")
+            if info is not None:
+                self.cache.set_tip(info["bestblockhash"], info["blocks"])
+                return
+        async with self.pinned():
+            blockhash = await self.call("getbestblockhash", use_cache=False)
+            if isinstance(blockhash, str) and blockhash != self.cache.tip_hash:
+                header = await self.call("getblockheader", [blockhash, True], use_cache=False)
+                self.cache.set_tip(blockhash, header.get('height') if isinstance(header, dict) else None)
+
+    async def tip(self) -> Optional[str]:
+        '''Returns the best block hash known to the response cache, checked at most every tip_interval.
+        None without a cache.'''
+        if self.cache is None:
+            return None
+        await self.__check_tip__()
+        return self.cache.tip_hash
+
+    async def follow_tip(self, bus:EventBus) -> None:
+        '''Updates the response cache tip from hashblock notifications instead of polling getbestblockhash'''
+        self.cache.tip_interval = float('inf')
+        async for topic, event in bus.listen("hashblock", "gap"):
+            if topic == "gap":
+                # a block notification may have been missed, check the tip on the next call
+                self.cache.tip_checked = float('-inf')
+                continue
+            header = await self.call("getblockheader", [event, True], use_cache=False)
+            self.cache.set_tip(event, header.get('height') if isinstance(header, dict) else None)
+            self.cache.tip_checked = asyncio.get_running_loop().time()
+
+    async def call(self, method:str, params:list=None, use_cache:bool=True, raw:bool=False):
+        '''Returns the result from the RPC server using the given method and params.
+        Identical read only calls made while one is in flight share its reply, as do cached results,
+        so results must not be mutated. Set use_cache to False to bypass the response cache.
+        With raw the undecoded JSON of the result is returned as a memoryview instead, that of an error as bytes.
+        Raises asyncio.TimeoutError if the call outlasts its timeout in RPC_TIMEOUTS or the current deadline.'''
+        if self.metrics is None:
+            return await self.__dispatch__(method, params, use_cache, raw)
+        metrics = self.metrics.method(method)
+        metrics.calls += 1
+        metrics.inflight += 1
+        start = time.perf_counter()
+        try:
+            return await self.__dispatch__(method, params, use_cache, raw)
+        except asyncio.CancelledError:
+            metrics.cancelled += 1
+            raise
+        except asyncio.TimeoutError:
+            metrics.timeouts += 1
+            raise
+        finally:
+            metrics.inflight -= 1
+            metrics.latency.observe(time.perf_counter() - start)
+
+    async def __dispatch__(self, method:str, params:list, use_cache:bool, raw:bool):
+        '''Answers a call from the cache, a coalesced call in flight or a new request'''
+        if use_cache and self.cache is not None and self.cache.cacheable(method, params):
+            await self.__check_tip__()
+            if raw:
+                result = self.cache.get_raw(method, params)
+                if result is not None:
+                    return memoryview(result)
+            hit, result = self.cache.get(method, params)
+            if hit:
+                return memoryview(orjson.dumps(result)) if raw else result
+        if not self.coalesce or method not in RPC_COALESCE_METHODS:
+            return await self.__request__(method, params, use_cache, raw)
+        # only calls sent alike are merged, the request runs with the priority and pin of each of its callers
+        key = (method, orjson.dumps(params if params else []), use_cache, raw, PRIORITY.get(), self.__pin__())
+        self.coalesce_stats["calls"] += 1
+        task = self.inflight.get(key)
+        if task is None:
+            # without the deadline of the caller starting it, each caller waits until its own instead
+            context = contextvars.copy_context()
+            context.run(DEADLINE.set, None)
+            task = context.run(asyncio.ensure_future, self.__request__(method, params, use_cache, raw))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.coalesce_stats["merged"] += 1
+        self.waiting[task] += 1
+        try:
+            # shielded so a cancelled caller does not cancel the request for the others
+            until = DEADLINE.get()
+            timeout = None if until is None else until - asyncio.get_running_loop().time()
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        finally:
+            self.waiting[task] -= 1
+            if not self.waiting[task]:
+                del self.waiting[task]
+                # the last caller gave up, nobody is left to answer
+                task.cancel()
+                # its connection is released before the caller goes on
+                await asyncio.wait([task])
+
+    async def __receive__(self, method:str, params:list=None) -> AsyncIterator[bytes]:
+        '''Yields the reply body of a call in chunks. The reply is read as fast as the node sends it, buffering what
+        the caller didn't consume yet, so its lane slot is released once the reply is complete rather than once a
+        slow consumer, e.g. an HTTP client, went through it.'''
+        command = {
+            "method": method,
+            "params": params if params else [],
+        }
+        received = asyncio.Queue()
+
+        async def read():
+            try:
+                async with self.__send__(orjson.dumps(command), classify(method, params), RPC_TIMEOUTS.get(method, RPC_TIMEOUT)) as reply:
+                    async for chunk in reply.content.iter_chunked(RPC_STREAM_CHUNK):
+                        received.put_nowait(chunk)
+            except Exception as exc:
+                received.put_nowait(exc)
+                return
+            received.put_nowait(None)
+        reader = asyncio.ensure_future(read())
+        try:
+            while True:
+                chunk = await received.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            reader.cancel()
+            # its connection is released before the caller goes on
+            await asyncio.wait([reader])
+
+    async def stream(self, method:str, params:list=None) -> AsyncIterator[bytes]:
+        '''Yields the undecoded JSON of the result in chunks as they are received from the server.
+        Replies with an error (or a null result) are small and decoded instead.'''
+        chunks = self.__receive__(method, params)
+        try:
+            head = b''
+            async for chunk in chunks:
+                head += chunk
+                if len(head) >= len(RAW_NULL_PREFIX):
+                    break
+            if not head.startswith(RAW_PREFIX) or head.startswith(RAW_NULL_PREFIX):
+                body = head + b''.join([chunk async for chunk in chunks])
+                result = result_slice(body)
+                yield bytes(result) if result is not None else bytes(decode_result(body))
+                return
+            # hold back enough bytes to strip the error envelope at the end
+            hold = len(RAW_SUFFIX) + 8
+            pending = head[len(RAW_PREFIX):]
+            async for chunk in chunks:
+                pending += chunk
+                if len(pending) > hold:
+                    yield pending[:-hold]
+                    pending = pending[-hold:]
+            pending = pending.rstrip()
+            if not pending.endswith(RAW_SUFFIX):
+                raise ValueError(f"Unexpected end of {method} reply: {pending!r}")
+            yield pending[:-len(RAW_SUFFIX)]
+        finally:
+            await chunks.aclose()
+
+    async def __iter_result__(self, method:str, params:list, path:Tuple[str, ...]) -> AsyncIterator:
+        '''Yields the elements of the container at path in the result, decoding the reply incrementally'''
+        splitter = JSONSplitter(("result",) + path)
+        chunks = self.__receive__(method, params)
+        try:
+            async for chunk in chunks:
+                for element in splitter.feed(chunk):
+                    yield element
+        finally:
+            await chunks.aclose()
+        if not splitter.found:
+            reply = orjson.loads(splitter.buffer)
+            raise RPCError(reply['error'] or {"code": None, "message": f"No {'.'.join(path)} in {method} result"})
+
+    async def __send_batch__(self, chunk:List[Tuple[str, list]]) -> List[Tuple[object, Optional[dict]]]:
+        '''Sends the calls as a single JSON-RPC batch and returns (result, error) for each in order'''
+        commands = [
+            {"method": method, "params": params if params else [], "id": id}
+            for id, (method, params) in enumerate(chunk)
+        ]
+        replies = await self.__rpc_batch__(commands)
+        if isinstance(replies, dict):
+            # the whole batch was rejected, e.g. malformed request
+            return [(None, replies['error'])] * len(chunk)
+        by_id = {reply.get('id'): reply for reply in replies}
+        results = []
+        for id in range(len(chunk)):
+            reply = by_id.get(id)
+            if reply is None:
+                results.append((None, {"code": -32603, "message": "No reply for batched call"}))
+            else:
+                results.append((reply['result'], reply['error']))
+                if reply['error'] and self.metrics is not None:
+                    self.metrics.method(chunk[id][0]).errors += 1
+        return results
+
+    def __chunks__(self, calls:List[Tuple[str, list]], size:int=None) -> List[List[Tuple[str, list]]]:
+        '''Splits calls into batches of at most size, batch_size by default'''
+        size = size or self.batch_size
+        return [calls[i:i + size] for i in range(0, len(calls), size)]
+
+    async def call_many(self, calls:List[Tuple[str, list]], batch_size:int=None) -> list:
+        '''Returns the results of the given (method, params) calls in order, sending them as JSON-RPC batches.
+        Calls beyond batch_size are split into chunks, an item that failed holds its error like call does.
+        Pass a smaller batch_size for calls with large results, so their batches are sent concurrently.'''
+        semaphore = asyncio.Semaphore(RPC_BATCH_CONCURRENCY)
+
+        async def send(chunk:List[Tuple[str, list]]) -> list:
+            async with semaphore:
+                return await self.__send_batch__(chunk)
+
+        replies = await asyncio.gather(*(send(chunk) for chunk in self.__chunks__(calls, batch_size)))
+        return [error if error else result for chunk in replies for result, error in chunk]
+
+    async def iter_many(self, calls:List[Tuple[str, list]], batch_size:int=None) -> AsyncIterator[Tuple[object, Optional[dict]]]:
+        '''Yields (result, error) of the given calls in order as their batches complete,
+        keeping at most RPC_BATCH_CONCURRENCY batches of at most batch_size calls in flight'''
+        chunks = iter(self.__chunks__(calls, batch_size))
+        window = collections.deque(
+            asyncio.ensure_future(self.__send_batch__(chunk))
+            for chunk in itertools.islice(chunks, RPC_BATCH_CONCURRENCY)
+        )
+        try:
+            while window:
+                replies = await window.popleft()
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    window.append(asyncio.ensure_future(self.__send_batch__(chunk)))
+                for reply in replies:
+                    yield reply
+        finally:
+            for task in window:
+                task.cancel()
+
+    def batch(self) -> 'RPCBatch':
+        '''Returns a context manager which queues typed calls and sends them as JSON-RPC batches upon exit'''
+        return RPCBatch(self)
 
     ######## NODE AND NETWORK ########
     async def addnode(self, node:str, command:str) -> Union[None, dict]:
@@ -88,9 +557,16 @@ class BitcoinRPC:
         params = [count, network,]
         return await self.call(method, params)
 
-    async def getpeerinfo(self) -> list:
-        '''Returns list of information about peer nodes'''
+    async def getpeerinfo(self, typed:bool=False) -> list:
+        '''Returns list of information about peer nodes.
+        If typed is true, returns a list of structs.PeerInfo instead of dicts.'''
+        if self.shared is not None:
+            peers = self.shared.get("getpeerinfo")
+            if peers is not None:
+                return structs.convert(peers, structs.PeerInfo, list) if typed else peers
         method = "getpeerinfo"
+        if typed:
+            return decode_typed(await self.call(method, raw=True), structs.decode, structs.PeerInfo, list)
         return await self.call(method)
 
     async def getmemoryinfo(self) -> dict:
@@ -116,6 +592,10 @@ class BitcoinRPC:
         return await self.call(method, params)
 
     async def getblockchaininfo(self) -> dict:
+        if self.shared is not None:
+            info = self.shared.get("getblockchaininfo")
+            if info is not None:
+                return info
         method = "getblockchaininfo"
         return await self.call(method)
 
@@ -126,37 +606,59 @@ class BitcoinRPC:
 
     async def getbestblockhash(self) -> str:
         '''version 0.9 Returns the hash of the best (tip) block in the longest block chain.'''
+        if self.shared is not None:
+            info = self.shared.get("getblockchaininfo")
+            if info is not None:
+                return info["bestblockhash"]
         method = "getbestblockhash"
         return await self.call(method)
 
     async def getblockcount(self) -> int:
         '''Returns the number of blocks in the longest block chain.'''
+        if self.shared is not None:
+            info = self.shared.get("getblockchaininfo")
+            if info is not None:
+                return info["blocks"]
         method = "getblockcount"
         return await self.call(method)
 
     async def getblockhash(self, block:int) -> str:
         '''Returns hash for specified block {0..N}'''
+        if self.headers is not None and 0 <= block <= self.headers.height - HEADERS_CONFIRMATIONS:
+            return self.headers.blockhash(block)
         method = "getblockhash"
         params = [block,]
         return await self.call(method, params)
 
-    async def getblockheader(self, blockhash:str, verbose:bool=True) -> Union[dict, str]:
+    async def getblockheader(self, blockhash:str, verbose:bool=True, typed:bool=False) -> Union[dict, str]:
         '''If verbose is false, returns a string that is serialized, hex-encoded data for blockheader 'hash'.
-        If verbose is true, returns an Object with information about blockheader <hash>.'''
+        If verbose is true, returns an Object with information about blockheader <hash>,
+        a structs.BlockHeaderInfo if typed is true.'''
+        if self.headers is not None and verbose is False:
+            header = self.headers.blockheader(blockhash)
+            if header is not None:
+                return header
         method = "getblockheader"
         params = [blockhash, verbose]
+        if typed and verbose:
+            return decode_typed(await self.call(method, params, raw=True), structs.decode, structs.BlockHeaderInfo)
         return await self.call(method, params)
 
-    async def getblock(self, blockhash:str, verbosity:int=1) -> dict:
+    async def getblock(self, blockhash:str, verbosity:int=1, raw:bool=False) -> dict:
         '''
             Returns information about the block with the given hash
             If verbosity is 0, returns a string that is serialized, hex-encoded data for block 'hash'.
             If verbosity is 1, returns an Object with information about block <hash>.
             If verbosity is 2, returns an Object with information about block <hash> and information about each transaction. 
+            If raw is true, returns the undecoded JSON instead.
         '''
+        if self.shared is not None and verbosity in (None, 1):
+            block = self.shared.block(blockhash)
+            if block is not None:
+                return memoryview(orjson.dumps(block)) if raw else block
         method = "getblock"
         params = [blockhash, verbosity,]
-        return await self.call(method, params)
+        return await self.call(method, params, raw=raw)
 
     async def getblockstats(self, hash_or_height:Union[str, int], stats:List[str]=None) -> dict:
         '''Compute per block statistics for a given window. All amounts are in satoshis. It won't work for some heights with pruning.'''
@@ -166,6 +668,17 @@ class BitcoinRPC:
         params = [hash_or_height, stats,]
         return await self.call(method, params)
 
+    async def getblockparsed(self, blockhash:str, rest:bool=False) -> Union[Block, dict]:
+        '''Returns the block with the given hash parsed locally from its serialized form, which is far smaller
+        than its verbose JSON. If rest is true, the binary block is fetched through the REST interface.'''
+        if rest:
+            async with self.__rest__(f"block/{blockhash}.bin") as reply:
+                if reply.status != 200:
+                    return {"code": reply.status, "message": (await reply.text()).strip()}
+                return Block(await reply.read())
+        reply = await self.getblock(blockhash, 0)
+        return Block.from_hex(reply) if isinstance(reply, str) else reply
+
     async def getchaintips(self) -> list:
         '''Return information about all known tips in the block tree, including the main chain as well as orphaned branches.'''
         method = "getchaintips"
@@ -184,13 +697,25 @@ class BitcoinRPC:
         params = [address,]
         return await self.call(method, params)
 
-    async def getrawtransaction(self, txid:str, verbose:bool=False, blockhash:str=None) -> dict:
-        '''Returns information about the transaction with the given txid'''
+    async def getrawtransaction(self, txid:str, verbose:bool=False, blockhash:str=None,
+                                binary:bool=False) -> Union[dict, str, Transaction]:
+        '''Returns information about the transaction with the given txid.
+        Without blockhash, the block of a confirmed transaction is looked up in the local txid index if any.
+        If binary is true, the serialized transaction is parsed locally into a Transaction instead.'''
         method = "getrawtransaction"
-        params = [txid, verbose,]
+        params = [txid, False if binary else verbose,]
+        located = None
+        if not blockhash and self.txindex is not None:
+            height = self.txindex.height_of(txid)
+            located = await self.getblockhash(height) if height is not None else None
+            blockhash = located if isinstance(located, str) else None
         if blockhash:
             params.append(blockhash)
-        return await self.call(method, params)
+        reply = await self.call(method, params)
+        if blockhash and blockhash == located and isinstance(reply, dict) and "code" in reply:
+            # the index may be behind a reorg or hold a colliding prefix, ask without the block
+            reply = await self.call(method, params[:2])
+        return Transaction.from_hex(reply) if binary and isinstance(reply, str) else reply
 
     async def gettxout(self, txid:str, n:int, include_mempool:bool=True):
         '''Returns details about an unspent transaction output (UTXO)'''
@@ -217,6 +742,13 @@ class BitcoinRPC:
         params = [checklevel, nblocks,]
         return await self.call(method, params)
 
+    async def iter_block_txs(self, blockhash:str) -> AsyncIterator[dict]:
+        '''Yields the decoded transactions of the block with the given hash one at a time, with bounded memory'''
+        method = "getblock"
+        params = [blockhash, 2,]
+        async for tx in self.__iter_result__(method, params, ("tx",)):
+            yield tx
+
     ######## UTILITIES ########
     async def validateaddress(self, address:str) -> dict:
         '''Returns information about the validity of the given address'''
@@ -252,28 +784,60 @@ class BitcoinRPC:
     ######## MEMORY POOL ########
     async def getmempoolinfo(self) -> dict:
         '''Returns information about the memory pool'''
+        if self.shared is not None:
+            info = self.shared.get("getmempoolinfo")
+            if info is not None:
+                return info
         method = "getmempoolinfo"
         return await self.call(method)
 
-    async def getrawmempool(self) -> list:
-        '''Returns list of txids in memory pool'''
+    async def getrawmempool(self, verbose:bool=False, mempool_sequence:bool=False, typed:bool=False) -> Union[list, dict]:
+        '''Returns list of txids in memory pool.
+        If verbose is true, returns an Object keyed by txid with information about each transaction,
+        a column store of them (structs.MempoolEntries) if typed is true.
+        If mempool_sequence is true, returns an Object with the txids and the mempool sequence value.'''
+        typed = typed and verbose and not mempool_sequence
+        if self.mempool is not None and self.mempool.synced:
+            entries = self.mempool.getrawmempool(verbose, mempool_sequence)
+            return structs.MempoolEntries(entries) if typed else entries
         method = "getrawmempool"
-        return await self.call(method)
+        params = [verbose, mempool_sequence,]
+        if typed:
+            return decode_typed(await self.call(method, params, raw=True), structs.MempoolEntries.decode)
+        return await self.call(method, params)
+
+    async def iter_mempool_verbose(self) -> AsyncIterator[Tuple[str, dict]]:
+        '''Yields (txid, entry) for every transaction in memory pool one at a time, with bounded memory'''
+        method = "getrawmempool"
+        params = [True,]
+        async for txid, entry in self.__iter_result__(method, params, ()):
+            yield txid, entry
 
-    async def getmempoolentry(self, txid:str) -> dict:
-        '''Returns information about the given txid'''
+    async def getmempoolentry(self, txid:str, typed:bool=False) -> dict:
+        '''Returns information about the given txid, a structs.MempoolEntryInfo if typed is true'''
+        if self.mempool is not None and self.mempool.synced:
+            entry = self.mempool.getmempoolentry(txid)
+            if not typed or "code" in entry:
+                return entry
+            return structs.convert(entry, structs.MempoolEntryInfo)
         method = "getmempoolentry"
         params = [txid,]
+        if typed:
+            return decode_typed(await self.call(method, params, raw=True), structs.decode, structs.MempoolEntryInfo)
         return await self.call(method, params)
 
     async def getmempoolancestors(self, txid:str, verbose:bool=False) -> list:
         '''Returns list containing mempool ancestors of the given txid'''
+        if self.mempool is not None and self.mempool.synced:
+            return self.mempool.getmempoolancestors(txid, verbose)
         method = "getmempoolancestors"
         params = [txid, verbose,]
         return await self.call(method, params)
 
     async def getmempooldescendants(self, txid:str, verbose:bool=False) -> list:
-        '''Returns list containing mempool ancestors of the given txid'''
+        '''Returns list containing mempool descendants of the given txid'''
+        if self.mempool is not None and self.mempool.synced:
+            return self.mempool.getmempooldescendants(txid, verbose)
         method = "getmempooldescendants"
         params = [txid, verbose, ]
         return await self.call(method, params)
@@ -296,7 +860,12 @@ class BitcoinRPC:
 
     ######## EXTERNAL QUERIES ########
     async def getsatoshis(self, wallet:str) -> int:
-        '''Returns the satoshi balance of given wallet'''
+        '''Returns the satoshi balance of given wallet, from the local address index once it is synced'''
+        if self.utxo is not None and self.utxo.synced:
+            try:
+                return self.utxo.balance(scriptpubkey(wallet))
+            except ValueError:
+                return {"code": -5, "message": "Invalid address"}
         url = f"https://blockchain.info/q/addressbalance/{wallet}"
         reply = await self.session.get(url)
         if reply.status == 200:
@@ -308,10 +877,252 @@ class BitcoinRPC:
         reply = await self.getblockchaininfo()
         return round(reply['size_on_disk'] / 2**30, 2) if reply else reply
 
-    async def getblockinfo(self, block:int, verbosity:int=2) -> dict:
-        '''Returns detailed info about given block height'''
-        blockhash = await self.getblockhash(block)
-        return await self.getblock(blockhash, verbosity)
+    async def getblockinfo(self, block:int, verbosity:int=2, raw:bool=False, binary:bool=False) -> dict:
+        '''Returns detailed info about given block height.
+        If binary is true, the block is parsed locally into a Block instead.'''
+        async with self.pinned():
+            blockhash = await self.getblockhash(block)
+            if not isinstance(blockhash, str):
+                return orjson.dumps(blockhash) if raw else blockhash
+            if binary:
+                return await self.getblockparsed(blockhash)
+            return await self.getblock(blockhash, verbosity, raw)
+
+    async def iter_blocks(self, start:int, stop:Optional[int]=None, verbosity:int=1, prefetch:int=RPC_PREFETCH,
+                          follow:bool=False, bus:EventBus=None) -> AsyncIterator[Union[dict, BlockDisconnected]]:
+        '''
+            Yields the blocks from height start to stop inclusive in height order, up to the tip if stop is None.
+            Up to prefetch blocks are fetched ahead, their getblockhash and getblock calls in flight together, and
+            no more until the caller takes the next one. If follow is true, waits for blocks past the tip (notified
+            on bus, polled otherwise) until stop, forever if None.
+            Each block has to link to the one before by its previousblockhash. When one doesn't, the blocks that
+            left the best chain are yielded as BlockDisconnected, tip first, and iteration resumes above the fork.
+        '''
+        if verbosity not in (1, 2, 3):
+            raise ValueError("iter_blocks needs verbosity 1 or more to check previousblockhash")
+        remembered = collections.deque(maxlen=RPC_REORG_DEPTH)    # (height, hash) of the last blocks yielded
+        window = collections.deque()    # tasks fetching the next blocks, in height order
+        wakeup = bus.subscribe("hashblock", "gap") if follow and bus is not None else None
+
+        async def fetch(height:int):
+            async with self.pinned():
+                # near the tip a cached hash could be of a block already replaced
+                if height <= best - HEADERS_CONFIRMATIONS:
+                    blockhash = await self.getblockhash(height)
+                else:
+                    blockhash = await self.call("getblockhash", [height], use_cache=False)
+                if not isinstance(blockhash, str):
+                    return blockhash
+                return await self.getblock(blockhash, verbosity)
+
+        async def tip() -> int:
+            count = await self.call("getblockcount", use_cache=False)
+            if not isinstance(count, int):
+                raise RPCError(count)
+            return count
+
+        async def rewind() -> List[BlockDisconnected]:
+            '''Forgets the blocks yielded that are no longer in the best chain, tip first'''
+            for task in window:
+                task.cancel()
+            window.clear()
+            disconnected = []
+            while remembered:
+                height, blockhash = remembered[-1]
+                if await self.call("getblockhash", [height], use_cache=False) == blockhash:
+                    break
+                disconnected.append(BlockDisconnected(*remembered.pop()))
+            if disconnected and not remembered:
+                logging.warning(f"reorg below the {RPC_REORG_DEPTH} blocks remembered, resuming at {disconnected[-1].height}")
+            return disconnected
+
+        height = start                  # of the next block to yield
+        best = -1                       # height of the tip last seen
+        unlinked = None                 # height of a block that didn't link to the one before, fetched again
+        try:
+            best = await tip()
+            last = stop if stop is not None or follow else best
+            while last is None or height <= last:
+                ahead = best if last is None else min(best, last)
+                while len(window) < prefetch and height + len(window) <= ahead:
+                    window.append(asyncio.ensure_future(fetch(height + len(window))))
+                if not window:
+                    best = await tip()
+                    if best >= height:
+                        continue
+                    if not follow:
+                        return
+                    if wakeup is None:
+                        await asyncio.sleep(RPC_FOLLOW_INTERVAL)
+                    else:
+                        try:
+                            await asyncio.wait_for(wakeup.get(), RPC_FOLLOW_INTERVAL)
+                        except asyncio.TimeoutError:
+                            pass
+                    # the tip may have been replaced without the chain growing
+                    disconnected = await rewind()
+                    for event in disconnected:
+                        yield event
+                    height = disconnected[-1].height if disconnected else height
+                    best = await tip()
+                    continue
+                block = await window.popleft()
+                if not isinstance(block, dict) or "hash" not in block:
+                    # past a tip that moved back, or a block the node can't serve
+                    disconnected = await rewind()
+                    for event in disconnected:
+                        yield event
+                    best = await tip()
+                    if not disconnected and height <= best:
+                        raise RPCError(block if isinstance(block, dict) else {"code": None, "message": f"No block at {height}"})
+                    height = disconnected[-1].height if disconnected else height
+                    continue
+                if remembered and block.get("previousblockhash") != remembered[-1][1]:
+                    disconnected = await rewind()
+                    for event in disconnected:
+                        yield event
+                    if not disconnected and unlinked == height:
+                        # fetched again from the best chain, it still doesn't link
+                        raise RPCError({"code": None, "message": f"Block {block['hash']} doesn't link to {remembered[-1][1]}"})
+                    unlinked = height
+                    height = disconnected[-1].height if disconnected else height
+                    best = await tip()
+                    continue
+                unlinked = None
+                remembered.append((height, block["hash"]))
+                height += 1
+                yield block
+        finally:
+            for task in window:
+                task.cancel()
+            if wakeup is not None:
+                bus.unsubscribe(wakeup, "hashblock", "gap")
+
+
+class RPCBatch:
+    '''
+        Queues calls made through the typed BitcoinRPC methods and sends them together.
+        Each typed method returns a task which is resolved once the batch is sent.
+
+            async with rpc.batch() as b:
+                hashes = [b.getblockhash(height) for height in range(500)]
+            hashes = [task.result() for task in hashes]
+
+        Derived methods that depend on earlier results (e.g. getblockinfo) are sent in further rounds.
+    '''
+    EXCLUDED = {"close", "call_many", "batch"}
+
+    def __init__(self, rpc:BitcoinRPC) -> None:
+        self.rpc = rpc
+        self.queue = []     # (method, params, future, task) waiting to be sent
+        self.tasks = []     # typed calls scheduled through this batch
+        self.queued = asyncio.Event()
+
+    async def __aenter__(self) -> 'RPCBatch':
+        '''Upon entry if being used as context manager'''
+        return self
+
+    async def __aexit__(self, exc_type, *args, **kwargs) -> None:
+        '''Upon exit sends the queued calls, or cancels them if the block raised'''
+        if exc_type is not None:
+            for task in self.tasks:
+                task.cancel()
+            for _, _, future, _ in self.queue:
+                future.cancel()
+            return
+        await self.flush()
+
+    def __getattr__(self, name:str):
+        '''Wraps typed BitcoinRPC methods so their calls are queued on this batch'''
+        attr = None if name.startswith('_') else getattr(type(self.rpc), name, None)
+        if name in self.EXCLUDED or not inspect.iscoroutinefunction(attr):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        def schedule(*args, **kwargs) -> Union[asyncio.Task, Coroutine]:
+            coro = attr(self, *args, **kwargs)
+            if asyncio.current_task() in self.tasks:
+                # nested call from a derived method, awaited directly by its caller
+                return coro
+            task = asyncio.ensure_future(coro)
+            self.tasks.append(task)
+            return task
+        return schedule
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        '''Session of the underlying client, used by non RPC queries'''
+        return self.rpc.session
+
+    def __rest__(self, path:str):
+        '''REST queries are sent right away by the underlying client'''
+        return self.rpc.__rest__(path)
+
+    def pinned(self):
+        '''Pinning is left to the underlying client, batched calls are sent together anyway'''
+        return self.rpc.pinned()
+
+    @property
+    def headers(self) -> Optional[HeaderStore]:
+        '''Header store of the underlying client'''
+        return self.rpc.headers
+
+    @property
+    def mempool(self) -> Optional[MempoolMirror]:
+        '''Mempool mirror of the underlying client'''
+        return self.rpc.mempool
+
+    @property
+    def utxo(self) -> Optional[UTXOIndex]:
+        '''Address index of the underlying client'''
+        return self.rpc.utxo
+
+    @property
+    def txindex(self) -> Optional[TxIndex]:
+        '''Txid index of the underlying client'''
+        return self.rpc.txindex
+
+    @property
+    def shared(self) -> Optional[SharedState]:
+        '''Shared snapshots of the underlying client'''
+        return self.rpc.shared
+
+    async def call(self, method:str, params:list=None, raw:bool=False):
+        '''Queues the call and returns its result once the batch has been sent'''
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((method, params, future, asyncio.current_task()))
+        self.queued.set()
+        result = await future
+        return orjson.dumps(result) if raw else result
+
+    async def send(self) -> None:
+        '''Sends all queued calls and resolves their futures'''
+        queue, self.queue = self.queue, []
+        try:
+            results = await self.rpc.call_many([(method, params) for method, params, *_ in queue])
+        except Exception as exc:
+            for _, _, future, _ in queue:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, _, future, _), result in zip(queue, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def flush(self) -> None:
+        '''Sends queued calls in rounds until every scheduled typed call has finished'''
+        while True:
+            pending = {task for task in self.tasks if not task.done()}
+            if not pending:
+                break
+            running = pending - {task for *_, task in self.queue}
+            if not running:
+                # every unfinished call is waiting on this batch
+                await self.send()
+                continue
+            self.queued.clear()
+            waiter = asyncio.ensure_future(self.queued.wait())
+            await asyncio.wait([*running, waiter], return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
 
 
 if __name__ == "__main__":
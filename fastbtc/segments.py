@@ -0,0 +1,286 @@
+import os
+import struct
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+
+
+SEGMENT_BUFFER = 500_000                # records buffered in memory before they are written as a segment
+SEGMENT_MERGE_CHUNK = 1_000_000         # records of each segment held in memory at a time while merging
+
+
+class SortedSegments:
+    '''
+        Table of fixed width records sorted by a 64 bit key then a 64 bit sub key, kept in immutable
+        memory-mapped segment files plus an in-memory buffer of recent writes. A segment stores its keys in
+        <sequence>.keys.npy, contiguous so they are bisected in place, and the rest of its records in <sequence>.npy.
+        The latest version of a (key, sub) record wins, deletions are written as records with live set to 0
+        and dropped when merged into the oldest segment. The newest segments are merged while a segment is
+        at most twice the size of the next, so lookups bisect about log2(records / SEGMENT_BUFFER) segments.
+        Segment files are never rewritten, a merge writes a new one before removing the two it replaces (the older
+        first), so a readonly table following another process's writes sees the same records whenever it reloads.
+        A table without subkey stores one record per key and leaves the sub key out of the records, which are then
+        (key, live, *fields), its sub key arguments must be 0.
+    '''
+    def __init__(self, path:str, fields:List[Tuple[str, str]], buffer:int=SEGMENT_BUFFER, readonly:bool=False,
+                 subkey:bool=True) -> None:
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.readonly = readonly
+        self.subkey = subkey
+        self.row = np.dtype(([("sub", "<u8")] if subkey else []) + [("live", "u1")] + fields)  # stored after the keys
+        self.dtype = np.dtype([("key", "<u8")] + self.row.descr)
+        self.live = 2 if subkey else 1  # position of live in a record tuple
+        self.empty = tuple(np.zeros(1, self.dtype)[0].item())[self.live + 1:]    # field values of a deletion
+        self.buffer = {}                # key -> sub -> record tuple
+        self.pending = 0                # records in the buffer
+        self.limit = buffer
+        self.segments = []              # (sequence, memory-mapped records, memory-mapped keys) oldest first
+        if not readonly:
+            for name in os.listdir(path):
+                if name.endswith(".tmp"):
+                    os.remove(os.path.join(path, name))
+        self.reload()
+        if not readonly:
+            # segments left by a merge interrupted before removing the ones it replaced
+            self.compact()
+
+    def __len__(self) -> int:
+        '''Records stored, counting versions and deletions not merged away yet'''
+        return sum(len(segment) for _, segment, _ in self.segments) + self.pending
+
+    def reload(self) -> None:
+        '''Maps the segments written since the last reload and forgets the removed ones'''
+        mapped = {sequence: segment for sequence, *segment in self.segments}
+        segments = []
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".npy") or name.endswith(".keys.npy"):
+                continue
+            sequence = int(name[:-4])
+            if sequence in mapped:
+                segments.append((sequence, *mapped[sequence]))
+                continue
+            try:
+                rows = np.load(self.segment_path(sequence), mmap_mode="r")
+                if rows.dtype != self.row:
+                    raise ValueError(f"segment {name} in {self.path} has records of another layout, rebuild it")
+                keys = np.load(self.keys_path(sequence), mmap_mode="r")
+            except FileNotFoundError:
+                # merged away by the writer meanwhile
+                continue
+            segments.append((sequence, rows, keys))
+        self.segments = segments
+
+    def segment_path(self, sequence:int) -> str:
+        return os.path.join(self.path, f"{sequence:012d}.npy")
+
+    def keys_path(self, sequence:int) -> str:
+        return os.path.join(self.path, f"{sequence:012d}.keys.npy")
+
+    ######## UPDATES ########
+    def record(self, key:int, sub:int, live:int, values:tuple) -> tuple:
+        return (key, sub, live, *values) if self.subkey else (key, live, *values)
+
+    def put(self, key:int, sub:int, *values) -> None:
+        self.buffered(key, sub)[sub] = self.record(key, sub, 1, values)
+
+    def delete(self, key:int, sub:int) -> None:
+        self.buffered(key, sub)[sub] = self.record(key, sub, 0, self.empty)
+
+    def buffered(self, key:int, sub:int) -> dict:
+        '''Returns the buffered records of key, counting the one of sub if it is new'''
+        subs = self.buffer.get(key)
+        if subs is None:
+            subs = self.buffer[key] = {}
+        if sub not in subs:
+            self.pending += 1
+        return subs
+
+    def full(self) -> bool:
+        '''Returns whether the buffer should be flushed'''
+        return self.pending >= self.limit
+
+    @staticmethod
+    def save(path:str, array:np.ndarray) -> None:
+        '''Writes array to path atomically'''
+        with open(path + ".tmp", "wb") as file:
+            np.save(file, array)
+        os.replace(path + ".tmp", path)
+
+    def write(self, sequence:int, records:np.ndarray) -> Tuple[int, np.ndarray, np.ndarray]:
+        '''Writes records as the segment with the given sequence and maps it, the keys first'''
+        self.save(self.keys_path(sequence), np.ascontiguousarray(records["key"]))
+        rows = np.empty(len(records), self.row)
+        for name in self.row.names:
+            rows[name] = records[name]
+        self.save(self.segment_path(sequence), rows)
+        return sequence, np.load(self.segment_path(sequence), mmap_mode="r"), np.load(self.keys_path(sequence), mmap_mode="r")
+
+    def join(self, keys:np.ndarray, rows:np.ndarray) -> np.ndarray:
+        '''Returns the records of the given keys and rows of a segment'''
+        records = np.empty(len(keys), self.dtype)
+        records["key"] = keys
+        for name in self.row.names:
+            records[name] = rows[name]
+        return records
+
+    def flush(self) -> None:
+        '''Writes the buffered records as a new segment and merges the newest segments'''
+        if not self.buffer:
+            return
+        records = np.array(
+            [subs[sub] for key, subs in sorted(self.buffer.items()) for sub in sorted(subs)], dtype=self.dtype
+        )
+        sequence = self.segments[-1][0] + 1 if self.segments else 0
+        # a new list, lookups on another thread keep iterating the one they started with
+        self.segments = self.segments + [self.write(sequence, records)]
+        self.buffer = {}
+        self.pending = 0
+        self.compact()
+
+    def compact(self) -> None:
+        '''Merges the newest segments while one is at most twice the size of the next'''
+        while len(self.segments) > 1 and len(self.segments[-2][1]) <= 2 * len(self.segments[-1][1]):
+            self.merge()
+
+    def merge(self) -> None:
+        '''
+            Merges the two newest segments into a new one, streaming both SEGMENT_MERGE_CHUNK records at a time
+            so only a chunk of each is ever in memory rather than the mapped files
+        '''
+        (older, old_rows, old_keys), (newer, new_rows, new_keys) = self.segments[-2:]
+        # nothing older is left for a deletion to hide
+        oldest = len(self.segments) == 2
+        sequence = newer + 1
+        capacity = len(old_keys) + len(new_keys)
+        with SegmentWriter(self.keys_path(sequence), old_keys.dtype, capacity) as keys_file, \
+             SegmentWriter(self.segment_path(sequence), self.row, capacity) as rows_file:
+            i = j = 0
+            while i < len(old_keys) or j < len(new_keys):
+                # up to the smallest key a chunk ahead in either segment, so the versions of a key stay together
+                bounds = [keys[start + SEGMENT_MERGE_CHUNK - 1] for keys, start in ((old_keys, i), (new_keys, j))
+                          if start + SEGMENT_MERGE_CHUNK <= len(keys)]
+                if bounds:
+                    bound = min(bounds)
+                    old_end = int(np.searchsorted(old_keys, bound, 'right'))
+                    new_end = int(np.searchsorted(new_keys, bound, 'right'))
+                else:
+                    old_end, new_end = len(old_keys), len(new_keys)
+                keys = np.concatenate((old_keys[i:old_end], new_keys[j:new_end]))
+                rows = np.concatenate((old_rows[i:old_end], new_rows[j:new_end]))
+                # stable, the newer version comes last
+                order = np.lexsort((rows["sub"], keys)) if self.subkey else np.argsort(keys, kind="stable")
+                keys, rows = keys[order], rows[order]
+                last = np.ones(len(keys), dtype=bool)
+                last[:-1] = keys[1:] != keys[:-1]
+                if self.subkey:
+                    last[:-1] |= rows["sub"][1:] != rows["sub"][:-1]
+                if oldest:
+                    last &= rows["live"] == 1
+                keys_file.write(keys[last])
+                rows_file.write(rows[last])
+                i, j = old_end, new_end
+        merged = (sequence, np.load(self.segment_path(sequence), mmap_mode="r"),
+                  np.load(self.keys_path(sequence), mmap_mode="r"))
+        self.segments = self.segments[:-2] + [merged]
+        # the older first, a deletion in the newer may hide one of its records from a reader
+        for sequence in (older, newer):
+            os.remove(self.segment_path(sequence))
+            os.remove(self.keys_path(sequence))
+
+    ######## LOOKUPS ########
+    def get(self, key:int, sub:int) -> Optional[tuple]:
+        '''Returns the live record (key, sub, live, *fields), or (key, live, *fields) without subkey, or None'''
+        record = self.buffer.get(key, {}).get(sub)
+        if record is not None:
+            return record if record[self.live] else None
+        for _, segment, keys in reversed(self.segments):
+            start, stop = int(np.searchsorted(keys, key, 'left')), int(np.searchsorted(keys, key, 'right'))
+            if start == stop:
+                continue
+            i = start + int(np.searchsorted(segment["sub"][start:stop], sub)) if self.subkey else start
+            if i < stop and (not self.subkey or segment["sub"][i] == sub):
+                record = (key, *segment[i].item())
+                return record if record[self.live] else None
+        return None
+
+    def find(self, key:int) -> np.ndarray:
+        '''Returns the live records with key, sorted by sub key'''
+        return self.find_many([key])[0]
+
+    def find_many(self, keys:Sequence[int]) -> List[np.ndarray]:
+        '''Returns the live records of each key, bisecting every segment for all keys at once'''
+        keys = np.asarray(keys, dtype=np.uint64)
+        parts = [[] for _ in range(len(keys))]
+        for _, segment, segment_keys in self.segments:
+            starts = np.searchsorted(segment_keys, keys, 'left')
+            stops = np.searchsorted(segment_keys, keys, 'right')
+            for n in np.flatnonzero(stops > starts):
+                parts[n].append(self.join(segment_keys[starts[n]:stops[n]], segment[starts[n]:stops[n]]))
+        for n, key in enumerate(keys.tolist()):
+            subs = self.buffer.get(key)
+            if subs:
+                parts[n].append(np.array(sorted(subs.values()), dtype=self.dtype))
+        return [self.latest(part) for part in parts]
+
+    def latest(self, parts:List[np.ndarray]) -> np.ndarray:
+        '''Returns the live latest versions among the records of one key, given oldest first'''
+        if not parts:
+            return np.empty(0, self.dtype)
+        records = np.concatenate(parts)
+        if len(parts) > 1 and not self.subkey:
+            records = records[-1:]
+        elif len(parts) > 1:
+            records = records[np.argsort(records["sub"], kind="stable")]
+            last = np.ones(len(records), dtype=bool)
+            last[:-1] = records["sub"][1:] != records["sub"][:-1]
+            records = records[last]
+        return records[records["live"] == 1]
+
+    def close(self) -> None:
+        '''Writes the buffered records'''
+        self.flush()
+
+
+class SegmentWriter:
+    '''
+        Writes a one dimensional .npy file of at most capacity records a chunk at a time, under a temporary name
+        until it is complete. The header is written for capacity records and rewritten with the final count,
+        padded to the same length, once the records are written.
+    '''
+    def __init__(self, path:str, dtype:np.dtype, capacity:int) -> None:
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self.size = len(self.header(capacity))
+        self.file = open(path + ".tmp", "wb")
+        self.file.write(self.header(capacity))
+
+    def header(self, count:int, size:int=0) -> bytes:
+        '''Returns a version 1.0 header of count records, padded to size bytes or to a multiple of 64'''
+        text = repr({"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False, "shape": (count,)})
+        # magic, version and length before the text, a newline after it
+        size = size or -(-(10 + len(text) + 1) // 64) * 64
+        return np.lib.format.magic(1, 0) + struct.pack("<H", size - 10) + text.encode().ljust(size - 11) + b"\n"
+
+    def write(self, records:np.ndarray) -> None:
+        self.file.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+        self.count += len(records)
+
+    def __enter__(self) -> "SegmentWriter":
+        return self
+
+    def __exit__(self, kind, error, traceback) -> None:
+        try:
+            if kind is None:
+                self.file.seek(0)
+                self.file.write(self.header(self.count, self.size))
+        finally:
+            self.file.close()
+        if kind is None:
+            os.replace(self.path + ".tmp", self.path)
+        else:
+            os.remove(self.path + ".tmp")
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
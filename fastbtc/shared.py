@@ -0,0 +1,238 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+import orjson
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+
+SHARED_PATH = os.getenv("FASTBTC_SHARED_PATH")  # file of the snapshots shared by worker processes, e.g. /dev/shm/fastbtc
+SHARED_INTERVAL = 2.0                   # seconds between snapshots, a block notification triggers one sooner
+SHARED_POLL = 0.25                      # seconds between checks of the published tip by the other workers
+SHARED_MAX_AGE = 10.0                   # seconds after which readers stop trusting a snapshot, the writer may be gone
+SHARED_RECENT_BLOCKS = 6                # blocks below the tip kept at verbosity 1
+SHARED_RETRIES = 8                      # reads of a slot being rewritten before giving up
+
+# snapshot topics and the bytes reserved for each, a snapshot that doesn't fit is not published
+SHARED_TOPICS = {
+    "getblockchaininfo": 16 * 2**10,
+    "getmempoolinfo": 4 * 2**10,
+    "getpeerinfo": 2 * 2**20,
+    "blocks": 16 * 2**20,
+}
+
+MAGIC = b"FBTCSHM1"
+HEADER = struct.Struct("<8sQ")          # magic, size of the layout it was created with
+SLOT = struct.Struct("<QId")            # sequence, odd while written, then length and publication time of the JSON
+
+
+class SharedState:
+    '''
+        Snapshots of node state published by one process and read by the others through a shared memory-mapped file.
+        Each topic has a slot guarded by a sequence lock: the writer makes the sequence odd, writes the JSON and
+        makes it even again. Readers never block it, they parse the JSON straight from the map and retry if the
+        sequence changed meanwhile. The process holding the lock file is the writer, the others take over when it
+        exits. Decoded snapshots are kept per sequence so readers only parse a new version once.
+    '''
+    def __init__(self, path:str, topics:Dict[str, int]=SHARED_TOPICS) -> None:
+        self.path = path
+        self.slots = {}                 # topic -> (offset of the slot, capacity)
+        offset = HEADER.size
+        for topic, capacity in topics.items():
+            self.slots[topic] = (offset, capacity)
+            offset += SLOT.size + capacity
+        self.size = offset
+        self.decoded = {}               # topic -> (sequence, value)
+        self.map = None
+        self.lock = None                # lock file, held by the writer
+        self.stats = {"hits": 0, "stale": 0, "retries": 0, "published": 0, "oversized": 0}
+        self.attach()
+
+    @property
+    def writer(self) -> bool:
+        return self.lock is not None
+
+    def attach(self) -> bool:
+        '''Maps the snapshots read-only once the writer created them, returns whether they are mapped.
+        Only the writer resizes the file, a reader doing so could cut it short under the writer's map.'''
+        if self.map is not None:
+            return True
+        try:
+            with open(self.path, "rb") as file:
+                if os.fstat(file.fileno()).st_size != self.size:
+                    return False
+                mapped = mmap.mmap(file.fileno(), self.size, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return False
+        if HEADER.unpack_from(mapped, 0) != (MAGIC, self.size):
+            mapped.close()
+            return False
+        self.map = mapped
+        return True
+
+    def elect(self) -> bool:
+        '''Becomes the writer if no other process is, returns whether this one is'''
+        if self.lock is not None:
+            return True
+        lock = open(self.path + ".lock", "a+b")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        self.lock = lock
+        with open(self.path, "a+b") as file:
+            if os.fstat(file.fileno()).st_size != self.size:
+                # created, or left by a different layout
+                file.truncate(self.size)
+            mapped = mmap.mmap(file.fileno(), self.size)
+        if HEADER.unpack_from(mapped, 0) != (MAGIC, self.size):
+            mapped[:] = bytes(self.size)
+            HEADER.pack_into(mapped, 0, MAGIC, self.size)
+        if self.map is not None:
+            self.map.close()
+        self.map = mapped
+        logging.info(f"publishing shared snapshots to {self.path}")
+        return True
+
+    ######## READS ########
+    def get(self, topic:str, max_age:float=SHARED_MAX_AGE) -> Any:
+        '''Returns the latest snapshot of topic, None if there is none younger than max_age seconds'''
+        offset, _ = self.slots[topic]
+        if not self.attach():
+            self.stats["stale"] += 1
+            return None
+        for _ in range(SHARED_RETRIES):
+            sequence, length, published = SLOT.unpack_from(self.map, offset)
+            if sequence == 0 or time.time() - published > max_age:
+                self.stats["stale"] += 1
+                return None
+            cached = self.decoded.get(topic)
+            if cached is not None and cached[0] == sequence:
+                self.stats["hits"] += 1
+                return cached[1]
+            if not sequence & 1:
+                start = offset + SLOT.size
+                try:
+                    value = orjson.loads(memoryview(self.map)[start:start + length])
+                except orjson.JSONDecodeError:
+                    value = None
+                if SLOT.unpack_from(self.map, offset)[0] == sequence:
+                    self.decoded[topic] = (sequence, value)
+                    self.stats["hits"] += 1
+                    return value
+            self.stats["retries"] += 1
+        return None
+
+    def block(self, blockhash:str) -> Optional[dict]:
+        '''Returns one of the recent blocks at verbosity 1, None if it isn't one or the tip they were taken at changed'''
+        info = self.get("getblockchaininfo")
+        blocks = self.get("blocks", max_age=float('inf'))
+        if info is None or not blocks or blocks[0]["hash"] != info["bestblockhash"]:
+            return None
+        return next((block for block in blocks if block["hash"] == blockhash), None)
+
+    ######## WRITES ########
+    def put(self, topic:str, value:Any) -> bool:
+        '''Publishes a snapshot of topic, returns False if it doesn't fit its slot'''
+        offset, capacity = self.slots[topic]
+        data = orjson.dumps(value)
+        if len(data) > capacity:
+            self.stats["oversized"] += 1
+            logging.warning(f"shared {topic} snapshot of {len(data)} bytes exceeds its {capacity} bytes")
+            return False
+        sequence = SLOT.unpack_from(self.map, offset)[0]
+        sequence += 1 if sequence & 1 == 0 else 2
+        struct.pack_into("<Q", self.map, offset, sequence)
+        start = offset + SLOT.size
+        self.map[start:start + len(data)] = data
+        struct.pack_into("<Id", self.map, offset + 8, len(data), time.time())
+        struct.pack_into("<Q", self.map, offset, sequence + 1)
+        self.stats["published"] += 1
+        return True
+
+    async def publish(self, rpc) -> None:
+        '''Takes and publishes the snapshots of every topic'''
+        info, peers, mempool = await asyncio.gather(
+            rpc.call("getblockchaininfo", use_cache=False), rpc.call("getpeerinfo"), rpc.call("getmempoolinfo"),
+        )
+        if isinstance(peers, list):
+            self.put("getpeerinfo", peers)
+        if isinstance(mempool, dict) and "code" not in mempool:
+            self.put("getmempoolinfo", mempool)
+        if not isinstance(info, dict) or "bestblockhash" not in info:
+            return
+        blocks = self.get("blocks", max_age=float('inf'))
+        if not blocks or blocks[0].get("hash") != info["bestblockhash"]:
+            blocks = await self.recent(rpc, info["bestblockhash"])
+            if blocks is not None:
+                self.put("blocks", blocks)
+        # last, readers take the tip from it and look for its block in the recent ones
+        self.put("getblockchaininfo", info)
+
+    async def recent(self, rpc, blockhash:str) -> Optional[list]:
+        '''Returns the tip block and the ones below it at verbosity 1, tip first'''
+        async with rpc.pinned():
+            blocks = []
+            while blockhash and len(blocks) < SHARED_RECENT_BLOCKS:
+                block = await rpc.call("getblock", [blockhash, 1], use_cache=False)
+                if not isinstance(block, dict) or "hash" not in block:
+                    return None
+                blocks.append(block)
+                blockhash = block.get("previousblockhash")
+        return blocks
+
+    def watch(self, bus, tip:Optional[str]) -> Optional[str]:
+        '''Publishes the best block of the writer's snapshot on bus as a hashblock notification if it isn't tip,
+        for the workers without ZMQ notifications. Returns the best block to compare the next snapshot with.'''
+        info = self.get("getblockchaininfo")
+        if info is None:
+            return tip
+        if tip is not None and info["bestblockhash"] != tip:
+            bus.publish("hashblock", info["bestblockhash"])
+        return info["bestblockhash"]
+
+    async def follow(self, rpc, bus) -> None:
+        '''Publishes snapshots every SHARED_INTERVAL while this process is the writer. Otherwise notifies the blocks
+        the writer publishes on bus, checking every SHARED_POLL for a new one and for whether it became the writer.'''
+        wake = asyncio.Event()
+
+        async def notify():
+            async for _ in bus.listen("hashblock", "gap"):
+                wake.set()
+        listener = asyncio.ensure_future(notify())
+        tip = None
+        try:
+            while True:
+                timeout = SHARED_POLL
+                if self.elect():
+                    timeout = SHARED_INTERVAL
+                    try:
+                        await self.publish(rpc)
+                    except Exception as exc:
+                        logging.warning(f"shared snapshots not published: {exc!r}")
+                else:
+                    tip = self.watch(bus, tip)
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+        finally:
+            listener.cancel()
+
+    def close(self) -> None:
+        '''Unmaps the snapshots and gives up writing them'''
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
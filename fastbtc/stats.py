@@ -0,0 +1,256 @@
+import os
+import asyncio
+import logging
+import numpy as np
+from typing import Dict, Optional
+
+
+STATS_DIR = os.getenv("FASTBTC_STATS_DIR")      # directory of the local block stats store, disabled if unset
+STATS_SYNC_BATCH = 10_000               # heights ingested between flushes to disk
+STATS_BATCH_SIZE = 100                  # getblockstats calls per JSON-RPC batch, each one can take a while on the node
+STATS_RETRY = 5.0                       # seconds before retrying a failed sync
+STATS_REORG_DEPTH = 6                   # heights below the stored tip checked against the node's chain on every sync
+STATS_GROWTH = 2**16                    # heights allocated at a time when the columns grow
+STATS_PERCENTILES = (10, 25, 50, 75, 90)
+
+# getblockstats fields kept, all integers in satoshis, bytes, weight units or seconds
+STATS_COLUMNS = (
+    "avgfee", "avgfeerate", "avgtxsize", "ins", "maxfee", "maxfeerate", "maxtxsize", "medianfee", "mediantime",
+    "mediantxsize", "minfee", "minfeerate", "mintxsize", "outs", "subsidy", "swtotal_size", "swtotal_weight", "swtxs",
+    "time", "total_out", "total_size", "total_weight", "totalfee", "txs", "utxo_increase", "utxo_size_inc",
+) + tuple(f"feerate_p{percentile}" for percentile in STATS_PERCENTILES)
+
+# status of a height
+MISSING = 0                             # not ingested yet
+STORED = 1
+UNAVAILABLE = 2                         # the node can't compute it, e.g. pruned
+
+AGGREGATES = ("mean", "sum", "min", "max", "count", "median")       # and p<percentile>, e.g. p90
+
+
+def prefix(blockhash:str) -> int:
+    '''Returns the leading 8 bytes of a block hash, kept to detect reorgs'''
+    return int(blockhash[:16], 16)
+
+
+def aggregate(values:np.ndarray, starts:np.ndarray, agg:str) -> np.ndarray:
+    '''Reduces the groups of values beginning at starts'''
+    counts = np.diff(np.append(starts, len(values)))
+    if agg == "sum":
+        return np.add.reduceat(values, starts)
+    if agg == "mean":
+        return np.add.reduceat(values, starts, dtype=np.float64) / counts
+    if agg == "min":
+        return np.minimum.reduceat(values, starts)
+    if agg == "max":
+        return np.maximum.reduceat(values, starts)
+    if agg == "count":
+        return counts
+    percentile = 50 if agg == "median" else float(agg[1:])
+    if len(counts) and (counts[:-1] == counts[0]).all():
+        # groups of step heights, all but the last one have the same size
+        full = (len(counts) - 1) * counts[0]
+        head = np.percentile(values[:full].reshape(-1, counts[0]), percentile, axis=1) if full else []
+        return np.append(head, np.percentile(values[full:], percentile))
+    return np.array([np.percentile(group, percentile) for group in np.split(values, starts[1:])])
+
+
+def valid_aggregate(agg:str) -> bool:
+    if agg in AGGREGATES:
+        return True
+    try:
+        return agg[0] == "p" and 0 <= float(agg[1:]) <= 100
+    except (IndexError, ValueError):
+        return False
+
+
+class BlockStatsStore:
+    '''
+        Local store of getblockstats results, one memory-mapped int64 column per stat indexed by height.
+            <stat>.dat   values of the stat, 8 bytes per height
+            hash.dat     leading 8 bytes of the block hash, to detect reorgs
+            status.dat   MISSING, STORED or UNAVAILABLE, 1 byte per height
+        Each block is asked to the node once, range queries then reduce the columns in process.
+    '''
+    def __init__(self, path:str) -> None:
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.columns = {}               # stat -> np.memmap
+        self.hashes = None
+        self.status = None
+        self.capacity = 0
+        self.length = 0                 # heights of the chain as of the last sync
+        self.map(max(self.size(), STATS_GROWTH))
+        self.load_length()
+
+    def size(self) -> int:
+        return os.path.getsize(self.file("status")) if os.path.exists(self.file("status")) else 0
+
+    def load_length(self) -> None:
+        stored = np.flatnonzero(self.status)
+        self.length = int(stored[-1]) + 1 if len(stored) else 0
+
+    def reload(self) -> None:
+        '''Maps the columns again if another process grew them and takes the heights it stored'''
+        if self.size() > self.capacity:
+            self.map(self.size())
+        self.load_length()
+
+    def file(self, name:str) -> str:
+        return os.path.join(self.path, f"{name}.dat")
+
+    def column(self, name:str, dtype) -> np.memmap:
+        '''Maps the file of a column, growing it to capacity'''
+        path = self.file(name)
+        size = self.capacity * np.dtype(dtype).itemsize
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as file:
+            if os.fstat(file.fileno()).st_size < size:
+                file.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=(self.capacity,))
+
+    def map(self, capacity:int) -> None:
+        '''Maps every column with room for capacity heights'''
+        self.flush()
+        self.capacity = -(-capacity // STATS_GROWTH) * STATS_GROWTH
+        self.columns = {name: self.column(name, np.int64) for name in STATS_COLUMNS}
+        self.hashes = self.column("hash", np.uint64)
+        self.status = self.column("status", np.uint8)
+
+    def flush(self) -> None:
+        for mapped in (*self.columns.values(), self.hashes, self.status):
+            if mapped is not None:
+                mapped.flush()
+
+    @property
+    def height(self) -> int:
+        '''Height of the chain tip as of the last sync, -1 when empty'''
+        return self.length - 1
+
+    def stored(self) -> int:
+        '''Returns the number of heights whose stats are stored'''
+        return int(np.count_nonzero(self.status[:self.length] == STORED))
+
+    ######## UPDATES ########
+    def resize(self, length:int) -> None:
+        '''Follows the chain to length heights, forgetting the stats of heights beyond it'''
+        if length > self.capacity:
+            self.map(length)
+        self.status[length:self.length] = MISSING
+        self.length = length
+
+    def put(self, height:int, stats:dict) -> None:
+        '''Stores the getblockstats result of a height'''
+        for name in STATS_COLUMNS:
+            if name.startswith("feerate_p"):
+                continue
+            self.columns[name][height] = stats.get(name) or 0
+        for percentile, value in zip(STATS_PERCENTILES, stats.get("feerate_percentiles") or ()):
+            self.columns[f"feerate_p{percentile}"][height] = value
+        self.hashes[height] = prefix(stats["blockhash"])
+        self.status[height] = STORED
+
+    async def check_reorg(self, rpc, tip:int) -> int:
+        '''Marks the heights near the stored tip whose block left the node's best chain as missing.
+        Returns the number of heights marked.'''
+        heights = range(max(min(self.height, tip) - STATS_REORG_DEPTH + 1, 0), min(self.height, tip) + 1)
+        hashes = await rpc.call_many([("getblockhash", [height]) for height in heights])
+        stale = [
+            height for height, blockhash in zip(heights, hashes)
+            if isinstance(blockhash, str) and self.status[height] == STORED and self.hashes[height] != prefix(blockhash)
+        ]
+        self.status[stale] = MISSING
+        return len(stale)
+
+    async def sync(self, rpc, batch:int=STATS_SYNC_BATCH) -> int:
+        '''Ingests the stats of every height not stored yet, fetching them as pipelined JSON-RPC batches.
+        Returns the number of heights stored.'''
+        async with rpc.pinned():
+            tip = await rpc.call("getblockcount", use_cache=False)
+            if not isinstance(tip, int):
+                return 0
+            stale = await self.check_reorg(rpc, tip)
+            if stale:
+                logging.info(f"block stats store dropping {stale} heights no longer in the best chain")
+        self.resize(tip + 1)
+        missing = np.flatnonzero(self.status[:self.length] == MISSING)
+        stored = 0
+        for i in range(0, len(missing), batch):
+            heights = missing[i:i + batch].tolist()
+            calls = [("getblockstats", [height]) for height in heights]
+            replies = iter(heights)
+            try:
+                async for stats, error in rpc.iter_many(calls, STATS_BATCH_SIZE):
+                    height = next(replies)
+                    if error is None and isinstance(stats, dict):
+                        self.put(height, stats)
+                        stored += 1
+                    elif error and error.get("code") == -1:
+                        # RPC_MISC_ERROR, the block or its undo data was pruned
+                        self.status[height] = UNAVAILABLE
+            finally:
+                # keeps what was stored when a batch fails, the next sync resumes from there
+                self.flush()
+        return stored
+
+    async def follow(self, rpc, bus) -> None:
+        '''Syncs now and whenever a block notification is received, a failed sync is retried every STATS_RETRY'''
+        queue = bus.subscribe("hashblock", "gap")
+        try:
+            while True:
+                timeout = None
+                try:
+                    await self.sync(rpc)
+                except Exception as exc:
+                    logging.warning(f"block stats sync failed: {exc!r}")
+                    timeout = STATS_RETRY
+                try:
+                    await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                # one sync catches up with every block notified meanwhile
+                while not queue.empty():
+                    queue.get_nowait()
+        finally:
+            bus.unsubscribe(queue, "hashblock", "gap")
+
+    ######## QUERIES ########
+    def query(self, stat:str, start:int=0, stop:Optional[int]=None, step:int=1, period:Optional[int]=None,
+              agg:str="mean", window:Optional[int]=None) -> Dict[str, np.ndarray]:
+        '''
+            Returns the stored values of stat for heights start to stop inclusive, with the height and median time
+            each value starts at. Values are reduced with agg over groups of step heights, or of period seconds of
+            median time, then smoothed by a rolling mean over window values.
+            Raises ValueError for an unknown stat or aggregate.
+        '''
+        column = self.columns.get(stat)
+        if column is None:
+            raise ValueError(f"Unknown stat {stat}, expected one of {', '.join(STATS_COLUMNS)}")
+        if not valid_aggregate(agg):
+            raise ValueError(f"Unknown aggregate {agg}, expected one of {', '.join(AGGREGATES)} or p<percentile>")
+        start = max(start, 0)
+        stop = self.height if stop is None else min(stop, self.height)
+        mask = self.status[start:stop + 1] == STORED
+        heights = np.flatnonzero(mask) + start
+        values = column[start:stop + 1][mask]
+        times = self.columns["mediantime"][start:stop + 1][mask]
+        if (step > 1 or period) and len(values):
+            keys = times // period if period else (heights - start) // step
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+            values = aggregate(values, starts, agg)
+            heights, times = heights[starts], times[starts]
+        if window and window > 1:
+            sums = np.cumsum(np.concatenate(([0], values)), dtype=np.float64)
+            values = (sums[window:] - sums[:-window]) / window
+            heights, times = heights[window - 1:], times[window - 1:]
+        return {"heights": np.asarray(heights), "mediantime": np.asarray(times), "values": np.asarray(values)}
+
+    def close(self) -> None:
+        '''Flushes and unmaps the columns'''
+        if self.status is None:
+            return
+        self.flush()
+        self.columns, self.hashes, self.status = {}, None, None
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
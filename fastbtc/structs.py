@@ -0,0 +1,219 @@
+import math
+import orjson
+from array import array
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
+
+try:
+    import msgspec
+except ImportError:     # msgspec is optional, without it results are decoded with orjson into __slots__ records
+    msgspec = None
+
+
+class Record:
+    '''
+        Base of the records built when msgspec is not installed: one slot per field of FIELDS, a missing field
+        holds None and is left out when encoded, fields unknown to the schema are dropped.
+    '''
+    __slots__ = ()
+    FIELDS: Tuple[Tuple[str, str, Optional[type]], ...] = ()   # (attribute, JSON key, nested record type)
+
+    def __init__(self, **fields) -> None:
+        for attribute, _, _ in self.FIELDS:
+            setattr(self, attribute, fields.pop(attribute, None))
+        if fields:
+            raise TypeError(f"{type(self).__name__} has no fields {', '.join(fields)}")
+
+    @classmethod
+    def from_dict(cls, data:dict) -> 'Record':
+        record = cls.__new__(cls)
+        for attribute, key, nested in cls.FIELDS:
+            value = data.get(key)
+            if nested is not None and value is not None:
+                value = nested.from_dict(value)
+            setattr(record, attribute, value)
+        return record
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, attribute) for attribute, key, _ in self.FIELDS if getattr(self, attribute) is not None}
+
+    def __eq__(self, other:Any) -> bool:
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name) for name, _, _ in self.FIELDS)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name, _, _ in self.FIELDS)})"
+
+
+def define(name:str, fields:List[Tuple[str, Any]]) -> type:
+    '''
+        Returns a struct type with the given (JSON key, type) fields, all optional.
+        With msgspec it is a msgspec.Struct decoded straight from JSON, otherwise a Record subclass.
+    '''
+    attributes = [(key.replace("-", "_"), key, kind) for key, kind in fields]
+    if msgspec is not None:
+        return msgspec.defstruct(
+            name, [(attribute, Optional[kind], None) for attribute, _, kind in attributes],
+            rename={attribute: key for attribute, key, _ in attributes if attribute != key},
+            omit_defaults=True, gc=False, module=__name__,
+        )
+    nested = lambda kind: kind if isinstance(kind, type) and issubclass(kind, Record) else None
+    return type(name, (Record,), {
+        "__slots__": tuple(attribute for attribute, _, _ in attributes),
+        "FIELDS": tuple((attribute, key, nested(kind)) for attribute, key, kind in attributes),
+    })
+
+
+MempoolFees = define("MempoolFees", [("base", float), ("modified", float), ("ancestor", float), ("descendant", float)])
+
+MempoolEntryInfo = define("MempoolEntryInfo", [
+    ("vsize", int), ("weight", int), ("time", int), ("height", int),
+    ("descendantcount", int), ("descendantsize", int), ("ancestorcount", int), ("ancestorsize", int),
+    ("wtxid", str), ("fees", MempoolFees), ("depends", List[str]), ("spentby", List[str]),
+    ("bip125-replaceable", bool), ("unbroadcast", bool),
+])
+
+BlockHeaderInfo = define("BlockHeaderInfo", [
+    ("hash", str), ("confirmations", int), ("height", int), ("version", int), ("versionHex", str),
+    ("merkleroot", str), ("time", int), ("mediantime", int), ("nonce", int), ("bits", str), ("target", str),
+    ("difficulty", float), ("chainwork", str), ("nTx", int), ("previousblockhash", str), ("nextblockhash", str),
+])
+
+PeerInfo = define("PeerInfo", [
+    ("id", int), ("addr", str), ("addrbind", str), ("addrlocal", str), ("network", str), ("mapped_as", int),
+    ("services", str), ("servicesnames", List[str]), ("relaytxes", bool), ("lastsend", int), ("lastrecv", int),
+    ("last_transaction", int), ("last_block", int), ("bytessent", int), ("bytesrecv", int), ("conntime", int),
+    ("timeoffset", int), ("pingtime", float), ("minping", float), ("pingwait", float), ("version", int),
+    ("subver", str), ("inbound", bool), ("bip152_hb_to", bool), ("bip152_hb_from", bool), ("startingheight", int),
+    ("presynced_headers", int), ("synced_headers", int), ("synced_blocks", int), ("inflight", List[int]),
+    ("addr_relay_enabled", bool), ("addr_processed", int), ("addr_rate_limited", int), ("permissions", List[str]),
+    ("minfeefilter", float), ("bytessent_per_msg", Dict[str, int]), ("bytesrecv_per_msg", Dict[str, int]),
+    ("connection_type", str), ("transport_protocol_type", str), ("session_id", str),
+])
+
+
+MEMPOOL_INTS = ("vsize", "weight", "time", "height", "descendantcount", "descendantsize", "ancestorcount", "ancestorsize")
+MEMPOOL_FEES = ("base", "modified", "ancestor", "descendant")
+MEMPOOL_FLAGS = ("bip125-replaceable", "unbroadcast")
+HAS_WTXID, HAS_FEES = 1 << 4, 1 << 5    # presence bits after the two bits (present, value) of each flag
+
+
+class MempoolEntries(Mapping):
+    '''
+        Verbose getrawmempool result stored by column, a mapping of txid to MempoolEntryInfo built on lookup.
+        Integer and fee fields are kept in arrays, wtxids as 32 bytes, the flags in a byte and only the depends and
+        spentby lists that aren't empty, about a fifth of the memory of the decoded JSON. A missing integer is
+        stored as -1 and a missing fee as NaN.
+    '''
+    def __init__(self, entries:Mapping=None) -> None:
+        self.rows = {}                  # txid -> row
+        self.ints = array("q")          # MEMPOOL_INTS of each row
+        self.fees = array("d")          # MEMPOOL_FEES of each row
+        self.wtxids = bytearray()
+        self.flags = bytearray()
+        self.links = {}                 # row -> (depends, spentby), when either isn't empty
+        for txid, entry in (entries or {}).items():
+            self.add(txid, entry)
+
+    @classmethod
+    def decode(cls, body:bytes) -> 'MempoolEntries':
+        '''Decodes the JSON of a verbose getrawmempool result. It is parsed into dicts first, so the peak memory
+        is that of the decoded JSON, only what is kept afterwards is smaller.'''
+        return cls(orjson.loads(body))
+
+    def add(self, txid:str, entry:dict) -> None:
+        '''Appends the entry of txid, given as decoded JSON'''
+        if txid in self.rows:
+            raise ValueError(f"{txid} already in snapshot")
+        row = self.rows[txid] = len(self.flags)
+        self.ints.extend(-1 if entry.get(key) is None else entry[key] for key in MEMPOOL_INTS)
+        fees = entry.get("fees")
+        self.fees.extend(math.nan if not fees or fees.get(key) is None else fees[key] for key in MEMPOOL_FEES)
+        wtxid = entry.get("wtxid")
+        self.wtxids += bytes.fromhex(wtxid) if wtxid else bytes(32)
+        flags = (HAS_WTXID if wtxid else 0) | (HAS_FEES if fees else 0)
+        for bit, key in enumerate(MEMPOOL_FLAGS):
+            if entry.get(key) is not None:
+                flags |= (1 | entry[key] << 1) << 2 * bit
+        self.flags.append(flags)
+        if entry.get("depends") or entry.get("spentby"):
+            self.links[row] = (tuple(entry.get("depends") or ()), tuple(entry.get("spentby") or ()))
+
+    def __getitem__(self, txid:str):
+        return convert(self.entry(txid), MempoolEntryInfo)
+
+    def entry(self, txid:str) -> dict:
+        '''Returns the entry of txid as decoded JSON'''
+        row = self.rows[txid]
+        flags = self.flags[row]
+        entry = {key: value for key, value in zip(MEMPOOL_INTS, self.ints[row * 8:row * 8 + 8]) if value >= 0}
+        if flags & HAS_WTXID:
+            entry["wtxid"] = self.wtxids[row * 32:row * 32 + 32].hex()
+        if flags & HAS_FEES:
+            entry["fees"] = {key: value for key, value in zip(MEMPOOL_FEES, self.fees[row * 4:row * 4 + 4]) if not math.isnan(value)}
+        depends, spentby = self.links.get(row, ((), ()))
+        entry["depends"], entry["spentby"] = list(depends), list(spentby)
+        for bit, key in enumerate(MEMPOOL_FLAGS):
+            if flags >> 2 * bit & 1:
+                entry[key] = bool(flags >> 2 * bit & 2)
+        return entry
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def to_dict(self) -> dict:
+        return {txid: self.entry(txid) for txid in self.rows}
+
+
+def builtin(value:Any) -> Any:
+    '''Returns what encode serializes in place of a struct or a snapshot'''
+    if isinstance(value, (Record, MempoolEntries)):
+        return value.to_dict()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def shape(cls:type, container:Optional[type]) -> Any:
+    '''Returns the type of a result made of cls records, in a list or a dict keyed by strings'''
+    return List[cls] if container is list else Dict[str, cls] if container is dict else cls
+
+
+if msgspec is not None:
+    DECODERS = {}                       # (cls, container) -> msgspec.json.Decoder
+    ENCODER = msgspec.json.Encoder(enc_hook=builtin)
+
+    def decode(body:bytes, cls:type, container:Optional[type]=None) -> Any:
+        '''Decodes the JSON of a result into cls records, a list of them or a dict of them'''
+        decoder = DECODERS.get((cls, container))
+        if decoder is None:
+            decoder = DECODERS[cls, container] = msgspec.json.Decoder(shape(cls, container))
+        return decoder.decode(body)
+
+    def convert(value:Any, cls:type, container:Optional[type]=None) -> Any:
+        '''Converts a result decoded into dicts like decode does'''
+        return msgspec.convert(value, shape(cls, container))
+
+    def encode(value:Any) -> bytes:
+        '''Returns the JSON of records, or of anything holding them'''
+        return ENCODER.encode(value)
+else:
+    def convert(value:Any, cls:Type[Record], container:Optional[type]=None) -> Any:
+        '''Converts a result decoded into dicts like decode does'''
+        if container is list:
+            return [cls.from_dict(item) for item in value]
+        if container is dict:
+            return {key: cls.from_dict(item) for key, item in value.items()}
+        return cls.from_dict(value)
+
+    def decode(body:bytes, cls:Type[Record], container:Optional[type]=None) -> Any:
+        '''Decodes the JSON of a result into cls records, a list of them or a dict of them'''
+        return convert(orjson.loads(body), cls, container)
+
+    def encode(value:Any) -> bytes:
+        '''Returns the JSON of records, or of anything holding them'''
+        return orjson.dumps(value, default=builtin)
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
@@ -0,0 +1,245 @@
+import os
+import fcntl
+import orjson
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+from fastbtc.segments import SortedSegments
+
+
+TXINDEX_DIR = os.getenv("FASTBTC_TXINDEX_DIR")  # directory of the local txid index, disabled if unset
+TXINDEX_SYNC_BATCH = 200                # blocks fetched and checked per round
+TXINDEX_BLOCKS_PER_BATCH = 10           # getblock calls per JSON-RPC batch, so a round is sent as concurrent batches
+TXINDEX_REORG_DEPTH = 100               # blocks that can be rolled back on a reorg
+TXINDEX_RELOAD = 5.0                    # seconds between reloads of an index written by another process, or sync retries
+
+# key is the leading 8 bytes of the txid, stored without a sub key: 13 bytes per txid with the key file
+TXID_FIELDS = [("height", "<u4")]
+
+
+def txid_key(txid:str) -> Optional[int]:
+    '''Returns the 64 bit key of a txid, its leading 8 bytes as displayed, None if it isn't 64 hex digits'''
+    if not isinstance(txid, str) or len(txid) != 64:
+        return None
+    try:
+        digest = bytes.fromhex(txid)
+    except ValueError:
+        return None
+    # fromhex skips whitespace between bytes
+    return int.from_bytes(digest[:8], 'big') if len(digest) == 32 else None
+
+
+class TxIndex:
+    '''
+        Local index of the height of every confirmed transaction, built from the node's blocks.
+            txids/       txid prefix -> height, see SortedSegments
+            state.json   indexed height and the hashes of the blocks that can be rolled back
+            lock         held by the one process writing, the others open the index read-only
+        Txids sharing their prefix give the height of the last one indexed, a lookup has about 1 chance in 10^10 of
+        hitting another transaction on mainnet so callers check the block they are pointed at.
+        The index is opened read-only, elect() makes this process the writer if no other one is.
+    '''
+    def __init__(self, path:str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.txids = SortedSegments(os.path.join(path, "txids"), TXID_FIELDS, readonly=True, subkey=False)
+        self.height = -1
+        self.hashes = {}                # height -> hash of the blocks that can be rolled back
+        self.synced = False             # caught up with the node's tip at the last sync
+        self.lock = None                # lock file, held by the writer
+        self.stats = {"blocks": 0, "txs": 0, "rollbacks": 0}
+        self.load_state()
+
+    @property
+    def writer(self) -> bool:
+        return self.lock is not None
+
+    def load_state(self) -> None:
+        path = os.path.join(self.path, "state.json")
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                state = orjson.loads(file.read())
+            self.height = state["height"]
+            self.hashes = {int(height): blockhash for height, blockhash in state["hashes"].items()}
+
+    def elect(self) -> bool:
+        '''Becomes the writer if no other process is, returns whether this one is'''
+        if self.lock is not None:
+            return True
+        lock = open(os.path.join(self.path, "lock"), "a+b")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        self.lock = lock
+        self.txids = SortedSegments(os.path.join(self.path, "txids"), TXID_FIELDS, subkey=False)
+        self.load_state()
+        return True
+
+    def reload(self) -> None:
+        '''Maps what the writer indexed since the last reload'''
+        self.load_state()
+        self.txids.reload()
+
+    ######## UPDATES ########
+    def add(self, height:int, blockhash:str, txids:List[str]) -> None:
+        '''Indexes the transactions of the block following the indexed tip'''
+        for txid in txids:
+            self.txids.put(txid_key(txid), 0, height)
+        self.hashes[height] = blockhash
+        self.hashes.pop(height - TXINDEX_REORG_DEPTH, None)
+        self.height = height
+        self.stats["blocks"] += 1
+        self.stats["txs"] += len(txids)
+
+    def add_many(self, heights:range, blocks:list) -> Tuple[int, bool]:
+        '''Indexes the verbose blocks at heights following the indexed tip, up to the first one missing.
+        Returns the number indexed and whether a block didn't follow the tip.'''
+        indexed = 0
+        for height, block in zip(heights, blocks):
+            if not isinstance(block, dict) or "tx" not in block:
+                break
+            if self.height >= 0 and block.get("previousblockhash") != self.hashes.get(self.height):
+                # the chain changed while indexing
+                return indexed, True
+            self.add(height, block["hash"], block["tx"])
+            indexed += 1
+        return indexed, False
+
+    def remove(self, txids:List[str]) -> None:
+        '''Unindexes the transactions of the indexed tip block'''
+        for txid in txids:
+            self.txids.delete(txid_key(txid), 0)
+        self.hashes.pop(self.height, None)
+        self.height -= 1
+        self.stats["rollbacks"] += 1
+
+    def checkpoint(self) -> None:
+        '''Writes the buffered records and then the indexed height, blocks indexed again after a crash in between
+        put the same records'''
+        if self.lock is None:
+            return
+        self.txids.flush()
+        path = os.path.join(self.path, "state.json")
+        with open(path + ".tmp", "wb") as file:
+            file.write(orjson.dumps({"height": self.height, "hashes": {str(k): v for k, v in self.hashes.items()}}))
+        os.replace(path + ".tmp", path)
+
+    async def rollback(self, rpc) -> bool:
+        '''Unindexes the blocks no longer in the node's best chain, asking the node for their transactions.
+        Returns False if the node couldn't tell.'''
+        async with rpc.pinned():
+            while self.height >= 0:
+                blockhash = await rpc.call("getblockhash", [self.height], use_cache=False)
+                if blockhash == self.hashes.get(self.height):
+                    break
+                if not isinstance(blockhash, str) and not (isinstance(blockhash, dict) and blockhash.get("code") == -8):
+                    # anything but a height out of range after a reorg
+                    logging.warning(f"txid index can't check block {self.height}: {blockhash}")
+                    return False
+                stale = self.hashes.get(self.height)
+                block = await rpc.call("getblock", [stale, 1]) if stale else None
+                if not isinstance(block, dict) or "tx" not in block:
+                    raise RuntimeError(f"can't roll back block {self.height} of the txid index, it has to be rebuilt")
+                logging.info(f"txid index rolling back block {self.height}")
+                self.remove(block["tx"])
+        return True
+
+    async def sync(self, rpc, batch:int=TXINDEX_SYNC_BATCH) -> int:
+        '''Rolls back blocks no longer in the node's best chain and indexes the new ones, fetching batch blocks
+        at a time as concurrent JSON-RPC batches. Each round is indexed and checkpoints written on another thread so
+        the event loop keeps serving meanwhile. Returns the number of blocks indexed.'''
+        if not self.elect():
+            raise RuntimeError(f"txid index in {self.path} is written by another process")
+        indexed = 0
+        while True:
+            tip = await rpc.call("getblockcount", use_cache=False) if await self.rollback(rpc) else None
+            if not isinstance(tip, int):
+                return indexed
+            reorg = False
+            for start in range(self.height + 1, tip + 1, batch):
+                heights = range(start, min(start + batch, tip + 1))
+                hashes = await rpc.call_many([("getblockhash", [height]) for height in heights])
+                if not all(isinstance(blockhash, str) for blockhash in hashes):
+                    break
+                blocks = await rpc.call_many(
+                    [("getblock", [blockhash, 1]) for blockhash in hashes], batch_size=TXINDEX_BLOCKS_PER_BATCH
+                )
+                added, reorg = await asyncio.to_thread(self.add_many, heights, blocks)
+                indexed += added
+                if self.height != heights[-1]:
+                    break
+                if self.txids.full():
+                    await asyncio.to_thread(self.checkpoint)
+            await asyncio.to_thread(self.checkpoint)
+            if not reorg:
+                self.synced = self.height == tip
+                return indexed
+
+    async def follow(self, rpc, bus) -> None:
+        '''Syncs now and whenever a block notification is received while this process writes the index, retrying
+        a failed sync every TXINDEX_RELOAD. Otherwise reloads it every TXINDEX_RELOAD and takes over once the writer exits.'''
+        queue = bus.subscribe("hashblock", "gap")
+        try:
+            while True:
+                timeout = None
+                if not self.elect():
+                    await self.refresh(rpc)
+                    timeout = TXINDEX_RELOAD
+                else:
+                    try:
+                        await self.sync(rpc)
+                    except Exception as exc:
+                        logging.warning(f"txid index sync failed: {exc!r}")
+                        timeout = TXINDEX_RELOAD
+                try:
+                    await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                # one sync catches up with every block notified meanwhile
+                while not queue.empty():
+                    queue.get_nowait()
+        finally:
+            bus.unsubscribe(queue, "hashblock", "gap")
+
+    async def refresh(self, rpc) -> None:
+        '''Reloads the index and checks whether its writer caught up with the node's tip'''
+        try:
+            self.reload()
+            tip = await rpc.getblockcount()
+        except Exception as exc:
+            logging.warning(f"txid index reload failed: {exc!r}")
+            self.synced = False
+            return
+        self.synced = tip == self.height
+
+    ######## LOOKUPS ########
+    def height_of(self, txid:str) -> Optional[int]:
+        '''Returns the height of the block confirming txid, None if it isn't indexed or isn't a txid'''
+        key = txid_key(txid)
+        if key is None:
+            return None
+        record = self.txids.get(key, 0)
+        return record[2] if record is not None else None
+
+    def heights_of(self, txids:List[str]) -> List[Optional[int]]:
+        '''Returns the heights of many txids, looked up together, None for those that aren't txids'''
+        keys = [txid_key(txid) for txid in txids]
+        found = iter(self.txids.find_many([key for key in keys if key is not None]))
+        heights = []
+        for key in keys:
+            records = next(found) if key is not None else ()
+            heights.append(int(records["height"][-1]) if len(records) else None)
+        return heights
+
+    def close(self) -> None:
+        '''Writes everything indexed so far and gives up writing the index'''
+        self.checkpoint()
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
@@ -0,0 +1,342 @@
+import os
+import fcntl
+import orjson
+import asyncio
+import hashlib
+import logging
+import collections
+import numpy as np
+from typing import Dict, List, Optional
+from fastbtc.block import Block
+from fastbtc.segments import SortedSegments
+
+
+UTXO_DIR = os.getenv("FASTBTC_UTXO_DIR")        # directory of the local address index, disabled if unset
+UTXO_UNDO_DEPTH = 100                   # blocks that can be rolled back on a reorg
+UTXO_PREFETCH = 4                       # blocks fetched ahead of the one being indexed
+UTXO_CHECKPOINT = 1000                  # blocks indexed between writes to disk
+UTXO_RELOAD = 5.0                       # seconds between reloads of an index written by another process, or sync retries
+
+# outputs: key is the script key, sub the outpoint key
+OUTPUT_FIELDS = [("value", "<i8"), ("height", "<u4"), ("vout", "<u4"), ("txid", "<u8")]
+# outpoints: key is the outpoint key, sub is unused
+OUTPOINT_FIELDS = [("script", "<u8")]
+# per block, the outputs it created and the ones it spent
+UNDO_DTYPE = np.dtype([("created", "u1"), ("script", "<u8"), ("outpoint", "<u8")] + OUTPUT_FIELDS)
+
+
+def script_key(script:bytes) -> int:
+    '''Returns the 64 bit key of an output script'''
+    return int.from_bytes(hashlib.blake2b(script, digest_size=8).digest(), 'little')
+
+
+def outpoint_key(prevout:bytes) -> int:
+    '''Returns the 64 bit key of a serialized outpoint, 32 byte txid then 4 byte output index'''
+    return int.from_bytes(hashlib.blake2b(prevout, digest_size=8).digest(), 'little')
+
+
+class UTXOIndex:
+    '''
+        Local index of unspent outputs by output script, built from the node's blocks.
+            outputs/     (script key, outpoint key) -> value, height, output index and txid prefix
+            outpoints/   outpoint key -> script key, to find the output an input spends
+            undo/        outputs created and spent by each of the last UTXO_UNDO_DEPTH blocks
+            state.json   indexed height and the hashes of the blocks that can be rolled back
+            lock         held by the one process writing, the others open the index read-only
+        Keys are 8 byte hashes in sorted, memory-mapped segments, see SortedSegments. A lookup may include the
+        outputs of another script whose key collides, with a chance of about 1 in 10^11 on mainnet.
+        The index is opened read-only, elect() makes this process the writer if no other one is.
+    '''
+    def __init__(self, path:str) -> None:
+        self.path = path
+        os.makedirs(os.path.join(path, "undo"), exist_ok=True)
+        self.outputs = SortedSegments(os.path.join(path, "outputs"), OUTPUT_FIELDS, readonly=True)
+        self.outpoints = SortedSegments(os.path.join(path, "outpoints"), OUTPOINT_FIELDS, readonly=True)
+        self.height = -1
+        self.durable = -1               # height of the last complete checkpoint
+        self.hashes = {}                # height -> hash of the blocks that can be rolled back
+        self.undo = {}                  # height -> undo records not written yet
+        self.synced = False             # caught up with the node's tip at the last sync
+        self.lock = None                # lock file, held by the writer
+        self.stats = {"blocks": 0, "created": 0, "spent": 0, "rollbacks": 0}
+        self.load_state()
+
+    @property
+    def writer(self) -> bool:
+        return self.lock is not None
+
+    def undo_path(self, height:int) -> str:
+        return os.path.join(self.path, "undo", f"{height}.npy")
+
+    def load_state(self) -> Optional[int]:
+        '''Reads the indexed height and hashes, returns the height a checkpoint was writing if it was interrupted'''
+        path = os.path.join(self.path, "state.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            state = orjson.loads(file.read())
+        self.height = self.durable = state["height"]
+        self.hashes = {int(height): blockhash for height, blockhash in state["hashes"].items()}
+        return state.get("flushing")
+
+    def save_state(self, flushing:Optional[int]=None) -> None:
+        '''Writes the height of the last complete checkpoint, and the one being written if any'''
+        state = {"height": self.durable, "hashes": {str(k): v for k, v in self.hashes.items()}}
+        if flushing is not None:
+            state["flushing"] = flushing
+        path = os.path.join(self.path, "state.json")
+        with open(path + ".tmp", "wb") as file:
+            file.write(orjson.dumps(state))
+        os.replace(path + ".tmp", path)
+
+    def elect(self) -> bool:
+        '''Becomes the writer if no other process is, returns whether this one is.
+        A checkpoint the last writer didn't finish is rolled back first.'''
+        if self.lock is not None:
+            return True
+        lock = open(os.path.join(self.path, "lock"), "a+b")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        self.lock = lock
+        self.outputs = SortedSegments(os.path.join(self.path, "outputs"), OUTPUT_FIELDS)
+        self.outpoints = SortedSegments(os.path.join(self.path, "outpoints"), OUTPOINT_FIELDS)
+        self.recover(self.load_state())
+        return True
+
+    def reload(self) -> Optional[int]:
+        '''Maps what the writer indexed since the last reload, returns the height it is writing if any'''
+        flushing = self.load_state()
+        self.outputs.reload()
+        self.outpoints.reload()
+        return flushing
+
+    ######## UPDATES ########
+    def connect(self, block:Block, height:int) -> None:
+        '''Indexes the outputs created and spent by the block following the indexed tip'''
+        undo = []
+        for tx in block:
+            if not tx.is_coinbase:
+                for txin in tx.inputs:
+                    outpoint = outpoint_key(bytes(txin.prevout))
+                    spent = self.outpoints.get(outpoint, 0)
+                    if spent is None:
+                        continue
+                    script = spent[3]
+                    output = self.outputs.get(script, outpoint)
+                    self.outpoints.delete(outpoint, 0)
+                    self.outputs.delete(script, outpoint)
+                    if output is not None:
+                        undo.append((0, script, outpoint, *output[3:]))
+            txid = bytes.fromhex(tx.txid)
+            prefix = int.from_bytes(txid[:8], 'big')
+            for vout, output in enumerate(tx.outputs):
+                script = bytes(output.scriptpubkey)
+                if script[:1] == b"\x6a":
+                    # OP_RETURN, provably unspendable
+                    continue
+                outpoint = outpoint_key(txid[::-1] + vout.to_bytes(4, 'little'))
+                key = script_key(script)
+                self.outputs.put(key, outpoint, output.value, height, vout, prefix)
+                self.outpoints.put(outpoint, 0, key)
+                undo.append((1, key, outpoint, 0, 0, 0, 0))
+        # kept until the next checkpoint, which may have to roll back every block since the last one
+        self.undo[height] = np.array(undo, dtype=UNDO_DTYPE)
+        self.hashes[height] = block.hash
+        self.height = height
+        self.stats["blocks"] += 1
+        self.stats["created"] += sum(record[0] for record in undo)
+        self.stats["spent"] += sum(1 - record[0] for record in undo)
+
+    def disconnect(self) -> None:
+        '''Rolls back the indexed tip block, raises RuntimeError without its undo data'''
+        height = self.height
+        undo = self.undo.pop(height, None)
+        if undo is None:
+            if not os.path.exists(self.undo_path(height)):
+                raise RuntimeError(f"no undo data for height {height}, the index has to be rebuilt")
+            undo = np.load(self.undo_path(height))
+        for created, script, outpoint, value, block, vout, txid in reversed(undo.tolist()):
+            if created:
+                self.outputs.delete(script, outpoint)
+                self.outpoints.delete(outpoint, 0)
+            else:
+                self.outputs.put(script, outpoint, value, block, vout, txid)
+                self.outpoints.put(outpoint, 0, script)
+        # its undo data is removed by the next checkpoint, once the rollback is written
+        self.hashes.pop(height, None)
+        self.height -= 1
+        self.stats["rollbacks"] += 1
+
+    def checkpoint(self) -> None:
+        '''
+            Writes the undo data, the height being flushed, the buffered records and then the indexed height.
+            Blocks are either only connected or only disconnected between checkpoints, so the records of an
+            interrupted one are in a mix of both states and disconnecting its blocks again from the higher
+            height, which only deletes and restores records, brings them back in line (see recover).
+        '''
+        if self.lock is None:
+            return
+        for height, undo in self.undo.items():
+            SortedSegments.save(self.undo_path(height), undo)
+        self.undo = {}
+        if self.height != self.durable or self.outputs.pending or self.outpoints.pending:
+            self.save_state(flushing=self.height)
+            self.outputs.flush()
+            self.outpoints.flush()
+        self.durable = self.height
+        self.hashes = {height: blockhash for height, blockhash in self.hashes.items() if height >= self.height - UTXO_UNDO_DEPTH}
+        self.save_state()
+        for name in os.listdir(os.path.join(self.path, "undo")):
+            height = int(name.split(".")[0])
+            if height <= self.height - UTXO_UNDO_DEPTH or height > self.height or name.endswith(".tmp"):
+                os.remove(os.path.join(self.path, "undo", name))
+
+    def recover(self, flushing:Optional[int]) -> None:
+        '''Rolls back the blocks of a checkpoint that was interrupted while flushing'''
+        if flushing is None:
+            return
+        target = min(self.durable, flushing)
+        self.height = self.durable = max(self.durable, flushing)
+        logging.warning(f"address index checkpoint was interrupted, rolling back to block {target}")
+        while self.height > target:
+            self.disconnect()
+        self.checkpoint()
+
+    async def rollback(self, rpc) -> bool:
+        '''Rolls back the indexed blocks no longer in the node's best chain.
+        Returns False if the node couldn't tell.'''
+        async with rpc.pinned():
+            while self.height >= 0:
+                blockhash = await rpc.call("getblockhash", [self.height], use_cache=False)
+                if blockhash == self.hashes.get(self.height):
+                    break
+                if not isinstance(blockhash, str) and not (isinstance(blockhash, dict) and blockhash.get("code") == -8):
+                    # anything but a height out of range after a reorg
+                    logging.warning(f"address index can't check block {self.height}: {blockhash}")
+                    return False
+                logging.info(f"address index rolling back block {self.height}")
+                self.disconnect()
+        return True
+
+    async def fetch(self, rpc, height:int) -> Optional[Block]:
+        blockhash = await rpc.getblockhash(height)
+        if not isinstance(blockhash, str):
+            return None
+        block = await rpc.getblockparsed(blockhash)
+        return block if isinstance(block, Block) else None
+
+    async def sync(self, rpc) -> int:
+        '''Rolls back blocks no longer in the node's best chain and indexes the new ones, fetching
+        UTXO_PREFETCH blocks ahead. Blocks are indexed and checkpoints written on another thread so the event loop
+        keeps serving meanwhile. Returns the number of blocks indexed.'''
+        if not self.elect():
+            raise RuntimeError(f"address index in {self.path} is written by another process")
+        indexed = 0
+        while True:
+            checked = await self.rollback(rpc)
+            if self.height < self.durable:
+                # written on its own, so a checkpoint never mixes rolled back and new blocks
+                await asyncio.to_thread(self.checkpoint)
+            tip = await rpc.call("getblockcount", use_cache=False) if checked else None
+            if not isinstance(tip, int):
+                return indexed
+            heights = iter(range(self.height + 1, tip + 1))
+            window = collections.deque(
+                (height, asyncio.ensure_future(self.fetch(rpc, height))) for height, _ in zip(heights, range(UTXO_PREFETCH))
+            )
+            reorg = False
+            try:
+                while window:
+                    height, task = window.popleft()
+                    block = await task
+                    following = next(heights, None)
+                    if following is not None:
+                        window.append((following, asyncio.ensure_future(self.fetch(rpc, following))))
+                    if block is None:
+                        break
+                    if self.height >= 0 and block.header.previousblockhash != self.hashes.get(self.height):
+                        # the chain changed while indexing
+                        reorg = True
+                        break
+                    # off the event loop, lookups meanwhile would see a partly indexed block
+                    self.synced = False
+                    await asyncio.to_thread(self.connect, block, height)
+                    indexed += 1
+                    if self.outputs.full() or self.outpoints.full() or height % UTXO_CHECKPOINT == 0:
+                        await asyncio.to_thread(self.checkpoint)
+            finally:
+                for _, task in window:
+                    task.cancel()
+            await asyncio.to_thread(self.checkpoint)
+            if not reorg:
+                self.synced = self.height == tip
+                return indexed
+
+    async def follow(self, rpc, bus) -> None:
+        '''Syncs now and whenever a block notification is received while this process writes the index, retrying
+        a failed sync every UTXO_RELOAD. Otherwise reloads it every UTXO_RELOAD and takes over once the writer exits.'''
+        queue = bus.subscribe("hashblock", "gap")
+        try:
+            while True:
+                timeout = None
+                if not self.elect():
+                    await self.refresh(rpc)
+                    timeout = UTXO_RELOAD
+                else:
+                    try:
+                        await self.sync(rpc)
+                    except Exception as exc:
+                        logging.warning(f"address index sync failed: {exc!r}")
+                        timeout = UTXO_RELOAD
+                try:
+                    await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                # one sync catches up with every block notified meanwhile
+                while not queue.empty():
+                    queue.get_nowait()
+        finally:
+            bus.unsubscribe(queue, "hashblock", "gap")
+
+    async def refresh(self, rpc) -> None:
+        '''Reloads the index and checks whether its writer caught up with the node's tip'''
+        try:
+            flushing = self.reload()
+            tip = await rpc.getblockcount()
+        except Exception as exc:
+            logging.warning(f"address index reload failed: {exc!r}")
+            self.synced = False
+            return
+        # the segments may be ahead of the height while a checkpoint is written
+        self.synced = flushing is None and tip == self.height
+
+    ######## LOOKUPS ########
+    def unspent(self, script:bytes) -> List[Dict[str, int]]:
+        '''Returns the unspent outputs paying to script, with the leading 8 bytes of their txid as hex'''
+        return [
+            {"txid": f"{txid:016x}", "vout": vout, "value": value, "height": height}
+            for _, _, _, value, height, vout, txid in self.outputs.find(script_key(script)).tolist()
+        ]
+
+    def balance(self, script:bytes) -> int:
+        '''Returns the satoshis of the unspent outputs paying to script'''
+        return int(self.outputs.find(script_key(script))["value"].sum())
+
+    def balances(self, scripts:List[bytes]) -> List[int]:
+        '''Returns the balances of many scripts, looked up together'''
+        found = self.outputs.find_many([script_key(script) for script in scripts])
+        return [int(records["value"].sum()) for records in found]
+
+    def close(self) -> None:
+        '''Writes everything indexed so far and gives up writing the index'''
+        self.checkpoint()
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
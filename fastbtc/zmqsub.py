@@ -0,0 +1,151 @@
+import os
+import asyncio
+import logging
+from typing import List, NamedTuple, Optional, Union
+from fastbtc.events import EventBus
+
+try:
+    import zmq
+    import zmq.asyncio
+except ImportError:     # pyzmq is optional, without it notifications fall back to polling
+    zmq = None
+
+
+ZMQ_URLS = os.getenv("BTC_ZMQ_URLS")    # comma separated zmqpubhashblock/zmqpubrawtx/zmqpubsequence endpoints
+ZMQ_TOPICS = ("hashblock", "rawtx", "sequence")
+POLL_INTERVAL = 5.0                     # seconds between getbestblockhash polls when ZMQ is not configured
+
+
+class SequenceEvent(NamedTuple):
+    '''Block connected (C) or disconnected (D), transaction added to (A) or removed from (R) the mempool'''
+    hash: str
+    label: str
+    mempool_sequence: Optional[int]
+
+
+class Gap(NamedTuple):
+    '''Notifications of topic were missed, the received sequence number is not the expected one'''
+    topic: str
+    expected: int
+    received: int
+
+
+def parse_sequence(body:bytes) -> SequenceEvent:
+    '''Parses the body of a sequence notification: 32 byte hash, label and mempool sequence for A and R'''
+    mempool_sequence = int.from_bytes(body[33:41], 'little') if len(body) >= 41 else None
+    return SequenceEvent(body[:32].hex(), chr(body[32]), mempool_sequence)
+
+
+class ZMQSubscriber:
+    '''
+        Subscribes to the ZMQ notifications of bitcoind and publishes them on the event bus.
+            hashblock -> block hash hex
+            rawtx -> serialized transaction bytes
+            sequence -> SequenceEvent
+            gap -> Gap, whenever the sequence number of a topic skipped
+        Each topic should be published on a single endpoint for gap detection to hold.
+    '''
+    def __init__(self, urls:List[str], bus:EventBus, topics:List[str]=ZMQ_TOPICS) -> None:
+        if zmq is None:
+            raise RuntimeError("pyzmq is required for ZMQ notifications")
+        self.urls = urls
+        self.bus = bus
+        self.topics = topics
+        self.sequences = {}     # topic -> last received sequence number
+        self.gaps = 0
+        self.context = None
+        self.socket = None
+        self.task = None
+
+    async def start(self) -> 'ZMQSubscriber':
+        '''Connects to the endpoints and starts publishing notifications'''
+        self.context = zmq.asyncio.Context()
+        self.socket = self.context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.RCVHWM, 0)
+        for topic in self.topics:
+            self.socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+        for url in self.urls:
+            self.socket.connect(url)
+        self.task = asyncio.ensure_future(self.run())
+        return self
+
+    async def run(self) -> None:
+        '''Receives notifications until closed'''
+        while True:
+            frames = await self.socket.recv_multipart()
+            if len(frames) == 3:
+                self.handle(*frames)
+
+    def handle(self, topic:bytes, body:bytes, sequence:bytes) -> None:
+        '''Checks the sequence number of a notification and publishes it'''
+        topic = topic.decode()
+        sequence = int.from_bytes(sequence, 'little')
+        last = self.sequences.get(topic)
+        expected = (last + 1) & 0xffffffff if last is not None else sequence
+        if sequence != expected:
+            self.gaps += 1
+            logging.warning(f"zmq {topic} notifications missed, expected {expected} got {sequence}")
+            self.bus.publish("gap", Gap(topic, expected, sequence))
+        self.sequences[topic] = sequence
+        if topic == "hashblock":
+            self.bus.publish(topic, body.hex())
+        elif topic == "rawtx":
+            self.bus.publish(topic, body)
+        elif topic == "sequence":
+            self.bus.publish(topic, parse_sequence(body))
+
+    async def close(self) -> None:
+        '''Stops receiving and closes the socket'''
+        if self.task is not None:
+            self.task.cancel()
+        if self.socket is not None:
+            self.socket.close(linger=0)
+            self.context.term()
+
+
+class TipPoller:
+    '''Publishes hashblock events by polling getbestblockhash, used when ZMQ is not configured'''
+    def __init__(self, rpc, bus:EventBus, interval:float=POLL_INTERVAL) -> None:
+        self.rpc = rpc
+        self.bus = bus
+        self.interval = interval
+        self.blockhash = None
+        self.task = None
+
+    async def start(self) -> 'TipPoller':
+        '''Starts polling'''
+        self.task = asyncio.ensure_future(self.run())
+        return self
+
+    async def run(self) -> None:
+        '''Polls the best block until closed'''
+        while True:
+            try:
+                blockhash = await self.rpc.call("getbestblockhash", use_cache=False)
+            except Exception as exc:
+                logging.warning(f"polling best block failed: {exc!r}")
+            else:
+                if not isinstance(blockhash, str):
+                    logging.warning(f"polling best block failed: {blockhash}")
+                elif blockhash != self.blockhash:
+                    self.blockhash = blockhash
+                    self.bus.publish("hashblock", blockhash)
+            await asyncio.sleep(self.interval)
+
+    async def close(self) -> None:
+        '''Stops polling'''
+        if self.task is not None:
+            self.task.cancel()
+
+
+async def start_notifications(rpc, bus:EventBus, urls:str=ZMQ_URLS) -> Union[ZMQSubscriber, TipPoller]:
+    '''Starts ZMQ notifications when endpoints are configured and pyzmq is installed, otherwise polls the node'''
+    if urls and zmq is not None:
+        return await ZMQSubscriber(urls.split(','), bus).start()
+    if urls:
+        logging.warning("pyzmq is not installed, polling the node for new blocks instead")
+    return await TipPoller(rpc, bus).start()
+
+
+if __name__ == "__main__":
+    raise RuntimeError("Module is not meant to be called directly")
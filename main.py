@@ -1,23 +1,158 @@
+import orjson
 import asyncio
+import hashlib
 import logging
+from contextlib import asynccontextmanager
 from websockets.exceptions import ConnectionClosedOK
 from typing import Optional, List, Union
-from fastapi import FastAPI, Request, Query, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastbtc.rpc import BitcoinRPC, RPC_USER, RPC_PASS, RPC_HOST, RPC_PORT
+from fastbtc.rpc import BitcoinRPC, raw_ok, RPC_USER, RPC_PASS, RPC_HOST, RPC_PORT, RPC_COALESCE_METHODS
+from fastbtc.cache import ResponseCache
+from fastbtc.diskcache import DiskCache, CACHE_DIR
+from fastbtc.httpcache import HTTPCache, etag
+from fastbtc.events import EventBus
+from fastbtc.broadcast import Broadcaster, DeltaBroadcaster
+from fastbtc.zmqsub import ZMQSubscriber, ZMQ_URLS, start_notifications
+from fastbtc.headers import HeaderStore, HEADERS_DIR
+from fastbtc.stats import BlockStatsStore, STATS_DIR
+from fastbtc.utxo import UTXOIndex, UTXO_DIR
+from fastbtc.txindex import TxIndex, TXINDEX_DIR
+from fastbtc.shared import SharedState, SHARED_PATH, SHARED_INTERVAL
+from fastbtc.address import scriptpubkey
+from fastbtc.mempool import MempoolMirror
+from fastbtc.pool import BitcoinRPCPool, POOL_URLS
+from fastbtc.lanes import Lanes
+from fastbtc.metrics import Metrics, RouteTimer
+from fastbtc.deadlines import Deadlines
 
 logging.basicConfig(encoding="utf-8", level=logging.DEBUG)
 
-app = FastAPI()
+headers = HeaderStore(HEADERS_DIR) if HEADERS_DIR else None
+
+blockstats = BlockStatsStore(STATS_DIR) if STATS_DIR else None
+
+utxo = UTXOIndex(UTXO_DIR) if UTXO_DIR else None
+
+txindex = TxIndex(TXINDEX_DIR) if TXINDEX_DIR else None
+
+# with several workers, one of them polls the node and the others read its snapshots
+shared = SharedState(SHARED_PATH) if SHARED_PATH else None
+
+# immutable results outlive restarts, workers sharing the directory read what the first one writes
+cache = ResponseCache(disk=DiskCache(CACHE_DIR) if CACHE_DIR else None)
+
+# encoded bodies of hash addressed routes, answered with 304s when the client has them
+responses = HTTPCache()
+
+# mirrored from ZMQ sequence notifications, mempool queries go to the node until it is synced
+mempool = MempoolMirror()
+
+# counters of the methods called through the typed wrappers exist before the first call
+metrics = Metrics(RPC_COALESCE_METHODS | {"batch"})
+
+if POOL_URLS:
+    rpc = BitcoinRPCPool(POOL_URLS.split(','), cache=cache, headers=headers, mempool=mempool, lanes=Lanes(),
+                         metrics=metrics, utxo=utxo, txindex=txindex, shared=shared)
+else:
+    rpc = BitcoinRPC(RPC_USER, RPC_PASS, RPC_HOST, RPC_PORT, cache=cache, headers=headers, mempool=mempool,
+                     lanes=Lanes(), metrics=metrics, utxo=utxo, txindex=txindex, shared=shared)
+
+bus = EventBus()
+
+# websocket topics, each fetched and serialized once per tick for all of its subscribers, peers sent as changes
+broadcasters = {
+    "peerinfo": DeltaBroadcaster(rpc.getpeerinfo, key="id"),
+    "mempoolinfo": Broadcaster(rpc.getmempoolinfo),
+    "nettotals": Broadcaster(rpc.getnettotals),
+    "tip": Broadcaster(rpc.getblockchaininfo, bus=bus, events=("hashblock",)),
+}
+
+# notifications and followers of the worker ingesting the node's state
+tasks = []
+
+notifier = None
+
+async def ingest():
+    '''Follows the node's blocks and mempool into the local stores. With several workers only the one holding the
+    shared snapshots' lock does, the others reload what it writes on each block it publishes or every SHARED_INTERVAL
+    and take over when it exits.'''
+    global notifier
+    if shared is not None and not shared.elect():
+        # notified by shared.follow of the blocks in the writer's snapshots
+        queue = bus.subscribe("hashblock", "gap")
+        try:
+            while not shared.elect():
+                for store in (headers, blockstats):
+                    if store is not None:
+                        store.reload()
+                for index in (utxo, txindex):
+                    if index is not None:
+                        await index.refresh(rpc)
+                try:
+                    await asyncio.wait_for(queue.get(), SHARED_INTERVAL)
+                    if rpc.cache is not None:
+                        # the next call takes the new tip from the snapshot
+                        rpc.cache.tip_checked = float('-inf')
+                except asyncio.TimeoutError:
+                    pass
+                while not queue.empty():
+                    queue.get_nowait()
+        finally:
+            bus.unsubscribe(queue, "hashblock", "gap")
+    notifier = await start_notifications(rpc, bus, ZMQ_URLS)
+    if isinstance(notifier, ZMQSubscriber):
+        tasks.append(asyncio.ensure_future(rpc.follow_tip(bus)))
+        tasks.append(asyncio.ensure_future(mempool.follow(rpc, bus)))
+    for store in (headers, blockstats, utxo, txindex):
+        if store is not None:
+            tasks.append(asyncio.ensure_future(store.follow(rpc, bus)))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if isinstance(rpc, BitcoinRPCPool):
+        await rpc.start()
+    if cache.disk is not None:
+        logging.info(f"response cache warmed with {cache.warm()} results from disk")
+    tasks.append(asyncio.ensure_future(ingest()))
+    if shared is not None:
+        tasks.append(asyncio.ensure_future(shared.follow(rpc, bus)))
+    yield
+    for task in tasks:
+        task.cancel()
+    tasks.clear()
+    for broadcaster in broadcasters.values():
+        await broadcaster.close()
+    if notifier is not None:
+        await notifier.close()
+    await rpc.close()
+    if headers is not None:
+        headers.close()
+    if blockstats is not None:
+        blockstats.close()
+    if utxo is not None:
+        utxo.close()
+    if txindex is not None:
+        txindex.close()
+    if cache.disk is not None:
+        cache.disk.close()
+    if shared is not None:
+        shared.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# inside the route timer, so the 504s it answers are timed too
+app.add_middleware(Deadlines, metrics=metrics)
+
+app.add_middleware(RouteTimer, metrics=metrics)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 templates = Jinja2Templates(directory="templates")
 
-rpc = BitcoinRPC(RPC_USER, RPC_PASS, RPC_HOST, RPC_PORT)
-
 ######## RENDERED PAGES ########
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
@@ -28,15 +163,33 @@ async def index(request: Request):
         }
     )
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.render(rpc), media_type="text/plain; version=0.0.4")
+
 ######## WSS ENDPOINTS ########
-@app.websocket("/ws/peerinfo")
-async def ws_peerinfo(websocket: WebSocket):
+@app.websocket("/ws/blocks")
+async def ws_blocks(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        async for _, blockhash in bus.listen("hashblock"):
+            await websocket.send_json({"hash": blockhash})
+    except (ConnectionClosedOK, WebSocketDisconnect):
+        logging.debug("ws client disconnected")
+
+@app.websocket("/ws/{topic}")
+async def ws_topic(websocket: WebSocket, topic:str):
+    broadcaster = broadcasters.get(topic)
+    if broadcaster is None:
+        await websocket.close(code=1008)
+        return
     await websocket.accept()
     try:
-        while True:
-            await websocket.send_json(await rpc.getpeerinfo())
-            await asyncio.sleep(5)
-    except ConnectionClosedOK:
+        async for frame in broadcaster.stream():
+            await websocket.send_bytes(frame)
+        logging.debug("ws client too slow or topic stopped, disconnecting")
+        await websocket.close(code=1013)
+    except (ConnectionClosedOK, WebSocketDisconnect):
         logging.debug("ws client disconnected")
 
 ######## API ENDPOINTS ########
@@ -119,17 +272,42 @@ async def getblockhash(block:int):
     return await rpc.getblockhash(block)
 
 @app.get("/rpc/getblockheader/{blockhash}")
-async def getblockheader(blockhash:str, verbose:Optional[bool]=None):
-    return await rpc.getblockheader(blockhash, verbose)
+async def getblockheader(request:Request, blockhash:str, verbose:Optional[bool]=None):
+    async def fetch():
+        header = await rpc.getblockheader(blockhash, verbose)
+        # a hex string, or an object with its hash, errors are objects with a code and message
+        return isinstance(header, str) or "hash" in header, orjson.dumps(header)
+    if verbose is False:
+        return await responses.respond(request, etag(blockhash, "header"), True, fetch)
+    # confirmations and nextblockhash change with the tip
+    tip = await rpc.tip()
+    return await responses.respond(request, etag(blockhash, "header", "verbose", tip[-16:]) if tip else None, False, fetch)
 
 @app.get("/rpc/getblock/{blockhash}")
-async def getblock(blockhash:str, verbosity:Optional[int]=None):
-    return await rpc.getblock(blockhash, verbosity)
+async def getblock(request:Request, blockhash:str, verbosity:Optional[int]=None):
+    async def fetch():
+        block = await rpc.getblock(blockhash, verbosity, raw=True)
+        return raw_ok(block), block
+    if verbosity == 0:
+        return await responses.respond(request, etag(blockhash, "block", 0), True, fetch)
+    tip = await rpc.tip()
+    return await responses.respond(request, etag(blockhash, "block", verbosity or 1, tip[-16:]) if tip else None, False, fetch)
 
 @app.post("/rpc/getblockstats")
 async def getblockstats(hash_or_height:Union[str, int], stats:list=[]):
     return await rpc.getblockstats(hash_or_height, stats)
 
+@app.get("/rpc/blockstats/{stat}")
+async def blockstats_range(stat:str, start:int=0, stop:Optional[int]=None, step:int=Query(1, ge=1),
+                           period:Optional[int]=Query(None, ge=1), agg:str="mean", window:Optional[int]=Query(None, ge=1)):
+    if blockstats is None:
+        raise HTTPException(status_code=404, detail="Block stats store is disabled, set FASTBTC_STATS_DIR")
+    try:
+        series = blockstats.query(stat, start, stop, step, period, agg, window)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return Response(orjson.dumps(series, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
+
 @app.get("/rpc/getaddressinfo/{address}")
 async def getaddressinfo(address:str):
     return await rpc.getaddressinfo(address)
@@ -166,8 +344,20 @@ async def verifychain(checklevel:Optional[int]=None, nblocks:Optional[int]=None)
     return await rpc.verifychain(checklevel, nblocks)
 
 @app.get("/rpc/getblockinfo/{height}")
-async def getblockinfo(height:int, verbosity:Optional[int]=None):
-    return await rpc.getblockinfo(height, verbosity)
+async def getblockinfo(request:Request, height:int, verbosity:Optional[int]=None):
+    async def fetch():
+        block = await rpc.getblockinfo(height, verbosity, raw=True)
+        return raw_ok(block), block
+    tip = await rpc.tip()
+    if tip is None:
+        return await responses.respond(request, None, False, fetch)
+    if verbosity == 0 and rpc.cache.height is not None and height <= rpc.cache.height - rpc.cache.confirmations:
+        # deep enough for its hash to be cached as final, validated like the block by hash
+        blockhash = await rpc.getblockhash(height)
+        if isinstance(blockhash, str):
+            return await responses.respond(request, etag(blockhash, "block", 0), True, fetch)
+    # the chain up to the tip decides which block is at height
+    return await responses.respond(request, etag(tip, "height", height, verbosity or 1), False, fetch)
 
 @app.get("/rpc/validateaddress/{address}")
 async def validateaddress(address:str):
@@ -182,8 +372,12 @@ async def signmessagewithprivkey(privkey:str, message:str):
     return await rpc.signmessagewithprivkey(privkey, message)
 
 @app.get("/rpc/decodescript/{hexstring}")
-async def decodescript(hexstring:str):
-    return await rpc.decodescript(hexstring)
+async def decodescript(request:Request, hexstring:str):
+    async def fetch():
+        script = await rpc.decodescript(hexstring)
+        return "asm" in script, orjson.dumps(script)
+    digest = hashlib.blake2b(hexstring.encode(), digest_size=32).hexdigest()
+    return await responses.respond(request, etag(digest, "script"), True, fetch)
 
 @app.get("/rpc/decoderawtransaction/{hexstring}")
 async def decoderawtransaction(hexstring:str, is_witness:Optional[bool]=None):
@@ -194,8 +388,10 @@ async def getmempoolinfo():
     return await rpc.getmempoolinfo()
 
 @app.get("/rpc/getrawmempool")
-async def getrawmempool():
-    return await rpc.getrawmempool()
+async def getrawmempool(verbose:bool=False, mempool_sequence:bool=False):
+    if mempool.synced:
+        return Response(orjson.dumps(mempool.getrawmempool(verbose, mempool_sequence)), media_type="application/json")
+    return StreamingResponse(rpc.stream("getrawmempool", [verbose, mempool_sequence]), media_type="application/json")
 
 @app.get("/rpc/getmempoolentry/{txid}")
 async def getmempoolentry(txid:str):
@@ -213,5 +409,76 @@ async def getmempooldescendants(txid:str, verbose:Optional[bool]=None):
 async def getsatoshis(address:str):
     return await rpc.getsatoshis(address)
 
+######## BULK ENDPOINTS ########
+BULK_MAX_KEYS = 100_000                 # keys accepted per bulk request
+
+class Outpoint(BaseModel):
+    txid: str
+    n: int
+    include_mempool: Optional[bool] = None
+
+def ndjson(keys:list, calls:list) -> StreamingResponse:
+    '''Streams the results of the calls as NDJSON lines in input order, each with its key and result or error'''
+    if len(keys) > BULK_MAX_KEYS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_KEYS} keys per request")
+
+    async def lines():
+        keys_iter = iter(keys)
+        async for result, error in rpc.iter_many(calls):
+            key = next(keys_iter)
+            yield orjson.dumps({"key": key, "error": error} if error else {"key": key, "result": result}) + b"\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/rpc/bulk/getmempoolentry")
+async def bulk_getmempoolentry(txids:List[str]):
+    return ndjson(txids, [("getmempoolentry", [txid]) for txid in txids])
+
+@app.post("/rpc/bulk/gettxout")
+async def bulk_gettxout(outpoints:List[Outpoint]):
+    keys = [{"txid": outpoint.txid, "n": outpoint.n} for outpoint in outpoints]
+    calls = [
+        ("gettxout", [outpoint.txid, outpoint.n] + ([outpoint.include_mempool] if outpoint.include_mempool is not None else []))
+        for outpoint in outpoints
+    ]
+    return ndjson(keys, calls)
+
+@app.post("/rpc/bulk/getblockheader")
+async def bulk_getblockheader(blockhashes:List[str], verbose:Optional[bool]=None):
+    return ndjson(blockhashes, [("getblockheader", [blockhash, verbose]) for blockhash in blockhashes])
+
+@app.post("/rpc/bulk/getblockhash")
+async def bulk_getblockhash(heights:List[int]):
+    return ndjson(heights, [("getblockhash", [height]) for height in heights])
+
+@app.post("/rpc/bulk/getsatoshis")
+async def bulk_getsatoshis(addresses:List[str]):
+    if len(addresses) > BULK_MAX_KEYS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_KEYS} keys per request")
+    if utxo is None or not utxo.synced:
+        raise HTTPException(status_code=503, detail="Address index is disabled or not synced, set FASTBTC_UTXO_DIR")
+    scripts = {}
+    for address in addresses:
+        try:
+            scripts[address] = scriptpubkey(address)
+        except ValueError:
+            pass
+    balances = dict(zip(scripts, utxo.balances(list(scripts.values()))))
+    lines = (
+        {"key": address, "result": balances[address]} if address in balances
+        else {"key": address, "error": {"code": -5, "message": "Invalid address"}}
+        for address in addresses
+    )
+    return Response(b"".join(orjson.dumps(line) + b"\n" for line in lines), media_type="application/x-ndjson")
+
+@app.get("/rpc/bulk/getblockhash")
+async def bulk_getblockhash_range(start:int, stop:int):
+    # checked before a call is built, the range may be huge
+    if stop < start:
+        raise HTTPException(status_code=400, detail="stop must not be below start")
+    if stop - start + 1 > BULK_MAX_KEYS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_KEYS} keys per request")
+    heights = range(start, stop + 1)
+    return ndjson(heights, [("getblockhash", [height]) for height in heights])
+
 if __name__ == "__main__":
     rpc.close()
\ No newline at end of file
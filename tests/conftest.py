@@ -0,0 +1,16 @@
+import pytest
+from fastbtc.rpc import BitcoinRPC
+from tests.fakenode import FakeNode
+
+
+@pytest.fixture
+async def node():
+    node = await FakeNode().start()
+    yield node
+    await node.stop()
+
+
+@pytest.fixture
+async def rpc(node):
+    async with BitcoinRPC("user", "pass", "127.0.0.1", node.port) as rpc:
+        yield rpc
@@ -0,0 +1,95 @@
+import orjson
+import random
+import asyncio
+from aiohttp import web
+from typing import Callable, Dict
+
+
+class RPCError(Exception):
+    '''Raised by a fake method to reply with a JSON-RPC error'''
+    def __init__(self, code:int, message:str) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class Raw(bytes):
+    '''Result already serialized as JSON, replied as is'''
+
+
+class FakeNode:
+    '''Local aiohttp JSON-RPC server standing in for bitcoind'''
+    def __init__(self, methods:Dict[str, Callable]=None, latency:float=0,
+                 error_rate:float=0, busy_rate:float=0, seed:int=0) -> None:
+        self.methods = dict(methods or {})
+        self.latency = latency  # seconds added to every HTTP request
+        self.error_rate = error_rate    # fraction of calls answered with an internal error
+        self.busy_rate = busy_rate      # fraction of HTTP requests rejected with 503
+        self.random = random.Random(seed)
+        self.rest = {}          # REST path, e.g. "block/<hash>.bin" -> body
+        self.busy = 0           # next requests rejected with 503 as when the work queue is full
+        self.posts = 0          # number of HTTP requests received
+        self.calls = []         # (method, params) of every call received
+        self.runner = None
+        self.port = None
+
+    async def start(self, port:int=0) -> 'FakeNode':
+        '''Starts serving on a local port, a free one by default'''
+        app = web.Application()
+        app.router.add_post("/", self.handle)
+        app.router.add_get("/rest/{path:.*}", self.handle_rest)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        '''Stops serving'''
+        await self.runner.cleanup()
+
+    def dispatch(self, command:dict) -> dict:
+        '''Runs a single JSON-RPC command and returns its reply object'''
+        method, params = command["method"], command.get("params", [])
+        self.calls.append((method, params))
+        reply = {"result": None, "error": None, "id": command.get("id")}
+        try:
+            if method not in self.methods:
+                raise RPCError(-32601, "Method not found")
+            if self.error_rate and self.random.random() < self.error_rate:
+                raise RPCError(-32603, "Internal error")
+            reply["result"] = self.methods[method](*params)
+        except RPCError as exc:
+            reply["error"] = {"code": exc.code, "message": exc.message}
+        return reply
+
+    async def handle(self, request:web.Request) -> web.Response:
+        '''Answers single and batched JSON-RPC requests'''
+        self.posts += 1
+        if self.busy or (self.busy_rate and self.random.random() < self.busy_rate):
+            self.busy = max(self.busy - 1, 0)
+            return web.Response(status=503, text="Work queue depth exceeded")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        payload = orjson.loads(await request.read())
+        if isinstance(payload, list):
+            body = b"[" + b",".join(self.serialize(self.dispatch(command)) for command in payload) + b"]"
+        else:
+            body = self.serialize(self.dispatch(payload))
+        return web.Response(body=body, content_type="application/json")
+
+    @staticmethod
+    def serialize(reply:dict) -> bytes:
+        '''Serializes a reply in the member order of bitcoind, splicing in Raw results'''
+        if isinstance(reply["result"], Raw):
+            return b'{"result":' + reply["result"] + b',"error":null,"id":' + orjson.dumps(reply["id"]) + b'}'
+        return orjson.dumps(reply)
+
+    async def handle_rest(self, request:web.Request) -> web.Response:
+        '''Answers REST requests from the registered bodies'''
+        self.posts += 1
+        body = self.rest.get(request.match_info["path"])
+        if body is None:
+            return web.Response(status=404, text="Block not found\n")
+        return web.Response(body=body, content_type="application/octet-stream")
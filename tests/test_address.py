@@ -0,0 +1,25 @@
+import pytest
+from fastbtc.address import scriptpubkey
+
+
+class TestClassAddress:
+
+    @pytest.mark.parametrize("address, script", [
+        ("1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMH", "76a914751e76e8199196d454941c45d1b3a323f1433bd688ac"),
+        ("3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy", "a914b472a266d0bd89c13706a4132ccfb16f7c3b9fcb87"),
+        ("BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4", "0014751e76e8199196d454941c45d1b3a323f1433bd6"),
+        ("bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0",
+         "512079be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798"),
+    ])
+    def test_scriptpubkey(self, address, script):
+        assert scriptpubkey(address).hex() == script
+
+    @pytest.mark.parametrize("address", [
+        "1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMJ",
+        "bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t5",
+        "bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kemeawh",     # bech32m checksum on a version 0 program
+        "not an address",
+    ])
+    def test_invalid(self, address):
+        with pytest.raises(ValueError):
+            scriptpubkey(address)
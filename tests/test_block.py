@@ -0,0 +1,115 @@
+import pytest
+from fastbtc.block import Block, BlockHeader, Transaction, sha256d
+
+
+GENESIS = bytes.fromhex(
+    "0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e"
+    "67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c01010000000100000000000000000000"
+    "00000000000000000000000000000000000000000000ffffffff4d04ffff001d0104455468652054696d65732030332f"
+    "4a616e2f32303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e64206261696c6f757420"
+    "666f722062616e6b73ffffffff0100f2052a01000000434104678afdb0fe5548271967f1a67130b7105cd6a828e039"
+    "09a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000"
+)
+GENESIS_HASH = "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f"
+GENESIS_TXID = "4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b"
+
+
+def segwit_tx(seed:int=1) -> tuple:
+    '''Returns a serialized P2WPKH spend and its serialization without witness'''
+    version = (2).to_bytes(4, 'little')
+    inputs = b"\x01" + bytes([seed]) * 32 + (3).to_bytes(4, 'little') + b"\x00" + b"\xfd\xff\xff\xff"
+    outputs = b"\x02" + b"".join(
+        value.to_bytes(8, 'little') + b"\x16\x00\x14" + bytes([seed + n]) * 20
+        for n, value in enumerate((150_000, 2_500_000))
+    )
+    witness = b"\x02" + b"\x48" + b"\x30" * 72 + b"\x21" + b"\x02" * 33
+    locktime = (800_000).to_bytes(4, 'little')
+    return (version + b"\x00\x01" + inputs + outputs + witness + locktime,
+            version + inputs + outputs + locktime)
+
+
+class TestClassBlock:
+
+    def test_genesis(self):
+        block = Block(GENESIS)
+        assert block.hash == GENESIS_HASH
+        assert block.header.merkleroot == GENESIS_TXID
+        assert block.header.previousblockhash == "00" * 32
+        assert block.header.time == 1231006505
+        assert block.header.bits == "1d00ffff"
+        assert block.header.nonce == 2083236893
+        assert len(block) == 1
+        assert block.size == 285
+        assert block.weight == 1140
+
+    def test_genesis_coinbase(self):
+        coinbase = Block(GENESIS).transactions[0]
+        assert coinbase.txid == GENESIS_TXID
+        assert coinbase.wtxid == GENESIS_TXID
+        assert coinbase.is_coinbase
+        assert not coinbase.is_segwit
+        assert coinbase.outputs[0].value == 50 * 10**8
+        assert b"Chancellor on brink" in bytes(coinbase.inputs[0].scriptsig)
+
+    def test_header(self):
+        header = BlockHeader(GENESIS[:80])
+        assert header.hash == GENESIS_HASH
+        assert header.target == 0xffff << 208
+
+    def test_segwit_transaction(self):
+        raw, stripped = segwit_tx()
+        tx = Transaction.from_bytes(raw)
+        assert tx.is_segwit
+        assert tx.txid == sha256d(stripped)[::-1].hex()
+        assert tx.wtxid == sha256d(raw)[::-1].hex()
+        assert tx.weight == 3 * len(stripped) + len(raw)
+        assert tx.vsize == (tx.weight + 3) // 4
+        assert tx.locktime == 800_000
+        assert [out.value for out in tx.outputs] == [150_000, 2_500_000]
+        assert bytes(tx.outputs[1].scriptpubkey) == b"\x00\x14" + bytes([2]) * 20
+        assert tx.inputs[0].txid == (bytes([1]) * 32).hex()
+        assert tx.inputs[0].vout == 3
+        assert [len(item) for item in tx.inputs[0].witness] == [72, 33]
+
+    def test_lazy_decoding(self):
+        raw, _ = segwit_tx()
+        block = Block(GENESIS[:80] + b"\x02" + raw + segwit_tx(5)[0])
+        txs = block.transactions
+        assert [tx.size for tx in txs] == [len(raw)] * 2
+        assert txs[1]._inputs is None and txs[1]._txid is None
+        assert txs[1].inputs[0].txid == (bytes([5]) * 32).hex()
+
+    def test_trailing_bytes(self):
+        raw, _ = segwit_tx()
+        with pytest.raises(ValueError):
+            Transaction.from_bytes(raw + b"\x00")
+
+    def test_truncated(self):
+        raw, _ = segwit_tx()
+        with pytest.raises((ValueError, IndexError)):
+            Transaction.from_bytes(raw[:-10])
+
+
+@pytest.mark.asyncio
+class TestClassBinaryBackend:
+
+    async def test_getblockinfo_binary(self, node, rpc):
+        node.methods["getblockhash"] = lambda height: GENESIS_HASH
+        node.methods["getblock"] = lambda blockhash, verbosity: GENESIS.hex()
+        block = await rpc.getblockinfo(0, binary=True)
+        assert block.hash == GENESIS_HASH
+        assert node.calls[-1] == ("getblock", [GENESIS_HASH, 0])
+
+    async def test_getblockparsed_rest(self, node, rpc):
+        node.rest[f"block/{GENESIS_HASH}.bin"] = GENESIS
+        block = await rpc.getblockparsed(GENESIS_HASH, rest=True)
+        assert block.transactions[0].txid == GENESIS_TXID
+        missing = await rpc.getblockparsed("00" * 32, rest=True)
+        assert missing["code"] == 404
+
+    async def test_getrawtransaction_binary(self, node, rpc):
+        raw, _ = segwit_tx()
+        node.methods["getrawtransaction"] = lambda txid, verbose: raw.hex()
+        tx = await rpc.getrawtransaction("ab" * 32, verbose=True, binary=True)
+        assert tx.wtxid == sha256d(raw)[::-1].hex()
+        assert node.calls[-1] == ("getrawtransaction", ["ab" * 32, False])
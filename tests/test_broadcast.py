@@ -0,0 +1,214 @@
+import pytest
+import asyncio
+import orjson
+from fastbtc.events import EventBus
+from fastbtc.broadcast import Broadcaster, DeltaBroadcaster
+
+
+class Counter:
+    '''Fetch function counting its calls'''
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def __call__(self) -> dict:
+        self.calls += 1
+        return {"tick": self.calls}
+
+
+class Peers:
+    '''Fetch function returning peers whose traffic counters grow on every call'''
+    def __init__(self, count:int) -> None:
+        self.peers = [
+            {"id": n, "addr": f"10.0.0.{n}:8333", "addrbind": "10.0.0.254:8333", "network": "ipv4",
+             "services": "0000000000000c09", "servicesnames": ["NETWORK", "WITNESS", "NETWORK_LIMITED", "P2P_V2"],
+             "relaytxes": True, "conntime": 1_700_000_000 + n, "pingtime": 0.05, "minping": 0.04, "version": 70016,
+             "subver": "/Satoshi:26.0.0/", "inbound": False, "startingheight": 820_000, "synced_headers": 820_000,
+             "synced_blocks": 820_000, "permissions": [], "minfeefilter": 0.00001, "connection_type": "outbound-full-relay",
+             "transport_protocol_type": "v2", "session_id": f"{n:064x}", "bytessent": 1000 * n, "bytesrecv": 5000 * n}
+            for n in range(count)
+        ]
+
+    async def __call__(self) -> list:
+        for peer in self.peers:
+            peer["bytessent"] += 100
+        return [dict(peer) for peer in self.peers]
+
+
+def apply(peers:dict, frame:bytes) -> dict:
+    '''Rebuilds the peers by id from a frame, as the dashboard does'''
+    data = orjson.loads(frame)
+    if data["type"] == "key":
+        return {peer["id"]: peer for peer in data["items"]}
+    peers = {id: dict(peer) for id, peer in peers.items() if id not in data["removed"]}
+    peers.update((peer["id"], peer) for peer in data["added"])
+    for change in data["changed"]:
+        peer = peers[change["id"]]
+        peer.update(change)
+        for field in [field for field, value in change.items() if value is None]:
+            del peer[field]
+    return peers
+
+
+async def receive(queue:asyncio.Queue):
+    return await asyncio.wait_for(queue.get(), 5)
+
+
+@pytest.mark.asyncio
+class TestClassBroadcaster:
+
+    async def test_fetches_once_for_all_subscribers(self):
+        fetch = Counter()
+        broadcaster = Broadcaster(fetch, interval=60)
+        queues = [broadcaster.subscribe() for _ in range(10)]
+        frames = [await receive(queue) for queue in queues]
+        assert frames == [orjson.dumps({"tick": 1})] * 10
+        assert all(frame is frames[0] for frame in frames)
+        assert fetch.calls == 1
+        await broadcaster.close()
+
+    async def test_new_subscriber_gets_latest_frame(self):
+        broadcaster = Broadcaster(Counter(), interval=60)
+        await receive(broadcaster.subscribe())
+        assert await receive(broadcaster.subscribe()) == orjson.dumps({"tick": 1})
+        await broadcaster.close()
+
+    async def test_slow_subscriber_skips_to_latest(self):
+        broadcaster = Broadcaster(Counter(), interval=60)
+        queue = broadcaster.subscribe()
+        for tick in range(3):
+            broadcaster.publish(orjson.dumps({"tick": tick}))
+        assert queue.qsize() == 1
+        assert queue.get_nowait() == orjson.dumps({"tick": 2})
+        assert broadcaster.stats["dropped"] == 2
+        await broadcaster.close()
+
+    async def test_slow_subscriber_disconnected(self):
+        broadcaster = Broadcaster(Counter(), interval=60, policy="disconnect")
+        stream = broadcaster.stream()
+        assert await stream.__anext__() == orjson.dumps({"tick": 1})
+        broadcaster.publish(b"2")
+        broadcaster.publish(b"3")
+        with pytest.raises(StopAsyncIteration):
+            await stream.__anext__()
+        assert not broadcaster.subscribers
+        assert broadcaster.stats["disconnected"] == 1
+
+    async def test_stops_without_subscribers(self):
+        fetch = Counter()
+        broadcaster = Broadcaster(fetch, interval=0.01)
+        queue = broadcaster.subscribe()
+        await receive(queue)
+        broadcaster.unsubscribe(queue)
+        calls = fetch.calls
+        await asyncio.sleep(0.05)
+        assert fetch.calls == calls
+        assert broadcaster.task is None
+
+    async def test_refresh_on_event(self):
+        fetch = Counter()
+        bus = EventBus()
+        broadcaster = Broadcaster(fetch, interval=60, bus=bus, events=("hashblock",))
+        queue = broadcaster.subscribe()
+        await receive(queue)
+        bus.publish("hashblock", "00" * 32)
+        assert await receive(queue) == orjson.dumps({"tick": 2})
+        await broadcaster.close()
+
+    async def test_fetch_failures_survived(self):
+        fetch = Counter()
+        failures = [asyncio.TimeoutError(), ValueError("unexpected reply")]
+
+        async def flaky():
+            if failures:
+                raise failures.pop(0)
+            return await fetch()
+        broadcaster = Broadcaster(flaky, interval=0.01)
+        queue = broadcaster.subscribe()
+        assert await receive(queue) == orjson.dumps({"tick": 1})
+        assert not broadcaster.task.done()
+        await broadcaster.close()
+
+    async def test_stopped_task_ends_streams(self):
+        async def broken():
+            raise RuntimeError("bug")
+        broadcaster = Broadcaster(Counter(), interval=0.01)
+        broadcaster.refresh = broken
+        frames = [frame async for frame in broadcaster.stream()]
+        assert frames == [] and not broadcaster.subscribers
+
+
+@pytest.mark.asyncio
+class TestClassDeltaBroadcaster:
+
+    async def test_deltas(self):
+        fetch = Peers(125)
+        broadcaster = DeltaBroadcaster(fetch, interval=60)
+        queue = broadcaster.subscribe()
+        keyframe = await receive(queue)
+        assert orjson.loads(keyframe)["type"] == "key"
+        peers = apply({}, keyframe)
+        fetch.peers.pop(3)
+        fetch.peers.append({"id": 200, "addr": "10.0.1.1:8333", "bytessent": 0})
+        del fetch.peers[0]["pingtime"]
+        await broadcaster.refresh()
+        frame = queue.get_nowait()
+        delta = orjson.loads(frame)
+        assert (delta["type"], delta["seq"], delta["removed"]) == ("delta", 2, [3])
+        assert delta["added"] == [{"id": 200, "addr": "10.0.1.1:8333", "bytessent": 100}]
+        assert delta["changed"][0] == {"id": 0, "pingtime": None, "bytessent": 200}
+        assert delta["changed"][1] == {"id": 1, "bytessent": 1200}
+        peers = apply(peers, frame)
+        assert peers == {peer["id"]: peer for peer in fetch.peers}
+        # an order of magnitude smaller than the full list
+        assert len(frame) * 10 < len(keyframe)
+        await broadcaster.close()
+
+    async def test_keyframes(self):
+        broadcaster = DeltaBroadcaster(Peers(5), interval=60, keyframe_interval=3)
+        queue = broadcaster.subscribe()
+        await receive(queue)
+        types = []
+        for _ in range(5):
+            await broadcaster.refresh()
+            types.append(orjson.loads(queue.get_nowait())["type"])
+        assert types == ["delta", "key", "delta", "delta", "key"]
+        # a new subscriber starts from the latest keyframe, not the latest delta
+        await broadcaster.refresh()
+        frame = orjson.loads(broadcaster.subscribe().get_nowait())
+        assert (frame["type"], frame["seq"], len(frame["items"])) == ("key", 7, 5)
+        await broadcaster.close()
+
+    async def test_keyframe_serialized_when_needed(self, monkeypatch):
+        serialized = []
+        class Spy:
+            def __getattr__(self, name):
+                return getattr(orjson, name)
+            def dumps(self, value):
+                serialized.append(value["type"])
+                return orjson.dumps(value)
+        monkeypatch.setattr("fastbtc.broadcast.orjson", Spy())
+        broadcaster = DeltaBroadcaster(Peers(5), interval=60)
+        queue = broadcaster.subscribe()
+        await receive(queue)
+        for _ in range(3):
+            await broadcaster.refresh()
+            queue.get_nowait()
+        assert serialized == ["key", "delta", "delta", "delta"]
+        # built once, when the first subscriber needs it
+        frame = broadcaster.subscribe().get_nowait()
+        assert broadcaster.subscribe().get_nowait() == frame and orjson.loads(frame)["seq"] == 4
+        assert serialized == ["key", "delta", "delta", "delta", "key"]
+        await broadcaster.close()
+
+    async def test_slow_subscriber_resyncs(self):
+        fetch = Peers(5)
+        broadcaster = DeltaBroadcaster(fetch, interval=60)
+        queue = broadcaster.subscribe()
+        await receive(queue)
+        await broadcaster.refresh()
+        await broadcaster.refresh()
+        frame = orjson.loads(queue.get_nowait())
+        assert (frame["type"], frame["seq"]) == ("key", 3)
+        assert apply({}, orjson.dumps(frame)) == {peer["id"]: peer for peer in fetch.peers}
+        assert broadcaster.stats["dropped"] == 1
+        await broadcaster.close()
@@ -0,0 +1,170 @@
+import pytest
+import asyncio
+import orjson
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.events import EventBus
+from fastbtc.cache import LRUCache, ResponseCache
+
+
+class Chain:
+    '''Minimal chain served by the fake node'''
+    def __init__(self, height:int) -> None:
+        self.height = height
+
+    def hash(self, height:int) -> str:
+        return f"{height:064x}"
+
+    def getbestblockhash(self) -> str:
+        return self.hash(self.height)
+
+    def getblockcount(self) -> int:
+        return self.height
+
+    def getblockhash(self, height:int) -> str:
+        return self.hash(height)
+
+    def getblockheader(self, blockhash:str, verbose:bool=True) -> dict:
+        height = int(blockhash, 16)
+        return {"hash": blockhash, "height": height, "confirmations": self.height - height + 1}
+
+    def getblock(self, blockhash:str, verbosity:int=1) -> dict:
+        return {**self.getblockheader(blockhash), "tx": []}
+
+    def serve(self, node) -> None:
+        for method in ("getbestblockhash", "getblockcount", "getblockhash", "getblockheader", "getblock"):
+            node.methods[method] = getattr(self, method)
+
+
+@pytest.fixture
+async def cached(node):
+    cache = ResponseCache(tip_interval=0)
+    async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, cache=cache) as rpc:
+        yield rpc
+
+
+class TestClassLRUCache:
+
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(max_bytes=30)
+        lru.put("a", 1, 10)
+        lru.put("b", 2, 10)
+        lru.put("c", 3, 10)
+        lru.get("a")
+        lru.put("d", 4, 10)
+        assert "b" not in lru
+        assert [key for key in lru.entries] == ["c", "a", "d"]
+        assert lru.nbytes == 30
+        assert lru.evictions == 1
+
+    def test_rejects_oversized(self):
+        lru = LRUCache(max_bytes=10)
+        lru.put("a", 1, 11)
+        assert len(lru) == 0
+
+
+@pytest.mark.asyncio
+class TestClassResponseCache:
+
+    async def test_immutable_block(self, node, cached):
+        chain = Chain(100)
+        chain.serve(node)
+        blockhash = chain.hash(10)
+        first = await cached.getblock(blockhash)
+        chain.height = 101
+        second = await cached.getblock(blockhash)
+        assert [method for method, _ in node.calls].count("getblock") == 1
+        assert first["confirmations"] == 91
+        assert second["confirmations"] == 92
+        assert cached.cache.stats["hits"] == 1
+
+    async def test_tip_scoped_invalidated(self, node, cached):
+        chain = Chain(100)
+        chain.serve(node)
+        assert await cached.getblockcount() == 100
+        assert await cached.getblockcount() == 100
+        assert [method for method, _ in node.calls].count("getblockcount") == 1
+        chain.height = 101
+        assert await cached.getblockcount() == 101
+        assert cached.cache.tip_hash == chain.hash(101)
+
+    async def test_recent_blocks_tip_scoped(self, node, cached):
+        chain = Chain(100)
+        chain.serve(node)
+        await cached.getblock(chain.hash(99))
+        assert len(cached.cache.tip) == 1
+        chain.height = 101
+        block = await cached.getblock(chain.hash(99))
+        assert block["confirmations"] == 3
+        assert [method for method, _ in node.calls].count("getblock") == 2
+
+    async def test_getblockhash_depth(self, node, cached):
+        chain = Chain(100)
+        chain.serve(node)
+        await cached.getblockcount()
+        await cached.getblockhash(10)
+        await cached.getblockhash(99)
+        key = ResponseCache.key
+        assert key("getblockhash", [10]) in cached.cache.immutable
+        assert key("getblockhash", [99]) in cached.cache.tip
+
+    async def test_raw_cached(self, node, cached):
+        chain = Chain(100)
+        chain.serve(node)
+        blockhash = chain.hash(10)
+        first = await cached.getblock(blockhash, raw=True)
+        # carries confirmations, kept until the tip changes
+        assert ResponseCache.raw_key("getblock", [blockhash, 1]) in cached.cache.tip
+        assert await cached.getblock(blockhash, raw=True) == bytes(first)
+        assert (await cached.getblock(blockhash))["hash"] == blockhash
+        assert [method for method, _ in node.calls].count("getblock") == 1
+
+    async def test_raw_not_decoded(self, node, cached, monkeypatch):
+        chain = Chain(100)
+        chain.serve(node)
+        decoded = []
+
+        class Spy:
+            def __getattr__(self, name):
+                return getattr(orjson, name)
+
+            def loads(self, data):
+                decoded.append(bytes(data))
+                return orjson.loads(data)
+        monkeypatch.setattr("fastbtc.rpc.orjson", Spy())
+        monkeypatch.setattr("fastbtc.cache.orjson", Spy())
+        blockhash = chain.hash(10)
+        await cached.getblockcount()
+        # the tip is known, only the block itself is sent from here on
+        cached.cache.tip_interval = float('inf')
+        decoded.clear()
+        first = await cached.getblock(blockhash, raw=True)
+        assert await cached.getblock(blockhash, raw=True) == bytes(first)
+        assert decoded == []
+
+    async def test_bypass(self, node, cached):
+        chain = Chain(100)
+        chain.serve(node)
+        blockhash = chain.hash(10)
+        await cached.getblock(blockhash)
+        await cached.call("getblock", [blockhash, 1], use_cache=False)
+        assert [method for method, _ in node.calls].count("getblock") == 2
+
+    async def test_errors_not_cached(self, node, cached):
+        chain = Chain(100)
+        chain.serve(node)
+        assert (await cached.decodescript("00"))["code"] == -32601
+        assert len(cached.cache.immutable) == 0
+
+    async def test_follow_tip(self, node, cached):
+        chain = Chain(100)
+        chain.serve(node)
+        bus = EventBus()
+        task = asyncio.ensure_future(cached.follow_tip(bus))
+        await asyncio.sleep(0)
+        bus.publish("hashblock", chain.hash(100))
+        while cached.cache.height is None:
+            await asyncio.sleep(0.01)
+        assert cached.cache.tip_hash == chain.hash(100)
+        assert await cached.getblockcount() == 100
+        assert "getbestblockhash" not in [method for method, _ in node.calls]
+        task.cancel()
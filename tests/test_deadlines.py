@@ -0,0 +1,118 @@
+import time
+import httpx
+import pytest
+import asyncio
+import main
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.lanes import Lanes
+from fastbtc.metrics import Metrics
+from fastbtc.deadlines import route_timeout, DEADLINE_MAX, ROUTE_TIMEOUT
+
+
+def scope(path:str, headers:list=()) -> dict:
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"nblocks=6",
+        "headers": [(b"host", b"test"), *headers], "server": ("test", 80), "client": ("127.0.0.1", 1234),
+    }
+
+
+@pytest.fixture
+async def slow(node, monkeypatch):
+    node.latency = 1.0
+    node.methods["verifychain"] = lambda checklevel=None, nblocks=None: True
+    async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, lanes=Lanes(), metrics=Metrics()) as rpc:
+        monkeypatch.setattr(main, "rpc", rpc)
+        yield rpc
+
+
+class TestClassRouteTimeout:
+
+    def test_route_timeout(self):
+        assert route_timeout(scope("/rpc/getblockcount")) == ROUTE_TIMEOUT
+        assert route_timeout(scope("/rpc/verifychain")) == 600.0
+        assert route_timeout(scope("/rpc/bulk/getblockhash")) is None
+        assert route_timeout(scope("/rpc/verifychain", [(b"x-request-timeout", b"2.5")])) == 2.5
+        assert route_timeout(scope("/rpc/verifychain", [(b"x-request-timeout", b"1e9")])) == DEADLINE_MAX
+        assert route_timeout(scope("/rpc/verifychain", [(b"x-request-timeout", b"soon")])) == 600.0
+        assert route_timeout(scope("/rpc/verifychain", [(b"x-request-timeout", b"-1")])) == 600.0
+
+
+@pytest.mark.asyncio
+class TestClassDeadlines:
+
+    async def test_timeout(self, node, slow):
+        # far slower than the deadline, so the bound below holds on a loaded machine
+        node.latency = 3.0
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = time.perf_counter()
+            response = await client.get("/rpc/verifychain", params={"nblocks": 6}, headers={"X-Request-Timeout": "0.2"})
+        assert response.status_code == 504
+        assert time.perf_counter() - start < 2.0
+        assert slow.metrics.method("verifychain").timeouts >= 1
+        assert main.metrics.route("/rpc/verifychain").timeouts >= 1
+
+    async def test_disconnect(self, node, slow):
+        disconnected = asyncio.Event()
+        sent = []
+
+        async def receive():
+            if not sent:
+                sent.append(True)
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        route = main.metrics.route("/rpc/verifychain")
+        cancelled = route.cancelled
+        start = time.perf_counter()
+        request = asyncio.ensure_future(main.app(scope("/rpc/verifychain"), receive, send))
+        for _ in range(50):
+            if node.posts:
+                break
+            await asyncio.sleep(0.01)
+        assert node.posts == 1
+        disconnected.set()
+        await request
+        assert time.perf_counter() - start < 0.9
+        assert route.cancelled == cancelled + 1
+        assert sent == [True]
+        metrics = slow.metrics.method("verifychain")
+        assert (metrics.cancelled, metrics.inflight) == (1, 0)
+        assert slow.connections()[f"127.0.0.1:{node.port}"][0] == 0
+        assert slow.lanes["heavy"].active == 0
+
+
+@pytest.mark.asyncio
+class TestClassCoalescedCancellation:
+
+    async def test_last_caller_cancels(self, node, rpc):
+        node.latency = 0.3
+        node.methods["getblockcount"] = lambda: 100
+        first = asyncio.ensure_future(rpc.call("getblockcount"))
+        second = asyncio.ensure_future(rpc.call("getblockcount"))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        assert await second == 100
+        assert node.posts == 1
+        third = asyncio.ensure_future(rpc.call("getblockcount"))
+        await asyncio.sleep(0.05)
+        (shared,) = rpc.inflight.values()
+        third.cancel()
+        await asyncio.sleep(0)
+        assert shared.cancelled() or shared.cancelling()
+        assert not rpc.waiting
+
+    async def test_method_timeout(self, node, rpc, monkeypatch):
+        monkeypatch.setattr("fastbtc.rpc.RPC_TIMEOUTS", {"verifychain": 0.1})
+        node.latency = 1.0
+        node.methods["verifychain"] = lambda checklevel=None, nblocks=None: True
+        with pytest.raises(asyncio.TimeoutError):
+            await rpc.verifychain(3, 6)
+        with Lanes.options(timeout=5.0):
+            with pytest.raises(asyncio.TimeoutError):
+                await rpc.verifychain(3, 6)
@@ -0,0 +1,110 @@
+import os
+import pytest
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.cache import ResponseCache
+from fastbtc.diskcache import DiskCache
+from tests.test_cache import Chain
+
+
+def block(n:int) -> dict:
+    return {"hash": f"{n:064x}", "height": n, "tx": [f"{n:064x}"] * 50}
+
+
+class TestClassDiskCache:
+
+    def test_put_get(self, tmp_path):
+        disk = DiskCache(str(tmp_path))
+        disk.put(b"getblock 1", block(1), 100)
+        disk.put(b"getblock 2", block(2))
+        assert disk.get(b"getblock 1") == (True, block(1), 100)
+        assert disk.get(b"getblock 2") == (True, block(2), None)
+        assert disk.get(b"getblock 3") == (False, None, None)
+        assert disk.stats == {"hits": 2, "misses": 1, "writes": 2, "evictions": 0}
+        # compressed, 50 repeated txids take a fraction of their JSON
+        assert disk.nbytes < 2 * len(str(block(1)))
+        disk.close()
+
+    def test_reopen(self, tmp_path):
+        disk = DiskCache(str(tmp_path), segment_bytes=1000)
+        for n in range(20):
+            disk.put(f"getblock {n}".encode(), block(n), n)
+        assert len([name for name in os.listdir(tmp_path) if name.endswith(".idx")]) > 1
+        disk.close()
+        disk = DiskCache(str(tmp_path), segment_bytes=1000)
+        assert len(disk) == 20
+        assert disk.get(b"getblock 7") == (True, block(7), 7)
+        assert [key for key, _, _ in disk.recent()][:2] == [b"getblock 19", b"getblock 18"]
+        disk.close()
+
+    def test_torn_record(self, tmp_path):
+        disk = DiskCache(str(tmp_path))
+        disk.put(b"getblock 1", block(1))
+        disk.put(b"getblock 2", block(2))
+        disk.close()
+        path = disk.log_path(0)
+        os.truncate(path, os.path.getsize(path) - 3)
+        disk = DiskCache(str(tmp_path))
+        assert disk.get(b"getblock 1")[0]
+        assert not disk.get(b"getblock 2")[0]
+        disk.put(b"getblock 3", block(3))
+        disk.close()
+        disk = DiskCache(str(tmp_path))
+        assert disk.get(b"getblock 3") == (True, block(3), None)
+        disk.close()
+
+    def test_eviction(self, tmp_path):
+        disk = DiskCache(str(tmp_path), max_bytes=3000, segment_bytes=1000)
+        for n in range(40):
+            disk.put(f"getblock {n}".encode(), block(n))
+        assert disk.nbytes <= 3000
+        assert disk.stats["evictions"] > 0
+        assert not disk.get(b"getblock 0")[0]
+        assert disk.get(b"getblock 39")[0]
+        assert len([name for name in os.listdir(tmp_path) if name.endswith(".log")]) == len(disk.scanned)
+        disk.close()
+
+    def test_shared_read_only(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("fastbtc.diskcache.DISK_CACHE_REFRESH", 0)
+        writer = DiskCache(str(tmp_path))
+        reader = DiskCache(str(tmp_path))
+        assert not writer.readonly and reader.readonly
+        writer.put(b"getblock 1", block(1))
+        assert reader.get(b"getblock 1") == (True, block(1), None)
+        reader.put(b"getblock 2", block(2))
+        assert not writer.get(b"getblock 2")[0]
+        reader.close()
+        writer.close()
+
+
+class TestClassPersistentResponseCache:
+
+    async def test_restart(self, node, tmp_path):
+        chain = Chain(100)
+        chain.serve(node)
+        blockhash = chain.hash(10)
+        disk = DiskCache(str(tmp_path))
+        async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, cache=ResponseCache(tip_interval=0, disk=disk)) as rpc:
+            await rpc.getblock(blockhash)
+            await rpc.getblock(chain.hash(99))      # recent, kept in memory only
+        disk.close()
+        chain.height = 110
+        cache = ResponseCache(tip_interval=0, disk=DiskCache(str(tmp_path)))
+        async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, cache=cache) as rpc:
+            block = await rpc.getblock(blockhash)
+            assert block["confirmations"] == 101
+            await rpc.getblock(chain.hash(99))
+        assert [method for method, _ in node.calls].count("getblock") == 3
+        assert cache.disk.stats["hits"] == 1
+        cache.disk.close()
+
+    def test_warm(self, tmp_path):
+        disk = DiskCache(str(tmp_path))
+        for n in range(10):
+            disk.put(ResponseCache.disk_key(ResponseCache.key("getblock", [f"{n:064x}", 1])), block(n), 100)
+        cache = ResponseCache(max_bytes=5000, disk=disk)
+        loaded = cache.warm()
+        assert 0 < loaded < 10
+        assert cache.get("getblock", [f"{9:064x}", 1]) == (True, block(9))
+        assert ResponseCache.key("getblock", [f"{0:064x}", 1]) not in cache.immutable
+        assert disk.stats["hits"] == 0
+        disk.close()
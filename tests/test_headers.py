@@ -0,0 +1,178 @@
+import pytest
+import asyncio
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.events import EventBus
+from fastbtc.block import sha256d, hash_hex
+from fastbtc.headers import HeaderStore, HEADERS_CONFIRMATIONS
+from tests.fakenode import RPCError
+
+
+def make_headers(prev:bytes, count:int, seed:int=0) -> list:
+    '''Returns count serialized headers linked from prev'''
+    headers = []
+    for n in range(count):
+        header = (
+            (4).to_bytes(4, 'little') + prev + sha256d(bytes([seed, n % 256, n // 256]))
+            + (1_600_000_000 + n).to_bytes(4, 'little') + bytes.fromhex("ffff001d") + n.to_bytes(4, 'little')
+        )
+        headers.append(header)
+        prev = sha256d(header)
+    return headers
+
+
+class HeaderChain:
+    '''Chain of synthetic headers served by the fake node'''
+    def __init__(self, count:int) -> None:
+        self.headers = make_headers(b"\x00" * 32, count)
+        self.stale = []             # (tip hash, height, branchlen) of abandoned branches
+
+    def reorg(self, fork:int, count:int) -> None:
+        '''Replaces the blocks after fork by count new ones'''
+        old = self.headers
+        self.headers = old[:fork + 1] + make_headers(sha256d(old[fork]), count, seed=1)
+        self.stale.append((hash_hex(sha256d(old[-1])), len(old) - 1, len(old) - 1 - fork))
+
+    def getblockcount(self) -> int:
+        return len(self.headers) - 1
+
+    def getblockhash(self, height:int) -> str:
+        if not 0 <= height < len(self.headers):
+            raise RPCError(-8, "Block height out of range")
+        return hash_hex(sha256d(self.headers[height]))
+
+    def getblockheader(self, blockhash:str, verbose:bool=True) -> str:
+        for header in self.headers:
+            if hash_hex(sha256d(header)) == blockhash:
+                return header.hex()
+        raise RPCError(-5, "Block not found")
+
+    def getchaintips(self) -> list:
+        tips = [{"height": len(self.headers) - 1, "hash": self.getblockhash(len(self.headers) - 1),
+                 "branchlen": 0, "status": "active"}]
+        return tips + [{"height": height, "hash": blockhash, "branchlen": branchlen, "status": "valid-fork"}
+                       for blockhash, height, branchlen in self.stale]
+
+    def serve(self, node) -> None:
+        for method in ("getblockcount", "getblockhash", "getblockheader", "getchaintips"):
+            node.methods[method] = getattr(self, method)
+
+
+@pytest.fixture
+def chain(node):
+    chain = HeaderChain(50)
+    chain.serve(node)
+    return chain
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HeaderStore(str(tmp_path))
+    yield store
+    store.close()
+
+
+class TestClassHeaderStore:
+
+    async def test_sync(self, rpc, chain, store):
+        assert await store.sync(rpc, batch=16) == 50
+        assert store.height == 49
+        assert store.blockhash(7) == chain.getblockhash(7)
+        assert store.height_of(chain.getblockhash(30)) == 30
+        assert store.blockheader(chain.getblockhash(30)) == chain.headers[30].hex()
+        assert store.header_at(3).previousblockhash == chain.getblockhash(2)
+        assert store.height_of("ff" * 32) is None
+        assert await store.sync(rpc) == 0
+
+    async def test_incremental(self, rpc, chain, store):
+        await store.sync(rpc)
+        chain.headers += make_headers(sha256d(chain.headers[-1]), 5)
+        assert await store.sync(rpc) == 5
+        assert store.height_of(chain.getblockhash(54)) == 54
+
+    async def test_reorg_from_chaintips(self, rpc, chain, store, node):
+        await store.sync(rpc)
+        stale = chain.getblockhash(45)
+        chain.reorg(40, 12)
+        node.calls.clear()
+        assert await store.sync(rpc) == 12
+        assert store.height == 52
+        assert store.blockhash(45) == chain.getblockhash(45)
+        assert store.height_of(stale) is None
+        # the fork point comes from getchaintips, without bisecting
+        assert node.calls[:2] == [("getchaintips", []), ("getblockcount", [])]
+
+    async def test_reorg_bisect(self, rpc, chain, store):
+        await store.sync(rpc)
+        chain.reorg(20, 40)
+        chain.stale.clear()
+        assert await store.sync(rpc) == 40
+        assert [store.blockhash(height) for height in range(61)] == [chain.getblockhash(height) for height in range(61)]
+
+    async def test_cold_start(self, rpc, chain, store, tmp_path):
+        await store.sync(rpc)
+        store.close()
+        reopened = HeaderStore(str(tmp_path))
+        assert reopened.height == 49
+        assert len(reopened.prefixes) == 50
+        assert reopened.height_of(chain.getblockhash(12)) == 12
+        reopened.close()
+
+    async def test_partial_write(self, rpc, chain, store, tmp_path):
+        await store.sync(rpc)
+        store.close()
+        with open(tmp_path / "headers.dat", "ab") as headers:
+            headers.write(chain.headers[0][:40])
+        with open(tmp_path / "hashes.dat", "ab") as hashes:
+            hashes.write(b"\x00" * 32)
+        reopened = HeaderStore(str(tmp_path))
+        assert reopened.height == 49
+        assert reopened.height_of(chain.getblockhash(49)) == 49
+        reopened.close()
+
+    async def test_reader_reloads(self, rpc, chain, store, tmp_path):
+        await store.sync(rpc)
+        reader = HeaderStore(str(tmp_path))
+        chain.reorg(45, 10)
+        await store.sync(rpc)
+        assert reader.height == 49
+        reader.reload()
+        assert reader.height == 55
+        assert reader.height_of(chain.getblockhash(46)) == 46
+        assert reader.height_of(chain.getblockhash(55)) == 55
+        reader.close()
+
+    async def test_follow_retries(self, rpc, chain, store, monkeypatch):
+        monkeypatch.setattr("fastbtc.headers.HEADERS_RETRY", 0.01)
+        sync, failures = store.sync, [asyncio.TimeoutError()]
+
+        async def flaky(rpc):
+            if failures:
+                raise failures.pop()
+            return await sync(rpc)
+        monkeypatch.setattr(store, "sync", flaky)
+        bus = EventBus()
+        task = asyncio.ensure_future(store.follow(rpc, bus))
+        for _ in range(100):
+            if store.height == 49:
+                break
+            await asyncio.sleep(0.01)
+        assert store.height == 49 and not failures
+        chain.headers += make_headers(sha256d(chain.headers[-1]), 2, seed=2)
+        bus.publish("hashblock", chain.getblockhash(51))
+        for _ in range(100):
+            if store.height == 51:
+                break
+            await asyncio.sleep(0.01)
+        assert store.height == 51
+        task.cancel()
+
+    async def test_rpc_answers_locally(self, node, chain, store):
+        async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, headers=store) as rpc:
+            await store.sync(rpc)
+            posts = node.posts
+            assert await rpc.getblockhash(10) == chain.getblockhash(10)
+            assert await rpc.getblockheader(chain.getblockhash(49), False) == chain.headers[49].hex()
+            assert node.posts == posts
+            # heights close to the tip are still asked to the node
+            assert await rpc.getblockhash(49 - HEADERS_CONFIRMATIONS + 1) == chain.getblockhash(49 - HEADERS_CONFIRMATIONS + 1)
+            assert node.posts == posts + 1
@@ -0,0 +1,76 @@
+import gzip
+from fastbtc import httpcache
+from fastbtc.httpcache import HTTPCache, etag, matches, negotiate, variant
+
+
+class TestClassNegotiation:
+
+    def test_negotiate(self, monkeypatch):
+        monkeypatch.setattr(httpcache, "ENCODINGS", {"zstd": None, "br": None, "gzip": None})
+        assert negotiate(None) is None
+        assert negotiate("identity") is None
+        assert negotiate("gzip, deflate") == "gzip"
+        assert negotiate("gzip, br, zstd") == "zstd"
+        assert negotiate("gzip;q=1.0, br;q=0.5") == "gzip"
+        assert negotiate("*;q=0.1, gzip;q=0") == "zstd"
+        assert negotiate("zstd;q=0, br;q=0, gzip;q=0") is None
+
+    def test_unavailable_codings_skipped(self, monkeypatch):
+        monkeypatch.setattr(httpcache, "ENCODINGS", {"gzip": None})
+        assert negotiate("br, zstd") is None
+        assert negotiate("br, gzip;q=0.2") == "gzip"
+
+    def test_etag(self):
+        assert etag("ab" * 32, "block", 0) == f'"{"ab" * 32}.block.0"'
+        assert etag("not a hash", "block", 0) is None
+        assert variant('"x"', "gzip") == '"x-gzip"'
+        assert matches('"y", W/"x-gzip"', '"x"')
+        assert matches("*", '"x"')
+        assert not matches('"x-deflate"', '"x"')
+
+
+class TestClassHTTPCache:
+
+    class Request:
+        def __init__(self, **headers) -> None:
+            self.headers = {name.replace("_", "-"): value for name, value in headers.items()}
+
+    async def test_compressed_once(self):
+        cache = HTTPCache(min_size=10)
+        fetched = []
+
+        async def fetch():
+            fetched.append(1)
+            return True, b'"' + b"ab" * 100 + b'"'
+        tag = etag("ab" * 32, "block", 0)
+        for _ in range(3):
+            response = await cache.respond(self.Request(accept_encoding="gzip"), tag, True, fetch)
+            assert gzip.decompress(response.body) == b'"' + b"ab" * 100 + b'"'
+        response = await cache.respond(self.Request(), tag, True, fetch)
+        assert response.body == b'"' + b"ab" * 100 + b'"'
+        assert len(fetched) == 1
+        assert cache.stats == {"not_modified": 0, "hits": 3, "misses": 1, "compressed": 1}
+
+    async def test_small_bodies_not_compressed(self):
+        cache = HTTPCache()
+
+        async def fetch():
+            return True, b'{"asm":"1"}'
+        response = await cache.respond(self.Request(accept_encoding="gzip"), etag("ab" * 32, "script"), True, fetch)
+        assert "Content-Encoding" not in response.headers
+        assert response.headers["ETag"] == etag("ab" * 32, "script")
+
+    async def test_errors_told_by_fetch(self):
+        cache = HTTPCache()
+        tag = etag("ab" * 32, "script")
+
+        async def error():
+            return False, b'{"message":"Script decode failed","code":-22}'
+
+        async def result():
+            return True, b'{"code":"6a"}'
+        response = await cache.respond(self.Request(), tag, True, error)
+        assert "ETag" not in response.headers and len(cache.bodies) == 0
+        # kept, though it looks like an error
+        response = await cache.respond(self.Request(), tag, True, result)
+        assert response.headers["ETag"] == tag and len(cache.bodies) == 1
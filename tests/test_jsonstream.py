@@ -0,0 +1,81 @@
+import pytest
+import orjson
+import random
+from fastbtc.jsonstream import JSONSplitter
+
+
+def split(document:bytes, path:tuple, size:int) -> list:
+    '''Feeds document to a splitter in chunks of size bytes'''
+    splitter = JSONSplitter(path)
+    elements = []
+    for i in range(0, len(document), size):
+        elements.extend(splitter.feed(document[i:i + size]))
+    return elements
+
+
+BLOCK = {
+    "hash": "00" * 32,
+    "nested": {"tx": ["not", "this"]},
+    "tx": [
+        {"txid": "ab" * 32, "vin": [{"coinbase": "03ff"}], "vout": [{"value": 6.25, "n": 0}]},
+        {"txid": "cd" * 32, "note": "quote \" and backslash \\ and ] , } {", "vout": []},
+        [1, 2, [3]],
+        "plain",
+        12.5,
+        None,
+    ],
+    "time": 1231006505,
+}
+
+
+class TestClassJSONSplitter:
+
+    @pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 10**6])
+    def test_array_items(self, size):
+        document = orjson.dumps({"result": BLOCK, "error": None, "id": None})
+        assert split(document, ("result", "tx"), size) == BLOCK["tx"]
+
+    @pytest.mark.parametrize("size", [1, 5, 10**6])
+    def test_object_members(self, size):
+        mempool = {f"{n:064x}": {"vsize": n, "depends": []} for n in range(50)}
+        document = orjson.dumps({"result": mempool, "error": None, "id": None})
+        assert split(document, ("result",), size) == list(mempool.items())
+
+    def test_whitespace(self):
+        document = b'{ "result" : { "tx" : [ 1 , {"a" : [ ] } , "x" ] } }'
+        assert split(document, ("result", "tx"), 4) == [1, {"a": []}, "x"]
+
+    def test_empty_container(self):
+        assert split(b'{"result":{"tx":[]}}', ("result", "tx"), 3) == []
+        assert split(b'{"result":{}}', ("result",), 3) == []
+
+    def test_missing_path(self):
+        splitter = JSONSplitter(("result", "tx"))
+        document = b'{"result":null,"error":{"code":-5,"message":"Block not found"},"id":null}'
+        assert splitter.feed(document) == []
+        assert not splitter.found
+        assert orjson.loads(splitter.buffer)["error"]["code"] == -5
+
+    def test_bounded_buffer(self):
+        txs = [{"txid": f"{n:064x}", "hex": "00" * 500} for n in range(200)]
+        document = orjson.dumps({"result": {"tx": txs}, "error": None, "id": None})
+        splitter = JSONSplitter(("result", "tx"))
+        peak = 0
+        elements = []
+        for i in range(0, len(document), 1024):
+            elements.extend(splitter.feed(document[i:i + 1024]))
+            peak = max(peak, len(splitter.buffer))
+        assert elements == txs
+        assert peak < 4 * 1024
+
+    def test_random_chunks(self):
+        document = orjson.dumps({"result": BLOCK, "error": None, "id": None})
+        rng = random.Random(7)
+        splitter = JSONSplitter(("result", "tx"))
+        elements = []
+        pos = 0
+        while pos < len(document):
+            size = rng.randint(1, 20)
+            elements.extend(splitter.feed(document[pos:pos + size]))
+            pos += size
+        assert elements == BLOCK["tx"]
@@ -0,0 +1,92 @@
+import pytest
+import asyncio
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.lanes import Lane, Lanes, classify
+
+
+@pytest.fixture
+async def laned(node):
+    async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, lanes=Lanes({"cheap": 4, "heavy": 1, "batch": 1})) as rpc:
+        yield rpc
+
+
+class TestClassLanes:
+
+    def test_classify(self):
+        assert classify("getblockcount") == "cheap"
+        assert classify("getblock", ["00", 1]) == "cheap"
+        assert classify("getblock", ["00", 2]) == "heavy"
+        assert classify("getrawmempool", [True]) == "heavy"
+        assert classify("verifychain", [3, 6]) == "heavy"
+
+    async def test_priority_order(self):
+        lane = Lane("heavy", 1)
+        await lane.acquire()
+        order = []
+
+        async def waiter(name, priority):
+            await lane.acquire(priority)
+            order.append(name)
+            lane.release()
+
+        tasks = [asyncio.ensure_future(waiter(name, priority)) for name, priority in (("low", 0), ("high", 5), ("mid", 1))]
+        await asyncio.sleep(0)
+        assert lane.depth == 3
+        lane.release()
+        await asyncio.gather(*tasks)
+        assert order == ["high", "mid", "low"]
+        assert lane.active == 0
+
+    async def test_deadline(self):
+        lane = Lane("heavy", 1)
+        await lane.acquire()
+        deadline = asyncio.get_running_loop().time() + 0.01
+        with pytest.raises(asyncio.TimeoutError):
+            await lane.acquire(deadline=deadline)
+        assert lane.stats["expired"] == 1
+        lane.release()
+        assert lane.active == 0
+        assert lane.depth == 0
+
+    async def test_cheap_not_behind_heavy(self, node, laned):
+        node.methods["verifychain"] = lambda checklevel, nblocks: True
+        node.methods["getblockcount"] = lambda: 100
+        node.latency = 0.05
+        heavy = [asyncio.ensure_future(laned.verifychain(3, nblocks)) for nblocks in range(4)]
+        await asyncio.sleep(0.01)
+        stats = laned.lanes.stats()
+        assert stats["heavy"]["active"] == 1
+        assert stats["heavy"]["depth"] == 3
+        start = asyncio.get_running_loop().time()
+        assert await laned.getblockcount() == 100
+        assert asyncio.get_running_loop().time() - start < 0.1
+        await asyncio.gather(*heavy)
+        assert laned.lanes.stats()["heavy"]["wait_max"] > 0
+
+    async def test_options_deadline(self, node, laned):
+        node.methods["verifychain"] = lambda checklevel, nblocks: True
+        node.latency = 0.05
+        busy = asyncio.ensure_future(laned.verifychain(3, 6))
+        await asyncio.sleep(0.01)
+        with laned.lanes.options(timeout=0.01):
+            with pytest.raises(asyncio.TimeoutError):
+                await laned.call("verifychain", [3, 7])
+        assert await busy is True
+
+    async def test_retry_503(self, node, laned):
+        node.methods["getblockcount"] = lambda: 100
+        node.busy = 2
+        assert await laned.getblockcount() == 100
+        assert node.posts == 3
+        assert laned.lanes.stats()["cheap"]["retried"] == 2
+
+    async def test_stream_releases_slot(self, node, laned):
+        txs = [{"txid": f"{n:064x}", "vin": [], "vout": [{"n": 0}]} for n in range(2000)]
+        node.methods["getblock"] = lambda blockhash, verbosity: {"hash": blockhash, "tx": txs}
+        node.methods["verifychain"] = lambda checklevel, nblocks: True
+        stream = laned.iter_block_txs("00" * 32)
+        assert await stream.__anext__() == txs[0]
+        # the reply is read before the consumer is done with it
+        assert await asyncio.wait_for(laned.verifychain(3, 6), 1) is True
+        assert laned.lanes.stats()["heavy"]["active"] == 0
+        assert [tx async for tx in stream] == txs[1:]
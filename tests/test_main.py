@@ -0,0 +1,262 @@
+import pytest
+import orjson
+import asyncio
+import httpx
+import main
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.cache import ResponseCache
+from fastbtc.events import EventBus
+from fastbtc.httpcache import HTTPCache
+from fastbtc.metrics import Metrics
+from fastbtc.shared import SharedState
+from fastbtc.stats import BlockStatsStore
+from fastbtc.utxo import UTXOIndex, script_key
+from tests.fakenode import RPCError
+
+
+@pytest.fixture
+async def client(rpc, monkeypatch):
+    monkeypatch.setattr(main, "rpc", rpc)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+def lines(response:httpx.Response) -> list:
+    return [orjson.loads(line) for line in response.content.splitlines()]
+
+
+@pytest.mark.asyncio
+class TestClassBulk:
+
+    async def test_getmempoolentry(self, node, rpc, client):
+        def getmempoolentry(txid):
+            if txid == "gone":
+                raise RPCError(-5, "Transaction not in mempool")
+            return {"vsize": len(txid)}
+        node.methods["getmempoolentry"] = getmempoolentry
+        response = await client.post("/rpc/bulk/getmempoolentry", json=["a", "gone", "abc"])
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert lines(response) == [
+            {"key": "a", "result": {"vsize": 1}},
+            {"key": "gone", "error": {"code": -5, "message": "Transaction not in mempool"}},
+            {"key": "abc", "result": {"vsize": 3}},
+        ]
+
+    async def test_getblockhash_range_in_order(self, node, rpc, client):
+        node.methods["getblockhash"] = lambda height: f"{height:064x}"
+        rpc.batch_size = 7
+        response = await client.get("/rpc/bulk/getblockhash", params={"start": 10, "stop": 109})
+        assert lines(response) == [{"key": height, "result": f"{height:064x}"} for height in range(10, 110)]
+        assert node.posts == 15
+
+    async def test_gettxout(self, node, rpc, client):
+        node.methods["gettxout"] = lambda txid, n, include_mempool=True: None if n else {"value": 1.0}
+        response = await client.post("/rpc/bulk/gettxout", json=[{"txid": "aa", "n": 0}, {"txid": "aa", "n": 1}])
+        assert lines(response) == [
+            {"key": {"txid": "aa", "n": 0}, "result": {"value": 1.0}},
+            {"key": {"txid": "aa", "n": 1}, "result": None},
+        ]
+
+    async def test_getsatoshis(self, client, monkeypatch, tmp_path):
+        index = UTXOIndex(str(tmp_path))
+        index.outputs.put(script_key(bytes.fromhex("0014751e76e8199196d454941c45d1b3a323f1433bd6")), 1, 5000, 1, 0, 0)
+        index.synced = True
+        monkeypatch.setattr(main, "utxo", index)
+        response = await client.post("/rpc/bulk/getsatoshis", json=["bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4", "nonsense"])
+        assert lines(response) == [
+            {"key": "bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4", "result": 5000},
+            {"key": "nonsense", "error": {"code": -5, "message": "Invalid address"}},
+        ]
+        index.synced = False
+        assert (await client.post("/rpc/bulk/getsatoshis", json=["nonsense"])).status_code == 503
+        index.close()
+
+    async def test_too_many_keys(self, client, monkeypatch):
+        monkeypatch.setattr(main, "BULK_MAX_KEYS", 10)
+        response = await client.get("/rpc/bulk/getblockhash", params={"start": 0, "stop": 10})
+        assert response.status_code == 413
+        response = await client.get("/rpc/bulk/getblockhash", params={"start": 0, "stop": 10**18})
+        assert response.status_code == 413
+        response = await client.get("/rpc/bulk/getblockhash", params={"start": 5, "stop": 4})
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+class TestClassIngest:
+
+    async def test_reader_takes_over(self, rpc, monkeypatch, tmp_path):
+        writer = SharedState(str(tmp_path / "shared"))
+        assert writer.elect()
+        monkeypatch.setattr(main, "rpc", rpc)
+        monkeypatch.setattr(main, "shared", SharedState(str(tmp_path / "shared")))
+        monkeypatch.setattr(main, "tasks", [])
+        monkeypatch.setattr(main, "notifier", None)
+        monkeypatch.setattr(main, "ZMQ_URLS", "")
+        monkeypatch.setattr(main, "SHARED_INTERVAL", 0.01)
+        task = asyncio.ensure_future(main.ingest())
+        await asyncio.sleep(0.05)
+        assert main.notifier is None and not main.tasks
+        writer.close()
+        await asyncio.wait_for(task, 1)
+        assert main.shared.writer
+        assert main.notifier is not None
+        await main.notifier.close()
+        main.shared.close()
+
+    async def test_reader_notified(self, rpc, monkeypatch, tmp_path):
+        writer = SharedState(str(tmp_path / "shared"))
+        assert writer.elect()
+        writer.put("getblockchaininfo", {"blocks": 100, "bestblockhash": f"{100:064x}"})
+        monkeypatch.setattr(main, "rpc", rpc)
+        monkeypatch.setattr(main, "bus", EventBus())
+        monkeypatch.setattr(main, "shared", SharedState(str(tmp_path / "shared")))
+        monkeypatch.setattr(main, "tasks", [])
+        monkeypatch.setattr("fastbtc.shared.SHARED_POLL", 0.01)
+        rpc.cache = ResponseCache(tip_interval=float('inf'))
+        rpc.cache.tip_checked = 0.0
+        rpc.shared = main.shared
+        blocks = main.bus.subscribe("hashblock")
+        tasks = [asyncio.ensure_future(main.ingest()), asyncio.ensure_future(main.shared.follow(rpc, main.bus))]
+        await asyncio.sleep(0.05)
+        assert blocks.empty()
+        writer.put("getblockchaininfo", {"blocks": 101, "bestblockhash": f"{101:064x}"})
+        assert await asyncio.wait_for(blocks.get(), 1) == ("hashblock", f"{101:064x}")
+        await asyncio.sleep(0.01)
+        # the tip is read from the snapshot on the next call
+        assert rpc.cache.tip_checked == float('-inf') and not main.shared.writer
+        assert await rpc.tip() == f"{101:064x}" and rpc.cache.height == 101
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+        main.shared.close()
+        writer.close()
+
+
+@pytest.mark.asyncio
+class TestClassUnknownFields:
+
+    async def test_getpeerinfo(self, node, client):
+        node.methods["getpeerinfo"] = lambda: [{"id": 1, "addr": "10.0.0.1:8333", "unknown_field": True}]
+        response = await client.get("/rpc/getpeerinfo")
+        assert response.json() == [{"id": 1, "addr": "10.0.0.1:8333", "unknown_field": True}]
+
+    async def test_getmempoolentry(self, node, client):
+        def getmempoolentry(txid):
+            if txid == "gone":
+                raise RPCError(-5, "Transaction not in mempool")
+            return {"vsize": 141, "fees": {"base": 0.0001}, "bip125-replaceable": True, "cluster": 2}
+        node.methods["getmempoolentry"] = getmempoolentry
+        response = await client.get("/rpc/getmempoolentry/aa")
+        assert response.json() == {"vsize": 141, "fees": {"base": 0.0001}, "bip125-replaceable": True, "cluster": 2}
+        response = await client.get("/rpc/getmempoolentry/gone")
+        assert response.json() == {"code": -5, "message": "Transaction not in mempool"}
+
+
+@pytest.mark.asyncio
+class TestClassMetrics:
+
+    async def test_metrics(self, node, client, monkeypatch):
+        node.methods["getblockcount"] = lambda: 100
+        metrics = Metrics()
+        monkeypatch.setattr(main, "metrics", metrics)
+        monkeypatch.setattr(main.rpc, "metrics", metrics)
+        routes = main.app.user_middleware[0].kwargs["metrics"].routes
+        before = routes["/rpc/getblockcount"].latency.count if "/rpc/getblockcount" in routes else 0
+        assert (await client.get("/rpc/getblockcount")).json() == 100
+        assert routes["/rpc/getblockcount"].latency.count == before + 1
+        response = await client.get("/metrics")
+        assert response.headers["content-type"].startswith("text/plain")
+        text = response.text
+        assert 'fastbtc_rpc_calls_total{method="getblockcount"} 1' in text
+        assert 'fastbtc_rpc_duration_seconds_count{method="getblockcount"} 1' in text
+        assert 'fastbtc_rpc_inflight{method="getblockcount"} 0' in text
+        assert 'fastbtc_rpc_received_bytes_total{method="getblockcount"} ' in text
+        assert 'fastbtc_connections_in_use{node="127.0.0.1:' in text
+
+
+class TestClassBlockStats:
+
+    async def test_range(self, client, monkeypatch, tmp_path):
+        store = BlockStatsStore(str(tmp_path))
+        store.resize(20)
+        for height in range(20):
+            store.put(height, {"blockhash": f"{height:064x}", "txs": height, "mediantime": 600 * height})
+        monkeypatch.setattr(main, "blockstats", store)
+        response = await client.get("/rpc/blockstats/txs", params={"start": 0, "stop": 19, "step": 10, "agg": "sum"})
+        assert response.json() == {"heights": [0, 10], "mediantime": [0, 6000], "values": [45, 145]}
+        assert (await client.get("/rpc/blockstats/nonsense")).status_code == 400
+        monkeypatch.setattr(main, "blockstats", None)
+        assert (await client.get("/rpc/blockstats/txs")).status_code == 404
+        store.close()
+
+
+class TestClassHTTPCache:
+
+    @pytest.fixture
+    async def cached(self, node, monkeypatch):
+        node.methods["getbestblockhash"] = lambda: f"{100:064x}"
+        node.methods["getblockheader"] = lambda blockhash, verbose=True: (
+            {"hash": blockhash, "height": int(blockhash, 16), "confirmations": 101 - int(blockhash, 16)} if verbose else "00" * 80
+        )
+        node.methods["getblockhash"] = lambda height: f"{height:064x}"
+        node.methods["getblock"] = lambda blockhash, verbosity=1: "ab" * 5000 if verbosity == 0 else {"hash": blockhash, "tx": ["cd" * 32] * 100}
+        node.methods["decodescript"] = lambda hexstring: {"asm": hexstring}
+        monkeypatch.setattr(main, "responses", HTTPCache())
+        async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, cache=ResponseCache(tip_interval=60)) as rpc:
+            monkeypatch.setattr(main, "rpc", rpc)
+            yield rpc
+
+    async def test_immutable_block(self, node, client, cached):
+        path = f"/rpc/getblock/{10:064x}"
+        response = await client.get(path, params={"verbosity": 0}, headers={"Accept-Encoding": "gzip"})
+        assert response.json() == "ab" * 5000
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        tag = response.headers["etag"]
+        assert tag == f'"{10:064x}.block.0-gzip"'
+        posts = node.posts
+        response = await client.get(path, params={"verbosity": 0}, headers={"If-None-Match": tag})
+        assert response.status_code == 304
+        assert response.content == b""
+        response = await client.get(path, params={"verbosity": 0}, headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert response.json() == "ab" * 5000
+        assert node.posts == posts
+        assert main.responses.stats["compressed"] == 1
+
+    async def test_fills_response_cache(self, node, client, cached):
+        response = await client.get(f"/rpc/getblock/{10:064x}", params={"verbosity": 1})
+        assert response.json()["hash"] == f"{10:064x}"
+        assert ResponseCache.raw_key("getblock", [f"{10:064x}", 1]) in cached.cache.tip
+        response = await client.get(f"/rpc/getblock/{10:064x}", params={"verbosity": 0})
+        assert ResponseCache.raw_key("getblock", [f"{10:064x}", 0]) in cached.cache.immutable
+
+    async def test_revalidated_with_tip(self, node, client, cached):
+        path = f"/rpc/getblock/{10:064x}"
+        response = await client.get(path)
+        assert response.headers["cache-control"] == "no-cache"
+        tag = response.headers["etag"]
+        assert (await client.get(path, headers={"If-None-Match": tag})).status_code == 304
+        cached.cache.set_tip(f"{101:064x}", 101)
+        response = await client.get(path, headers={"If-None-Match": tag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != tag
+
+    async def test_deep_block_by_height(self, client, cached):
+        response = await client.get("/rpc/getblockinfo/10", params={"verbosity": 0}, headers={"Accept-Encoding": "identity"})
+        assert response.headers["etag"] == f'"{10:064x}.block.0"'
+        response = await client.get("/rpc/getblockinfo/99", params={"verbosity": 0})
+        assert response.headers["cache-control"] == "no-cache"
+
+    async def test_errors_not_cached(self, node, client, cached):
+        node.methods["getblock"] = lambda blockhash, verbosity=1: (_ for _ in ()).throw(RPCError(-5, "Block not found"))
+        response = await client.get(f"/rpc/getblock/{10:064x}", params={"verbosity": 0})
+        assert response.json() == {"code": -5, "message": "Block not found"}
+        assert "etag" not in response.headers
+        assert len(main.responses.bodies) == 0
+
+    async def test_decodescript(self, client, cached):
+        response = await client.get("/rpc/decodescript/51")
+        assert response.json() == {"asm": "51"}
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
@@ -0,0 +1,169 @@
+import pytest
+import asyncio
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.events import EventBus
+from fastbtc.mempool import MempoolMirror, NOT_IN_MEMPOOL
+from fastbtc.zmqsub import SequenceEvent, Gap
+from tests.fakenode import RPCError
+
+
+class FakeMempool:
+    '''Mempool served by the fake node, txids are single characters repeated'''
+    def __init__(self) -> None:
+        self.entries = {}
+        self.sequence = 0
+        self.blocks = {}
+
+    @staticmethod
+    def txid(name:str) -> str:
+        return name * 64
+
+    def add(self, name:str, depends:str="", fee:int=1000) -> SequenceEvent:
+        txid = self.txid(name)
+        self.entries[txid] = {
+            "vsize": 100, "weight": 400, "time": 1_700_000_000, "height": 800_000, "wtxid": txid,
+            "fees": {"base": fee / 1e8, "modified": fee / 1e8},
+            "depends": [self.txid(parent) for parent in depends],
+            "bip125-replaceable": False, "unbroadcast": False,
+        }
+        self.sequence += 1
+        return SequenceEvent(txid, 'A', self.sequence)
+
+    def remove(self, name:str) -> SequenceEvent:
+        txid = self.txid(name)
+        del self.entries[txid]
+        self.sequence += 1
+        return SequenceEvent(txid, 'R', self.sequence)
+
+    def mine(self, blockhash:str, names:str) -> SequenceEvent:
+        txids = [self.txid(name) for name in names]
+        for txid in txids:
+            del self.entries[txid]
+            self.sequence += 1
+        self.blocks[blockhash] = {"hash": blockhash, "tx": ["0" * 64] + txids}
+        return SequenceEvent(blockhash, 'C', None)
+
+    def getrawmempool(self, verbose:bool=False, mempool_sequence:bool=False):
+        return {"txids": list(self.entries), "mempool_sequence": self.sequence}
+
+    def getmempoolentry(self, txid:str) -> dict:
+        if txid not in self.entries:
+            raise RPCError(-5, "Transaction not in mempool")
+        return self.entries[txid]
+
+    def getblock(self, blockhash:str, verbosity:int=1) -> dict:
+        return self.blocks[blockhash]
+
+    def serve(self, node) -> None:
+        for method in ("getrawmempool", "getmempoolentry", "getblock"):
+            node.methods[method] = getattr(self, method)
+
+
+@pytest.fixture
+def pool(node):
+    pool = FakeMempool()
+    pool.serve(node)
+    return pool
+
+
+@pytest.fixture
+async def mirror(rpc, pool):
+    pool.add("a")
+    pool.add("b", depends="a", fee=3000)
+    mirror = MempoolMirror()
+    await mirror.resync(rpc)
+    return mirror
+
+
+class TestClassMempoolMirror:
+
+    async def test_bootstrap(self, mirror, pool):
+        assert mirror.synced
+        assert mirror.sequence == 2
+        assert mirror.getrawmempool() == [pool.txid("a"), pool.txid("b")]
+        assert mirror.getrawmempool(mempool_sequence=True) == {"txids": mirror.getrawmempool(), "mempool_sequence": 2}
+
+    async def test_entry(self, mirror, pool):
+        entry = mirror.getmempoolentry(pool.txid("a"))
+        assert entry["descendantcount"] == 2
+        assert entry["descendantsize"] == 200
+        assert entry["ancestorcount"] == 1
+        assert entry["fees"] == {"base": 1e-05, "modified": 1e-05, "ancestor": 1e-05, "descendant": 4e-05}
+        assert entry["spentby"] == [pool.txid("b")]
+        assert mirror.getmempoolentry(pool.txid("b"))["depends"] == [pool.txid("a")]
+        assert mirror.getmempoolentry(pool.txid("z")) == NOT_IN_MEMPOOL
+
+    async def test_deltas(self, rpc, mirror, pool, node):
+        events = [pool.add("c", depends="b"), pool.add("d"), pool.remove("d")]
+        node.calls.clear()
+        await mirror.apply(rpc, events)
+        assert set(mirror.getmempoolancestors(pool.txid("c"))) == {pool.txid("a"), pool.txid("b")}
+        assert set(mirror.getmempooldescendants(pool.txid("a"))) == {pool.txid("b"), pool.txid("c")}
+        assert pool.txid("d") not in mirror
+        assert mirror.sequence == pool.sequence
+        assert [method for method, _ in node.calls] == ["getmempoolentry", "getmempoolentry"]
+
+    async def test_block(self, rpc, mirror, pool):
+        events = [pool.add("c"), pool.mine("f" * 64, "ab"), pool.add("d")]
+        await mirror.apply(rpc, events)
+        assert mirror.getrawmempool() == [pool.txid("c"), pool.txid("d")]
+        assert mirror.sequence == pool.sequence
+        assert mirror.stats["resyncs"] == 1
+
+    async def test_sequence_gap_resyncs(self, rpc, mirror, pool):
+        pool.add("c")
+        events = [pool.add("d")]
+        await mirror.apply(rpc, events)
+        assert mirror.stats["resyncs"] == 2
+        assert set(mirror.getrawmempool()) == {pool.txid(name) for name in "abcd"}
+
+    async def test_follow(self, rpc, mirror, pool):
+        bus = EventBus()
+        task = asyncio.ensure_future(mirror.follow(rpc, bus))
+        await asyncio.sleep(0.05)
+        bus.publish("sequence", pool.add("c"))
+        await asyncio.sleep(0.05)
+        assert pool.txid("c") in mirror
+        pool.add("d")
+        bus.publish("gap", Gap("sequence", 3, 5))
+        await asyncio.sleep(0.05)
+        assert pool.txid("d") in mirror
+        task.cancel()
+
+    async def test_follow_recovers(self, rpc, mirror, pool, monkeypatch):
+        monkeypatch.setattr("fastbtc.mempool.MEMPOOL_BACKOFF", 0.01)
+        bus = EventBus()
+        failures = [asyncio.TimeoutError(), KeyError("fees")]
+        resync, apply = mirror.resync, mirror.apply
+
+        async def flaky_resync(rpc):
+            if failures and isinstance(failures[0], asyncio.TimeoutError):
+                raise failures.pop(0)
+            await resync(rpc)
+
+        async def flaky_apply(rpc, events):
+            if failures:
+                raise failures.pop(0)
+            await apply(rpc, events)
+        monkeypatch.setattr(mirror, "resync", flaky_resync)
+        monkeypatch.setattr(mirror, "apply", flaky_apply)
+        task = asyncio.ensure_future(mirror.follow(rpc, bus))
+        await asyncio.sleep(0.05)
+        assert mirror.synced
+        bus.publish("sequence", pool.add("c"))
+        await asyncio.sleep(0.05)
+        assert not failures and mirror.synced
+        assert pool.txid("c") in mirror
+        bus.publish("sequence", pool.add("d"))
+        await asyncio.sleep(0.05)
+        assert pool.txid("d") in mirror
+        assert not task.done()
+        task.cancel()
+
+    async def test_rpc_answers_locally(self, node, mirror, pool):
+        async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, mempool=mirror) as rpc:
+            posts = node.posts
+            assert await rpc.getrawmempool() == [pool.txid("a"), pool.txid("b")]
+            assert await rpc.getmempooldescendants(pool.txid("a"), True) == {pool.txid("b"): mirror.entry(pool.txid("b"))}
+            assert await rpc.getmempoolentry(pool.txid("z")) == NOT_IN_MEMPOOL
+            assert node.posts == posts
@@ -0,0 +1,53 @@
+import pytest
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.lanes import Lanes
+from fastbtc.metrics import Histogram, Metrics
+from tests.fakenode import RPCError
+
+
+@pytest.fixture
+async def measured(node):
+    metrics = Metrics(["getblockcount"])
+    async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, metrics=metrics, lanes=Lanes()) as rpc:
+        yield rpc
+
+
+class TestClassMetrics:
+
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        assert list(histogram.render("h", 'method="a"')) == [
+            'h_bucket{method="a",le="0.1"} 2',
+            'h_bucket{method="a",le="1.0"} 3',
+            'h_bucket{method="a",le="+Inf"} 4',
+            'h_sum{method="a"} 3.65',
+            'h_count{method="a"} 4',
+        ]
+
+    def test_preallocated(self):
+        metrics = Metrics(["getblockcount"])
+        entry = metrics.method("getblockcount")
+        assert metrics.method("getblockcount") is entry
+        assert 'method="getblockcount"' not in metrics.render()
+
+    async def test_calls(self, node, measured):
+        def getblockhash(height):
+            raise RPCError(-8, "Block height out of range")
+        node.methods["getblockcount"] = lambda: 100
+        node.methods["getblockhash"] = getblockhash
+        await measured.getblockcount()
+        await measured.getblockhash(200)
+        await measured.call_many([("getblockhash", [1]), ("getblockcount", [])])
+        entry = measured.metrics.method("getblockcount")
+        assert entry.calls == 1
+        assert entry.inflight == 0
+        assert entry.latency.count == 1
+        assert entry.decode.count == 1
+        assert entry.received > 0
+        assert measured.metrics.method("getblockhash").errors == 2
+        assert measured.metrics.method("batch").sent > 0
+        text = measured.metrics.render(measured)
+        assert 'fastbtc_lane_admitted_total{lane="batch"} 1' in text
+        assert 'fastbtc_rpc_errors_total{method="getblockhash"} 2' in text
@@ -1,5 +1,11 @@
+import time
 import pytest
-from fastbtc.rpc import BitcoinRPC, RPC_USER, RPC_PASS, RPC_HOST, RPC_PORT
+import asyncio
+import orjson
+from fastbtc.events import EventBus
+from fastbtc.lanes import Lanes
+from fastbtc.rpc import BitcoinRPC, BlockDisconnected, RPCError, raw_ok, RPC_USER, RPC_PASS, RPC_HOST, RPC_PORT
+from tests.fakenode import RPCError as NodeError
 
 
 @pytest.mark.asyncio
@@ -116,5 +122,285 @@ class TestClassExternal:
         pass
 
 
+@pytest.mark.asyncio
+class TestClassBatch:
+
+    async def test_call_many(self, node, rpc):
+        node.methods["getblockhash"] = lambda height: f"{height:064x}"
+        results = await rpc.call_many([("getblockhash", [height]) for height in range(10)])
+        assert results == [f"{height:064x}" for height in range(10)]
+        assert node.posts == 1
+
+    async def test_call_many_chunks(self, node, rpc):
+        node.methods["getblockhash"] = lambda height: f"{height:064x}"
+        rpc.batch_size = 3
+        results = await rpc.call_many([("getblockhash", [height]) for height in range(10)])
+        assert results == [f"{height:064x}" for height in range(10)]
+        assert node.posts == 4
+
+    async def test_call_many_errors(self, node, rpc):
+        def getmempoolentry(txid):
+            if txid == "missing":
+                raise NodeError(-5, "Transaction not in mempool")
+            return {"vsize": 141}
+        node.methods["getmempoolentry"] = getmempoolentry
+        results = await rpc.call_many([("getmempoolentry", ["a"]), ("getmempoolentry", ["missing"])])
+        assert results == [{"vsize": 141}, {"code": -5, "message": "Transaction not in mempool"}]
+
+    async def test_batch_typed_calls(self, node, rpc):
+        node.methods["getblockhash"] = lambda height: f"{height:064x}"
+        node.methods["gettxout"] = lambda txid, n: {"value": n}
+        async with rpc.batch() as b:
+            hashes = [b.getblockhash(height) for height in range(5)]
+            txout = b.gettxout("ab" * 32, 1)
+        assert [task.result() for task in hashes] == [f"{height:064x}" for height in range(5)]
+        assert txout.result() == {"value": 1}
+        assert node.posts == 1
+
+    async def test_batch_derived_calls(self, node, rpc):
+        node.methods["getblockhash"] = lambda height: f"{height:064x}"
+        node.methods["getblock"] = lambda blockhash, verbosity: {"hash": blockhash}
+        async with rpc.batch() as b:
+            blocks = [b.getblockinfo(height, 1) for height in range(3)]
+        assert [task.result() for task in blocks] == [{"hash": f"{height:064x}"} for height in range(3)]
+        assert node.posts == 2
+
+
+@pytest.mark.asyncio
+class TestClassCoalesce:
+
+    async def test_identical_calls_merged(self, node, rpc):
+        node.latency = 0.05
+        node.methods["getpeerinfo"] = lambda: [{"id": 0}]
+        results = await asyncio.gather(*(rpc.getpeerinfo() for _ in range(20)))
+        assert results == [[{"id": 0}]] * 20
+        assert node.posts == 1
+        assert rpc.coalesce_stats == {"calls": 20, "merged": 19}
+        assert not rpc.inflight
+
+    async def test_different_params_not_merged(self, node, rpc):
+        node.latency = 0.05
+        node.methods["getblockhash"] = lambda height: f"{height:064x}"
+        results = await asyncio.gather(rpc.getblockhash(1), rpc.getblockhash(2), rpc.getblockhash(1))
+        assert results == [f"{1:064x}", f"{2:064x}", f"{1:064x}"]
+        assert node.posts == 2
+
+    async def test_priorities_not_merged(self, node, rpc):
+        node.latency = 0.05
+        node.methods["getmempoolinfo"] = lambda: {"size": 1}
+
+        async def urgent():
+            with Lanes.options(priority=1):
+                return await rpc.getmempoolinfo()
+        await asyncio.gather(urgent(), rpc.getmempoolinfo(), urgent())
+        assert node.posts == 2
+
+    async def test_caller_deadline_not_shared(self, node, rpc):
+        node.latency = 0.1
+        node.methods["getmempoolinfo"] = lambda: {"size": 1}
+
+        async def hurried():
+            with Lanes.options(timeout=0.03):
+                return await rpc.getmempoolinfo()
+        first = asyncio.ensure_future(hurried())
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(rpc.getmempoolinfo())
+        with pytest.raises(asyncio.TimeoutError):
+            await first
+        assert await second == {"size": 1}
+        assert node.posts == 1
+
+    async def test_writes_not_merged(self, node, rpc):
+        node.latency = 0.05
+        node.methods["clearbanned"] = lambda: None
+        await asyncio.gather(rpc.clearbanned(), rpc.clearbanned())
+        assert node.posts == 2
+        assert rpc.coalesce_stats["calls"] == 0
+
+    async def test_cancelled_caller(self, node, rpc):
+        node.latency = 0.05
+        node.methods["getmempoolinfo"] = lambda: {"size": 1}
+        first = asyncio.ensure_future(rpc.getmempoolinfo())
+        second = asyncio.ensure_future(rpc.getmempoolinfo())
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == {"size": 1}
+        assert node.posts == 1
+
+
+@pytest.mark.asyncio
+class TestClassRaw:
+
+    async def test_raw_call(self, node, rpc):
+        block = {"hash": "00" * 32, "tx": [{"txid": "ab" * 32}] * 3}
+        node.methods["getblock"] = lambda blockhash, verbosity: block
+        result = await rpc.getblock("00" * 32, 2, raw=True)
+        assert bytes(result) == orjson.dumps(block) and raw_ok(result)
+
+    async def test_raw_call_error(self, node, rpc):
+        def getblock(blockhash, verbosity):
+            raise NodeError(-5, "Block not found")
+        node.methods["getblock"] = getblock
+        result = await rpc.getblock("00" * 32, 2, raw=True)
+        assert orjson.loads(result) == {"code": -5, "message": "Block not found"} and not raw_ok(result)
+
+    async def test_stream(self, node, rpc):
+        mempool = [f"{n:064x}" for n in range(5000)]
+        node.methods["getrawmempool"] = lambda: mempool
+        chunks = [chunk async for chunk in rpc.stream("getrawmempool")]
+        assert len(chunks) > 1
+        assert orjson.loads(b"".join(chunks)) == mempool
+
+    async def test_stream_error(self, node, rpc):
+        chunks = [chunk async for chunk in rpc.stream("getrawmempool")]
+        assert orjson.loads(b"".join(chunks)) == {"code": -32601, "message": "Method not found"}
+
+    async def test_stream_null(self, node, rpc):
+        node.methods["clearbanned"] = lambda: None
+        assert [chunk async for chunk in rpc.stream("clearbanned")] == [b"null"]
+
+
+@pytest.mark.asyncio
+class TestClassIncremental:
+
+    async def test_iter_block_txs(self, node, rpc):
+        txs = [{"txid": f"{n:064x}", "vin": [], "vout": [{"n": 0}]} for n in range(2000)]
+        node.methods["getblock"] = lambda blockhash, verbosity: {"hash": blockhash, "tx": txs, "time": 0}
+        assert [tx async for tx in rpc.iter_block_txs("00" * 32)] == txs
+
+    async def test_iter_block_txs_error(self, node, rpc):
+        def getblock(blockhash, verbosity):
+            raise NodeError(-5, "Block not found")
+        node.methods["getblock"] = getblock
+        with pytest.raises(RPCError) as exc:
+            [tx async for tx in rpc.iter_block_txs("00" * 32)]
+        assert exc.value.code == -5
+
+    async def test_iter_mempool_verbose(self, node, rpc):
+        mempool = {f"{n:064x}": {"vsize": 100 + n} for n in range(1000)}
+        node.methods["getrawmempool"] = lambda verbose: mempool
+        assert [entry async for entry in rpc.iter_mempool_verbose()] == list(mempool.items())
+
+
+class Chain:
+    '''Best chain served through a FakeNode, blocks of replaced branches stay retrievable by hash'''
+    def __init__(self, node, length:int) -> None:
+        self.hashes = []
+        self.blocks = {}
+        self.extend(length)
+        node.methods["getblockcount"] = lambda: len(self.hashes) - 1
+        node.methods["getblockhash"] = self.getblockhash
+        node.methods["getblock"] = lambda blockhash, verbosity=1: self.blocks[blockhash]
+
+    def getblockhash(self, height:int) -> str:
+        if not 0 <= height < len(self.hashes):
+            raise NodeError(-8, "Block height out of range")
+        return self.hashes[height]
+
+    def extend(self, count:int, branch:int=0) -> None:
+        for _ in range(count):
+            height = len(self.hashes)
+            blockhash = f"{branch:032x}{height:032x}"
+            self.blocks[blockhash] = {"hash": blockhash, "height": height, "tx": []}
+            if height:
+                self.blocks[blockhash]["previousblockhash"] = self.hashes[-1]
+            self.hashes.append(blockhash)
+
+    def reorg(self, height:int, count:int, branch:int) -> None:
+        del self.hashes[height:]
+        self.extend(count, branch)
+
+
+def replay(events:list) -> list:
+    '''Returns the chain of hashes an indexer applying events would end up with'''
+    chain = []
+    for event in events:
+        if isinstance(event, BlockDisconnected):
+            assert chain.pop() == (event.height, event.hash)
+        else:
+            assert event["height"] == len(chain) + (chain[0][0] if chain else event["height"])
+            chain.append((event["height"], event["hash"]))
+    return [blockhash for _, blockhash in chain]
+
+
+@pytest.mark.asyncio
+class TestClassIterBlocks:
+
+    async def test_in_order(self, node, rpc):
+        chain = Chain(node, 40)
+        node.latency = 0.02
+        start = time.perf_counter()
+        blocks = [block async for block in rpc.iter_blocks(0)]
+        # two serial round trips per block would take at least 1.6s
+        assert time.perf_counter() - start < 0.8
+        assert [block["hash"] for block in blocks] == chain.hashes
+        assert [block["hash"] async for block in rpc.iter_blocks(10, 19, prefetch=3)] == chain.hashes[10:20]
+        assert [block async for block in rpc.iter_blocks(40)] == []
+        with pytest.raises(ValueError):
+            [block async for block in rpc.iter_blocks(0, verbosity=0)]
+
+    async def test_backpressure(self, node, rpc):
+        Chain(node, 100)
+        blocks = rpc.iter_blocks(0, prefetch=4)
+        assert (await blocks.__anext__())["height"] == 0
+        await asyncio.sleep(0.1)
+        fetched = [params for method, params in node.calls if method == "getblock"]
+        assert len(fetched) <= 5
+        await blocks.aclose()
+
+    async def test_reorg(self, node, rpc):
+        chain = Chain(node, 12)
+        events = []
+        async for event in rpc.iter_blocks(0, 13, prefetch=4):
+            events.append(event)
+            if not isinstance(event, BlockDisconnected) and event["height"] == 8 and len(chain.hashes) == 12:
+                chain.reorg(6, 8, branch=1)
+        disconnected = [event for event in events if isinstance(event, BlockDisconnected)]
+        assert [event.height for event in disconnected] == list(range(disconnected[0].height, 5, -1))
+        assert all(event.hash == f"{0:032x}{event.height:032x}" for event in disconnected)
+        assert replay(events) == chain.hashes
+
+    async def test_shorter_reorg(self, node, rpc):
+        chain = Chain(node, 10)
+        bus = EventBus()
+        events = []
+        async for event in rpc.iter_blocks(0, prefetch=2, follow=True, bus=bus):
+            events.append(event)
+            if not isinstance(event, BlockDisconnected) and event["height"] == 9:
+                chain.reorg(7, 1, branch=1)
+                bus.publish("hashblock", chain.hashes[-1])
+            elif not isinstance(event, BlockDisconnected) and event["hash"] == chain.hashes[-1]:
+                break
+        assert [event.height for event in events if isinstance(event, BlockDisconnected)] == [9, 8, 7]
+        assert replay(events) == chain.hashes
+
+    async def test_follow(self, node, rpc):
+        chain = Chain(node, 5)
+        bus = EventBus()
+        heights = []
+        async for block in rpc.iter_blocks(3, 8, follow=True, bus=bus):
+            heights.append(block["height"])
+            if block["height"] == len(chain.hashes) - 1:
+                chain.extend(2)
+                bus.publish("hashblock", chain.hashes[-1])
+        assert heights == [3, 4, 5, 6, 7, 8]
+        assert not bus.subscribers["hashblock"]
+
+    async def test_error(self, node, rpc):
+        chain = Chain(node, 5)
+        def getblock(blockhash, verbosity=1):
+            if blockhash == chain.hashes[3]:
+                raise NodeError(-1, "Block not available (pruned data)")
+            return chain.blocks[blockhash]
+        node.methods["getblock"] = getblock
+        with pytest.raises(RPCError) as exc:
+            [block async for block in rpc.iter_blocks(0)]
+        assert exc.value.code == -1
+        node.methods["getblock"] = lambda blockhash, verbosity=1: {**chain.blocks[blockhash], "previousblockhash": "00" * 32}
+        with pytest.raises(RPCError) as exc:
+            [block async for block in rpc.iter_blocks(0)]
+        assert "doesn't link" in exc.value.message
+
+
 if __name__ == "__main__":
     raise RuntimeError("Module is not meant to be called directly")
\ No newline at end of file
@@ -0,0 +1,113 @@
+import numpy as np
+from fastbtc.segments import SortedSegments
+
+
+FIELDS = [("value", "<i8")]
+
+
+class TestClassSortedSegments:
+
+    def test_buffer_and_segments(self, tmp_path):
+        table = SortedSegments(str(tmp_path), FIELDS)
+        table.put(5, 1, 10)
+        table.put(5, 2, 20)
+        table.put(7, 1, 70)
+        assert table.get(5, 2) == (5, 2, 1, 20)
+        table.flush()
+        assert table.get(5, 2) == (5, 2, 1, 20)
+        table.put(5, 2, 21)
+        table.delete(5, 1)
+        assert table.find(5)["value"].tolist() == [21]
+        table.flush()
+        assert table.get(5, 1) is None
+        assert [records["value"].tolist() for records in table.find_many([7, 5, 6])] == [[70], [21], []]
+
+    def test_merge_drops_deletions(self, tmp_path):
+        table = SortedSegments(str(tmp_path), FIELDS)
+        for n in range(4):
+            table.put(n, 0, n)
+            table.flush()
+        assert [len(segment) for _, segment, _ in table.segments] == [3, 1]
+        table.delete(2, 0)
+        table.flush()
+        # merged down to the oldest segment, where the deleted record and its deletion are dropped
+        assert [len(segment) for _, segment, _ in table.segments] == [3]
+        assert table.find(2).size == 0
+        assert table.find(3)["value"].tolist() == [3]
+
+    def test_reopen(self, tmp_path):
+        table = SortedSegments(str(tmp_path), FIELDS, buffer=2)
+        for n in range(10):
+            table.put(n % 3, n, n)
+            if table.full():
+                table.flush()
+        table.close()
+        table = SortedSegments(str(tmp_path), FIELDS)
+        assert table.find(1)["sub"].tolist() == [1, 4, 7]
+        assert np.array_equal(table.find(0)["value"], [0, 3, 6, 9])
+
+    def test_readonly_reload(self, tmp_path):
+        table = SortedSegments(str(tmp_path), FIELDS)
+        reader = SortedSegments(str(tmp_path), FIELDS, readonly=True)
+        for n in range(4):
+            table.put(n, 0, n)
+            table.flush()
+        (tmp_path / "000000000099.npy.tmp").write_bytes(b"partial")
+        reader.reload()
+        assert [record["value"].tolist() for record in reader.find_many(range(4))] == [[0], [1], [2], [3]]
+        table.delete(2, 0)
+        table.flush()
+        reader.reload()
+        assert reader.find(2).size == 0
+        assert [sequence for sequence, _, _ in reader.segments] == [sequence for sequence, _, _ in table.segments]
+        assert (tmp_path / "000000000099.npy.tmp").exists()
+
+    def test_interrupted_merge(self, tmp_path):
+        table = SortedSegments(str(tmp_path), FIELDS)
+        records = lambda *rows: np.array(list(rows), dtype=table.dtype)
+        table.write(0, records((1, 0, 1, 1), (2, 0, 1, 2)))
+        table.write(1, records((2, 0, 0, 0)))
+        # merged into segment 2, which crashed before 0 and 1 were removed
+        table.write(2, records((1, 0, 1, 1)))
+        reopened = SortedSegments(str(tmp_path), FIELDS)
+        assert reopened.find(2).size == 0 and reopened.find(1)["value"].tolist() == [1]
+        assert len(reopened.segments) == 1
+
+    def test_without_subkey(self, tmp_path):
+        table = SortedSegments(str(tmp_path), [("height", "<u4")], subkey=False)
+        assert table.row.itemsize == 5
+        for n in range(4):
+            table.put(n, 0, n)
+            table.flush()
+        table.put(1, 0, 10)
+        table.delete(2, 0)
+        assert table.get(1, 0) == (1, 1, 10)
+        table.flush()
+        assert [len(segment) for _, segment, _ in table.segments] == [3]
+        assert table.get(1, 0) == (1, 1, 10) and table.get(2, 0) is None
+        assert [records["height"].tolist() for records in table.find_many([0, 1, 2])] == [[0], [10], []]
+        assert table.find(3).dtype.names == ("key", "live", "height")
+
+    def test_streaming_merge(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("fastbtc.segments.SEGMENT_MERGE_CHUNK", 3)
+        rng = np.random.default_rng(7)
+        for subkey in (True, False):
+            table = SortedSegments(str(tmp_path / str(subkey)), FIELDS, buffer=5, subkey=subkey)
+            model = {}
+            for n in range(400):
+                key, sub = int(rng.integers(20)), int(rng.integers(3)) if subkey else 0
+                if rng.random() < 0.3:
+                    table.delete(key, sub)
+                    model.pop((key, sub), None)
+                else:
+                    table.put(key, sub, n)
+                    model[key, sub] = n
+                if table.full():
+                    table.flush()
+            table.close()
+            reopened = SortedSegments(str(tmp_path / str(subkey)), FIELDS, subkey=subkey)
+            for key in range(20):
+                expected = [value for (k, sub), value in sorted(model.items()) if k == key]
+                assert reopened.find(key)["value"].tolist() == expected
+            for _, segment, keys in reopened.segments:
+                assert len(segment) == len(keys) and np.all(keys[1:] >= keys[:-1])
@@ -0,0 +1,130 @@
+import sys
+import struct
+import asyncio
+import subprocess
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.events import EventBus
+from fastbtc.shared import SharedState, SLOT
+
+
+TOPICS = {"getblockchaininfo": 1024, "getmempoolinfo": 1024, "getpeerinfo": 4096, "blocks": 8192}
+
+
+class Chain:
+    '''Chain of verbosity 1 blocks with a mempool and peers, served by the fake node'''
+    def __init__(self, height:int) -> None:
+        self.height = height
+
+    def getblockchaininfo(self) -> dict:
+        return {"chain": "regtest", "blocks": self.height, "bestblockhash": f"{self.height:064x}"}
+
+    def getblock(self, blockhash:str, verbosity:int=1) -> dict:
+        height = int(blockhash, 16)
+        return {"hash": blockhash, "height": height, "previousblockhash": f"{height - 1:064x}" if height else None}
+
+    def serve(self, node) -> None:
+        node.methods["getblockchaininfo"] = self.getblockchaininfo
+        node.methods["getblock"] = self.getblock
+        node.methods["getmempoolinfo"] = lambda: {"size": 3}
+        node.methods["getpeerinfo"] = lambda: [{"id": 0}]
+
+
+class TestClassSharedState:
+
+    def test_reader_before_writer(self, tmp_path):
+        path = str(tmp_path / "shared")
+        reader = SharedState(path, TOPICS)
+        assert reader.get("getmempoolinfo") is None
+        writer = SharedState(path, TOPICS)
+        assert writer.elect()
+        assert not reader.elect()
+        writer.put("getmempoolinfo", {"size": 1})
+        assert reader.get("getmempoolinfo") == {"size": 1}
+        writer.put("getmempoolinfo", {"size": 2})
+        assert reader.get("getmempoolinfo") == {"size": 2}
+        assert reader.get("getmempoolinfo") is reader.get("getmempoolinfo")
+        writer.close()
+        # the lock is free again
+        assert reader.elect()
+        reader.close()
+
+    def test_write_in_progress(self, tmp_path):
+        writer = SharedState(str(tmp_path / "shared"), TOPICS)
+        writer.elect()
+        writer.put("getmempoolinfo", {"size": 1})
+        reader = SharedState(writer.path, TOPICS)
+        offset, _ = writer.slots["getmempoolinfo"]
+        sequence = SLOT.unpack_from(writer.map, offset)[0]
+        struct.pack_into("<Q", writer.map, offset, sequence + 1)
+        assert reader.get("getmempoolinfo") is None
+        assert reader.stats["retries"] == 8
+        # a writer taking over after a crash mid-write keeps the sequences increasing
+        writer.put("getmempoolinfo", {"size": 2})
+        assert SLOT.unpack_from(writer.map, offset)[0] == sequence + 4
+        assert reader.get("getmempoolinfo") == {"size": 2}
+        reader.close()
+        writer.close()
+
+    def test_stale_and_oversized(self, tmp_path):
+        writer = SharedState(str(tmp_path / "shared"), TOPICS)
+        writer.elect()
+        assert not writer.put("getmempoolinfo", {"pad": "x" * 2000})
+        writer.put("getmempoolinfo", {"size": 1})
+        assert writer.get("getmempoolinfo", max_age=-1) is None
+        writer.close()
+
+    def test_other_process(self, tmp_path):
+        writer = SharedState(str(tmp_path / "shared"), TOPICS)
+        writer.elect()
+        writer.put("getpeerinfo", [{"id": 7}])
+        script = (
+            "import sys\n"
+            "from fastbtc.shared import SharedState\n"
+            f"shared = SharedState(sys.argv[1], {TOPICS!r})\n"
+            "print(shared.elect(), shared.get('getpeerinfo'))\n"
+        )
+        output = subprocess.run([sys.executable, "-c", script, writer.path], capture_output=True, text=True, check=True).stdout
+        assert output.strip() == "False [{'id': 7}]"
+        writer.close()
+
+
+class TestClassSharedRPC:
+
+    async def test_publish_and_read(self, node, rpc, tmp_path):
+        chain = Chain(100)
+        chain.serve(node)
+        writer = SharedState(str(tmp_path / "shared"), TOPICS)
+        writer.elect()
+        await writer.publish(rpc)
+        assert len(writer.get("blocks")) == 6
+        reader = SharedState(writer.path, TOPICS)
+        async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, shared=reader) as worker:
+            posts = node.posts
+            assert await worker.getblockcount() == 100
+            assert await worker.getbestblockhash() == f"{100:064x}"
+            assert await worker.getmempoolinfo() == {"size": 3}
+            assert await worker.getpeerinfo() == [{"id": 0}]
+            assert (await worker.getblock(f"{98:064x}"))["height"] == 98
+            assert node.posts == posts
+            # older than the recent blocks, or another verbosity
+            await worker.getblock(f"{90:064x}")
+            await worker.getblock(f"{98:064x}", 2)
+            assert node.posts == posts + 2
+        reader.close()
+        writer.close()
+
+    async def test_follow(self, node, rpc, tmp_path):
+        chain = Chain(100)
+        chain.serve(node)
+        shared = SharedState(str(tmp_path / "shared"), TOPICS)
+        bus = EventBus()
+        task = asyncio.ensure_future(shared.follow(rpc, bus))
+        while shared.get("getblockchaininfo") is None:
+            await asyncio.sleep(0.01)
+        chain.height = 101
+        bus.publish("hashblock", f"{101:064x}")
+        while shared.get("getblockchaininfo")["blocks"] != 101:
+            await asyncio.sleep(0.01)
+        assert shared.block(f"{101:064x}")["height"] == 101
+        task.cancel()
+        shared.close()
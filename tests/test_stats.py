@@ -0,0 +1,148 @@
+import pytest
+import asyncio
+import numpy as np
+from fastbtc.events import EventBus
+from fastbtc.stats import BlockStatsStore, MISSING, STORED, UNAVAILABLE, STATS_BATCH_SIZE
+from tests.fakenode import RPCError
+
+
+class StatsChain:
+    '''Chain whose block at height n has n + 1 transactions, served by the fake node'''
+    def __init__(self, count:int) -> None:
+        self.count = count
+        self.seed = 0               # changed by a reorg
+        self.pruned = set()
+
+    def blockhash(self, height:int) -> str:
+        return f"{self.seed:016x}{height:048x}"
+
+    def getblockcount(self) -> int:
+        return self.count - 1
+
+    def getblockhash(self, height:int) -> str:
+        if not 0 <= height < self.count:
+            raise RPCError(-8, "Block height out of range")
+        return self.blockhash(height)
+
+    def getblockstats(self, height:int) -> dict:
+        if height in self.pruned:
+            raise RPCError(-1, "Block not available (pruned data)")
+        if not 0 <= height < self.count:
+            raise RPCError(-8, "Target block height after current tip")
+        return {
+            "blockhash": self.blockhash(height), "height": height, "txs": height + 1 + self.seed,
+            "totalfee": 1000 * height, "mediantime": 1_599_998_400 + 600 * height,
+            "feerate_percentiles": [1, 2, 3, 4, height],
+        }
+
+    def serve(self, node) -> None:
+        for method in ("getblockcount", "getblockhash", "getblockstats"):
+            node.methods[method] = getattr(self, method)
+
+
+@pytest.fixture
+def chain(node):
+    chain = StatsChain(100)
+    chain.serve(node)
+    return chain
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = BlockStatsStore(str(tmp_path))
+    yield store
+    store.close()
+
+
+class TestClassBlockStatsStore:
+
+    async def test_sync(self, rpc, chain, store):
+        assert await store.sync(rpc, batch=30) == 100
+        assert store.height == 99
+        assert store.stored() == 100
+        series = store.query("txs", 10, 14)
+        assert series["heights"].tolist() == [10, 11, 12, 13, 14]
+        assert series["values"].tolist() == [11, 12, 13, 14, 15]
+        assert store.query("feerate_p90", 5, 6)["values"].tolist() == [5, 6]
+        assert await store.sync(rpc) == 0
+
+    async def test_aggregates(self, rpc, chain, store):
+        await store.sync(rpc)
+        assert store.query("txs", 0, 99, step=10, agg="sum")["values"].tolist() == [sum(range(n + 1, n + 11)) for n in range(0, 100, 10)]
+        assert store.query("txs", 0, 24, step=10, agg="max")["values"].tolist() == [10, 20, 25]
+        assert store.query("txs", 0, 24, step=10, agg="median")["values"].tolist() == [5.5, 15.5, 23.0]
+        assert store.query("txs", 0, 24, step=10, agg="count")["heights"].tolist() == [0, 10, 20]
+        # 6 blocks per hour of median time
+        hourly = store.query("txs", 0, 11, period=3600, agg="mean")
+        assert hourly["values"].tolist() == [3.5, 9.5]
+        assert hourly["mediantime"].tolist() == [1_599_998_400, 1_600_002_000]
+        rolling = store.query("txs", 0, 4, window=2)
+        assert rolling["values"].tolist() == [1.5, 2.5, 3.5, 4.5]
+        assert rolling["heights"].tolist() == [1, 2, 3, 4]
+        with pytest.raises(ValueError):
+            store.query("nonsense")
+        with pytest.raises(ValueError):
+            store.query("txs", agg="p101")
+
+    async def test_reorg_and_growth(self, rpc, chain, store):
+        await store.sync(rpc)
+        chain.seed = 1
+        chain.count = 120
+        await store.sync(rpc)
+        assert store.height == 119
+        # the last heights of the old chain were fetched again, the older ones are kept
+        assert store.query("txs", 93, 94)["values"].tolist() == [94, 96]
+        assert store.query("txs", 119, 119)["values"].tolist() == [121]
+
+    async def test_pruned(self, rpc, chain, store, node):
+        chain.pruned = {3, 4}
+        assert await store.sync(rpc) == 98
+        assert store.status[3] == UNAVAILABLE
+        assert store.query("txs", 2, 5)["heights"].tolist() == [2, 5]
+        assert store.query("txs", 0, 9, step=5, agg="count")["values"].tolist() == [3, 5]
+        node.calls.clear()
+        await store.sync(rpc)
+        assert "getblockstats" not in [method for method, _ in node.calls]
+
+    async def test_follow_retries(self, rpc, chain, store, monkeypatch):
+        monkeypatch.setattr("fastbtc.stats.STATS_RETRY", 0.01)
+        iter_many, sizes = rpc.iter_many, []
+
+        async def timing_out(calls, batch_size=None):
+            sizes.append(batch_size)
+            async for reply in iter_many(calls, batch_size):
+                yield reply
+                if len(sizes) == 1 and store.stored() == 20:
+                    raise asyncio.TimeoutError()
+        monkeypatch.setattr(rpc, "iter_many", timing_out)
+        bus = EventBus()
+        task = asyncio.ensure_future(store.follow(rpc, bus))
+        for _ in range(100):
+            if store.stored() == 100:
+                break
+            await asyncio.sleep(0.01)
+        assert store.stored() == 100
+        assert sizes == [STATS_BATCH_SIZE, STATS_BATCH_SIZE]
+        task.cancel()
+
+    async def test_reopen(self, rpc, chain, tmp_path):
+        store = BlockStatsStore(str(tmp_path))
+        await store.sync(rpc)
+        store.close()
+        store = BlockStatsStore(str(tmp_path))
+        assert store.height == 99
+        assert store.status[99] == STORED and store.status[100] == MISSING
+        assert np.array_equal(store.query("totalfee", 0, 2)["values"], [0, 1000, 2000])
+        store.close()
+
+    async def test_reader_reloads(self, rpc, chain, tmp_path, monkeypatch):
+        monkeypatch.setattr("fastbtc.stats.STATS_GROWTH", 64)
+        writer = BlockStatsStore(str(tmp_path))
+        reader = BlockStatsStore(str(tmp_path))
+        await writer.sync(rpc)
+        assert reader.height == -1 and reader.capacity == 64
+        reader.reload()
+        assert reader.height == 99 and reader.capacity == 128
+        assert np.array_equal(reader.query("totalfee", 98, 99)["values"], [98000, 99000])
+        writer.close()
+        reader.close()
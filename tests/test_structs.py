@@ -0,0 +1,103 @@
+import math
+import orjson
+import pytest
+from fastbtc import structs
+from fastbtc.mempool import MempoolMirror
+from tests.fakenode import RPCError
+
+
+def entry(n:int, **fields) -> dict:
+    return {
+        "vsize": 100 + n, "weight": 400 + 4 * n, "time": 1_700_000_000 + n, "height": 800_000,
+        "descendantcount": 1, "descendantsize": 100 + n, "ancestorcount": 1, "ancestorsize": 100 + n,
+        "wtxid": f"{n:064x}", "fees": {"base": 0.0001, "modified": 0.0001, "ancestor": 0.0001, "descendant": 0.0001},
+        "depends": [], "spentby": [], "bip125-replaceable": False, "unbroadcast": n % 2 == 1, **fields,
+    }
+
+
+PEER = {"id": 3, "addr": "10.0.0.1:8333", "network": "ipv4", "pingtime": 0.05, "bytessent_per_msg": {"ping": 32},
+        "inbound": False, "connection_type": "outbound-full-relay", "unknown_field": 1}
+
+
+class TestClassStructs:
+
+    def test_roundtrip(self):
+        body = orjson.dumps(entry(1))
+        info = structs.decode(body, structs.MempoolEntryInfo)
+        assert info.vsize == 101 and info.fees.base == 0.0001
+        assert info.bip125_replaceable is False and info.unbroadcast is True
+        assert orjson.loads(structs.encode(info)) == entry(1)
+        assert structs.convert(entry(1), structs.MempoolEntryInfo) == info
+
+    def test_unknown_and_missing_fields(self):
+        peers = structs.decode(orjson.dumps([PEER, {"id": 4}]), structs.PeerInfo, list)
+        assert [peer.id for peer in peers] == [3, 4]
+        assert peers[1].addr is None
+        expected = dict(PEER)
+        del expected["unknown_field"]
+        assert orjson.loads(structs.encode(peers)) == [expected, {"id": 4}]
+
+    def test_slots(self):
+        info = structs.MempoolEntryInfo(vsize=1)
+        assert not hasattr(info, "__dict__")
+        with pytest.raises((AttributeError, TypeError)):
+            info.extra = 1
+
+
+class TestClassMempoolEntries:
+
+    def test_lookup(self):
+        entries = {f"{n:064x}": entry(n) for n in range(10)}
+        entries[f"{3:064x}"] = entry(3, depends=[f"{2:064x}"], fees={"base": 0.0002})
+        del entries[f"{4:064x}"]["bip125-replaceable"], entries[f"{4:064x}"]["wtxid"], entries[f"{4:064x}"]["height"]
+        snapshot = structs.MempoolEntries.decode(orjson.dumps(entries))
+        assert len(snapshot) == 10 and list(snapshot) == list(entries)
+        assert snapshot[f"{3:064x}"].depends == [f"{2:064x}"]
+        assert snapshot[f"{3:064x}"].fees == structs.MempoolFees(base=0.0002)
+        assert snapshot[f"{4:064x}"].wtxid is None and snapshot[f"{4:064x}"].height is None
+        assert f"{10:064x}" not in snapshot
+        assert orjson.loads(structs.encode(snapshot)) == entries
+        assert orjson.loads(structs.encode({"entries": snapshot})) == {"entries": entries}
+
+    def test_compact(self):
+        entries = {f"{n:064x}": entry(n) for n in range(1000)}
+        snapshot = structs.MempoolEntries(entries)
+        assert snapshot.ints.itemsize * len(snapshot.ints) == 1000 * 8 * 8
+        assert len(snapshot.wtxids) == 1000 * 32 and not snapshot.links
+        assert math.isnan(structs.MempoolEntries({"a": {}}).fees[0])
+
+
+@pytest.mark.asyncio
+class TestClassTypedRPC:
+
+    async def test_typed_methods(self, node, rpc):
+        entries = {f"{n:064x}": entry(n) for n in range(5)}
+        node.methods["getrawmempool"] = lambda verbose=False, mempool_sequence=False: entries if verbose else list(entries)
+        node.methods["getmempoolentry"] = lambda txid: entries[txid]
+        node.methods["getpeerinfo"] = lambda: [PEER]
+        node.methods["getblockheader"] = lambda blockhash, verbose=True: {"hash": blockhash, "height": 7, "nTx": 2}
+        snapshot = await rpc.getrawmempool(True, typed=True)
+        assert isinstance(snapshot, structs.MempoolEntries)
+        assert dict(snapshot) == structs.convert(entries, structs.MempoolEntryInfo, dict)
+        assert await rpc.getrawmempool(typed=True) == list(entries)
+        assert (await rpc.getmempoolentry(f"{2:064x}", typed=True)).vsize == 102
+        assert (await rpc.getpeerinfo(typed=True))[0].connection_type == "outbound-full-relay"
+        assert (await rpc.getblockheader(f"{7:064x}", typed=True)).nTx == 2
+        assert await rpc.getpeerinfo() == [PEER]
+
+    async def test_typed_error(self, node, rpc):
+        def getmempoolentry(txid):
+            raise RPCError(-5, "Transaction not in mempool")
+        node.methods["getmempoolentry"] = getmempoolentry
+        assert await rpc.getmempoolentry("gone", typed=True) == {"code": -5, "message": "Transaction not in mempool"}
+
+    async def test_typed_mirror(self, rpc):
+        entries = {f"{n:064x}": entry(n) for n in range(3)}
+        rpc.mempool = MempoolMirror()
+        for txid, mirrored in entries.items():
+            rpc.mempool.add(txid, mirrored)
+        rpc.mempool.synced = True
+        snapshot = await rpc.getrawmempool(True, typed=True)
+        assert snapshot[f"{1:064x}"].vsize == 101
+        assert (await rpc.getmempoolentry(f"{1:064x}", typed=True)).wtxid == f"{1:064x}"
+        assert "code" in await rpc.getmempoolentry("gone", typed=True)
@@ -0,0 +1,195 @@
+import asyncio
+import pytest
+import threading
+from fastbtc.events import EventBus
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.txindex import TxIndex
+from tests.fakenode import RPCError
+
+
+class TxChain:
+    '''Chain of verbosity 1 blocks served by a fake node without -txindex'''
+    def __init__(self) -> None:
+        self.blocks = []                # best chain
+        self.stale = {}                 # hash -> block left behind by a reorg
+
+    def mine(self, *txids:str, fork:str="") -> dict:
+        height = len(self.blocks)
+        blockhash = f"{fork}{height:0{64 - len(fork)}x}"
+        block = {
+            "hash": blockhash,
+            "height": height,
+            "previousblockhash": self.blocks[-1]["hash"] if self.blocks else None,
+            # the reversed hash as coinbase txid keeps txid prefixes unique
+            "tx": [blockhash[::-1], *txids],
+        }
+        self.blocks.append(block)
+        return block
+
+    def reorg(self, height:int) -> None:
+        '''Disconnects the blocks from height on'''
+        self.stale.update((block["hash"], block) for block in self.blocks[height:])
+        del self.blocks[height:]
+
+    def getblockcount(self) -> int:
+        return len(self.blocks) - 1
+
+    def getblockhash(self, height:int) -> str:
+        if not 0 <= height < len(self.blocks):
+            raise RPCError(-8, "Block height out of range")
+        return self.blocks[height]["hash"]
+
+    def getblock(self, blockhash:str, verbosity:int=1) -> dict:
+        for block in self.blocks:
+            if block["hash"] == blockhash:
+                return block
+        if blockhash in self.stale:
+            return self.stale[blockhash]
+        raise RPCError(-5, "Block not found")
+
+    def getrawtransaction(self, txid:str, verbose:bool=False, blockhash:str=None) -> str:
+        if blockhash is None:
+            raise RPCError(-5, "No such mempool transaction. Use -txindex or provide a block hash to enable blockchain transaction queries.")
+        if txid not in self.getblock(blockhash)["tx"]:
+            raise RPCError(-5, "No such transaction found in the provided block.")
+        return f"raw {txid}"
+
+    def serve(self, node) -> None:
+        for method in ("getblockcount", "getblockhash", "getblock", "getrawtransaction"):
+            node.methods[method] = getattr(self, method)
+
+
+@pytest.fixture
+def chain(node):
+    chain = TxChain()
+    chain.serve(node)
+    chain.mine()
+    chain.mine("aa" * 32, "bb" * 32)
+    chain.mine("cc" * 32)
+    return chain
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = TxIndex(str(tmp_path))
+    yield index
+    index.close()
+
+
+class TestClassTxIndex:
+
+    async def test_sync(self, rpc, chain, index):
+        assert await index.sync(rpc, batch=2) == 3
+        assert index.synced
+        assert index.height == 2
+        assert index.height_of("aa" * 32) == 1
+        assert index.height_of("cc" * 32) == 2
+        assert index.height_of(chain.blocks[0]["tx"][0]) == 0
+        assert index.height_of("dd" * 32) is None
+        assert index.heights_of(["bb" * 32, "dd" * 32, "cc" * 32]) == [1, None, 2]
+        assert index.height_of("zz" * 32) is None and index.height_of("aa") is None
+        assert index.heights_of(["zz" * 32, "bb" * 32, "aa " * 21 + "a"]) == [None, 1, None]
+        chain.mine("dd" * 32)
+        assert await index.sync(rpc) == 1
+        assert index.height_of("dd" * 32) == 3
+
+    async def test_indexed_off_loop(self, rpc, chain, index, monkeypatch):
+        threads = []
+        add = index.add
+        def spy(height, blockhash, txids):
+            threads.append(threading.current_thread())
+            add(height, blockhash, txids)
+        monkeypatch.setattr(index, "add", spy)
+        assert await index.sync(rpc, batch=2) == 3
+        assert len(threads) == 3 and threading.main_thread() not in threads
+        assert index.height_of("cc" * 32) == 2
+
+    async def test_reopen(self, rpc, chain, tmp_path):
+        index = TxIndex(str(tmp_path))
+        await index.sync(rpc)
+        index.close()
+        index = TxIndex(str(tmp_path))
+        assert index.height == 2
+        assert index.height_of("bb" * 32) == 1
+        assert await index.sync(rpc) == 0
+
+    async def test_reorg(self, rpc, chain, index):
+        await index.sync(rpc)
+        chain.reorg(2)
+        chain.mine("ee" * 32, fork="f")
+        chain.mine("cc" * 32, fork="f")
+        assert await index.sync(rpc) == 2
+        assert index.stats["rollbacks"] == 1
+        assert index.height_of("ee" * 32) == 2
+        assert index.height_of("cc" * 32) == 3
+        assert index.hashes[3] == chain.blocks[3]["hash"]
+
+    async def test_reorg_to_shorter_chain(self, rpc, chain, index):
+        await index.sync(rpc)
+        chain.reorg(1)
+        chain.mine("ee" * 32, fork="f")
+        assert await index.sync(rpc) == 1
+        assert index.height == 1
+        assert index.height_of("aa" * 32) is None
+        assert index.height_of("cc" * 32) is None
+        assert index.height_of("ee" * 32) == 1
+
+    async def test_single_writer(self, rpc, chain, index, tmp_path):
+        await index.sync(rpc)
+        reader = TxIndex(str(tmp_path))
+        assert not reader.elect()
+        with pytest.raises(RuntimeError):
+            await reader.sync(rpc)
+        chain.mine("dd" * 32)
+        await index.sync(rpc)
+        assert reader.height_of("dd" * 32) is None
+        reader.reload()
+        assert reader.height_of("dd" * 32) == 3
+        reader.close()
+
+    async def test_follow_takes_over(self, rpc, chain, index, tmp_path, monkeypatch):
+        monkeypatch.setattr("fastbtc.txindex.TXINDEX_RELOAD", 0.05)
+        await index.sync(rpc)
+        reader = TxIndex(str(tmp_path))
+        task = asyncio.ensure_future(reader.follow(rpc, EventBus()))
+        await asyncio.sleep(0.1)
+        assert not reader.writer
+        assert reader.synced and reader.height == 2
+        index.close()
+        chain.mine("dd" * 32)
+        await asyncio.sleep(0.2)
+        assert reader.writer
+        assert reader.height_of("dd" * 32) == 3
+        task.cancel()
+        reader.close()
+
+
+class TestClassGetRawTransaction:
+
+    async def test_blockhash_filled_in(self, node, chain, tmp_path):
+        index = TxIndex(str(tmp_path))
+        async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, txindex=index) as rpc:
+            assert "code" in await rpc.getrawtransaction("cc" * 32)
+            await index.sync(rpc)
+            assert await rpc.getrawtransaction("cc" * 32) == f"raw {'cc' * 32}"
+            # unknown to the index, asked as is
+            assert await rpc.getrawtransaction("dd" * 32) == {
+                "code": -5,
+                "message": "No such mempool transaction. Use -txindex or provide a block hash to enable blockchain transaction queries.",
+            }
+            # not a txid, the node tells why
+            assert (await rpc.getrawtransaction("zz" * 32))["code"] == -5
+
+    async def test_stale_index_falls_back(self, node, chain, tmp_path):
+        index = TxIndex(str(tmp_path))
+        async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, txindex=index) as rpc:
+            await index.sync(rpc)
+            calls = []
+            served = chain.getrawtransaction
+            chain.getrawtransaction = lambda *params: calls.append(params) or served(*params)
+            node.methods["getrawtransaction"] = chain.getrawtransaction
+            chain.reorg(1)
+            chain.mine("bb" * 32, fork="f")
+            chain.mine("aa" * 32, fork="f")
+            assert "code" in await rpc.getrawtransaction("aa" * 32)
+            assert len(calls) == 2 and len(calls[1]) == 2
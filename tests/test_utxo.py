@@ -0,0 +1,167 @@
+import pytest
+import threading
+from fastbtc.block import Block, sha256d, hash_hex
+from fastbtc.rpc import BitcoinRPC
+from fastbtc.utxo import UTXOIndex
+from tests.fakenode import RPCError
+
+
+# P2WPKH scripts of three payees
+ALICE, BOB, CAROL = (b"\x00\x14" + bytes([n]) * 20 for n in (1, 2, 3))
+
+
+def make_tx(inputs:list, outputs:list, locktime:int=0) -> bytes:
+    '''Returns a legacy transaction spending (txid bytes, vout) inputs, None for a coinbase, to (value, script) outputs'''
+    raw = (1).to_bytes(4, 'little') + bytes([len(inputs)])
+    for prevout in inputs:
+        txid, vout = prevout or (bytes(32), 0xffffffff)
+        raw += txid + vout.to_bytes(4, 'little') + b"\x00" + b"\xff\xff\xff\xff"
+    raw += bytes([len(outputs)])
+    for value, script in outputs:
+        raw += value.to_bytes(8, 'little') + bytes([len(script)]) + script
+    return raw + locktime.to_bytes(4, 'little')
+
+
+class UTXOChain:
+    '''Chain of blocks built from transactions, served by the fake node'''
+    def __init__(self) -> None:
+        self.blocks = []
+
+    def mine(self, payee:bytes, *txs:bytes) -> list:
+        '''Appends a block paying 50 to payee, returns the txids of its transactions in internal byte order'''
+        prev = sha256d(self.blocks[-1][:80]) if self.blocks else bytes(32)
+        # the height as locktime keeps coinbase txids unique
+        coinbase = make_tx([None], [(50, payee)], locktime=len(self.blocks))
+        body = [coinbase, *txs]
+        header = (1).to_bytes(4, 'little') + prev + sha256d(b"".join(body)) + len(self.blocks).to_bytes(4, 'little') + bytes(8)
+        self.blocks.append(header + bytes([len(body)]) + b"".join(body))
+        return [sha256d(tx) for tx in body]
+
+    def getblockcount(self) -> int:
+        return len(self.blocks) - 1
+
+    def getblockhash(self, height:int) -> str:
+        if not 0 <= height < len(self.blocks):
+            raise RPCError(-8, "Block height out of range")
+        return hash_hex(sha256d(self.blocks[height][:80]))
+
+    def getblock(self, blockhash:str, verbosity:int=1) -> str:
+        for block in self.blocks:
+            if hash_hex(sha256d(block[:80])) == blockhash:
+                return block.hex()
+        raise RPCError(-5, "Block not found")
+
+    def serve(self, node) -> None:
+        for method in ("getblockcount", "getblockhash", "getblock"):
+            node.methods[method] = getattr(self, method)
+
+
+@pytest.fixture
+def chain(node):
+    chain = UTXOChain()
+    chain.serve(node)
+    first = chain.mine(ALICE)
+    second = chain.mine(BOB, make_tx([(first[0], 0)], [(20, BOB), (29, ALICE), (0, b"\x6a\x01\x00")]))
+    chain.spend = second[1]
+    chain.mine(CAROL, make_tx([(second[1], 0)], [(20, ALICE)]))
+    return chain
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = UTXOIndex(str(tmp_path))
+    yield index
+    index.close()
+
+
+class TestClassUTXOIndex:
+
+    async def test_sync(self, rpc, chain, index):
+        assert await index.sync(rpc) == 3
+        assert index.synced
+        assert index.balance(ALICE) == 49
+        assert index.balances([BOB, CAROL, b"\x51"]) == [50, 50, 0]
+        assert sorted(output["value"] for output in index.unspent(ALICE)) == [20, 29]
+        assert await index.sync(rpc) == 0
+
+    async def test_connect_off_loop(self, rpc, chain, index, monkeypatch):
+        threads = []
+        connect = index.connect
+        def spy(block, height):
+            threads.append(threading.current_thread())
+            assert not index.synced
+            connect(block, height)
+        monkeypatch.setattr(index, "connect", spy)
+        assert await index.sync(rpc) == 3
+        assert threads and threading.main_thread() not in threads
+        assert index.synced and index.balance(ALICE) == 49
+
+    async def test_reorg(self, rpc, chain, index):
+        await index.sync(rpc)
+        chain.blocks.pop()
+        chain.mine(CAROL)
+        chain.mine(CAROL)
+        assert await index.sync(rpc) == 2
+        assert index.stats["rollbacks"] == 1
+        assert index.balance(BOB) == 70
+        assert index.balance(ALICE) == 29
+        assert index.balance(CAROL) == 100
+
+    async def test_reopen(self, rpc, chain, tmp_path):
+        index = UTXOIndex(str(tmp_path))
+        await index.sync(rpc)
+        index.close()
+        index = UTXOIndex(str(tmp_path))
+        assert index.height == 2
+        assert index.balance(ALICE) == 49
+        chain.blocks.pop()
+        await index.sync(rpc)
+        assert index.balance(BOB) == 70
+        index.close()
+
+    async def test_getsatoshis(self, node, chain, index):
+        async with BitcoinRPC("user", "pass", "127.0.0.1", node.port, utxo=index) as rpc:
+            await index.sync(rpc)
+            # bc1q with the program of ALICE
+            address = "bc1qqyqszqgpqyqszqgpqyqszqgpqyqszqgpyfl4f3"
+            assert await rpc.getsatoshis(address) == 49
+            assert await rpc.getsatoshis("nonsense") == {"code": -5, "message": "Invalid address"}
+
+    async def test_single_writer(self, rpc, chain, index, tmp_path):
+        await index.sync(rpc)
+        reader = UTXOIndex(str(tmp_path))
+        assert not reader.elect()
+        with pytest.raises(RuntimeError):
+            await reader.sync(rpc)
+        chain.mine(CAROL, make_tx([(chain.spend, 1)], [(29, CAROL)]))
+        await index.sync(rpc)
+        assert reader.height == 2
+        assert reader.reload() is None
+        assert reader.height == 3
+        assert reader.balances([ALICE, CAROL]) == [20, 129]
+        index.close()
+        assert reader.elect()
+        reader.close()
+
+    async def test_interrupted_checkpoint(self, rpc, chain, tmp_path, monkeypatch):
+        index = UTXOIndex(str(tmp_path))
+        await index.sync(rpc)
+        chain.mine(BOB, make_tx([(chain.spend, 1)], [(29, CAROL)]))
+        def crash():
+            raise OSError("disk full")
+        # the outputs are written, the outpoints aren't
+        monkeypatch.setattr(index.outpoints, "flush", crash)
+        with pytest.raises(OSError):
+            await index.sync(rpc)
+        index.lock.close()
+        index = UTXOIndex(str(tmp_path))
+        assert index.elect()
+        assert index.height == 2
+        assert index.balances([ALICE, BOB, CAROL]) == [49, 50, 50]
+        assert await index.sync(rpc) == 1
+        assert index.balances([ALICE, BOB, CAROL]) == [20, 100, 79]
+        chain.blocks.pop()
+        chain.mine(CAROL)
+        await index.sync(rpc)
+        assert index.balances([ALICE, BOB, CAROL]) == [49, 50, 100]
+        index.close()
@@ -0,0 +1,138 @@
+import pytest
+import asyncio
+import zmq
+import zmq.asyncio
+from fastbtc.events import EventBus
+from fastbtc.zmqsub import ZMQSubscriber, TipPoller, SequenceEvent, Gap
+from tests.fakenode import RPCError as NodeError
+
+
+class Publisher:
+    '''Local ZMQ publisher standing in for bitcoind'''
+    def __init__(self) -> None:
+        self.context = zmq.asyncio.Context()
+        self.socket = self.context.socket(zmq.XPUB)
+        port = self.socket.bind_to_random_port("tcp://127.0.0.1")
+        self.url = f"tcp://127.0.0.1:{port}"
+        self.sequences = {}
+
+    async def wait_subscribed(self, count:int) -> None:
+        '''Waits until the subscriber registered count topics'''
+        for _ in range(count):
+            await asyncio.wait_for(self.socket.recv(), 5)
+
+    async def send(self, topic:str, body:bytes, sequence:int=None) -> None:
+        if sequence is None:
+            sequence = self.sequences.get(topic, -1) + 1
+        self.sequences[topic] = sequence
+        await self.socket.send_multipart([topic.encode(), body, sequence.to_bytes(4, 'little')])
+
+    def close(self) -> None:
+        self.socket.close(linger=0)
+        self.context.term()
+
+
+@pytest.fixture
+async def publisher():
+    publisher = Publisher()
+    yield publisher
+    publisher.close()
+
+
+@pytest.fixture
+async def bus():
+    return EventBus()
+
+
+@pytest.fixture
+async def subscriber(publisher, bus):
+    subscriber = await ZMQSubscriber([publisher.url], bus).start()
+    await publisher.wait_subscribed(3)
+    yield subscriber
+    await subscriber.close()
+
+
+async def receive(queue:asyncio.Queue):
+    return await asyncio.wait_for(queue.get(), 5)
+
+
+class TestClassEventBus:
+
+    async def test_slow_subscriber_drops_oldest(self):
+        bus = EventBus(maxsize=2)
+        queue = bus.subscribe("hashblock")
+        for event in range(3):
+            bus.publish("hashblock", event)
+        assert [queue.get_nowait(), queue.get_nowait()] == [("hashblock", 1), ("hashblock", 2)]
+        assert bus.dropped == 1
+
+    async def test_unsubscribe(self):
+        bus = EventBus()
+        queue = bus.subscribe("hashblock", "gap")
+        bus.unsubscribe(queue, "hashblock")
+        bus.publish("hashblock", 1)
+        bus.publish("gap", 2)
+        assert queue.qsize() == 1
+
+
+class TestClassZMQSubscriber:
+
+    async def test_hashblock(self, publisher, bus, subscriber):
+        queue = bus.subscribe("hashblock")
+        blockhash = bytes(range(32))
+        await publisher.send("hashblock", blockhash)
+        assert await receive(queue) == ("hashblock", blockhash.hex())
+
+    async def test_rawtx(self, publisher, bus, subscriber):
+        queue = bus.subscribe("rawtx")
+        await publisher.send("rawtx", b"\x02\x00\x00\x00")
+        assert await receive(queue) == ("rawtx", b"\x02\x00\x00\x00")
+
+    async def test_sequence(self, publisher, bus, subscriber):
+        queue = bus.subscribe("sequence")
+        txid = bytes(range(32))
+        await publisher.send("sequence", txid + b"A" + (42).to_bytes(8, 'little'))
+        await publisher.send("sequence", txid + b"C")
+        assert await receive(queue) == ("sequence", SequenceEvent(txid.hex(), "A", 42))
+        assert await receive(queue) == ("sequence", SequenceEvent(txid.hex(), "C", None))
+
+    async def test_gap(self, publisher, bus, subscriber):
+        queue = bus.subscribe("gap")
+        await publisher.send("hashblock", bytes(32), 7)
+        await publisher.send("hashblock", bytes(32), 8)
+        await publisher.send("hashblock", bytes(32), 11)
+        assert await receive(queue) == ("gap", Gap("hashblock", 9, 11))
+        assert subscriber.gaps == 1
+
+
+class TestClassTipPoller:
+
+    async def test_publishes_new_tips(self, node, rpc, bus):
+        tips = iter([f"{height:064x}" for height in (1, 1, 2)])
+        node.methods["getbestblockhash"] = lambda: next(tips)
+        queue = bus.subscribe("hashblock")
+        poller = await TipPoller(rpc, bus, interval=0.01).start()
+        assert await receive(queue) == ("hashblock", f"{1:064x}")
+        assert await receive(queue) == ("hashblock", f"{2:064x}")
+        await poller.close()
+
+    async def test_survives_failures(self, node, rpc, bus, monkeypatch):
+        errors = [NodeError(-28, "Loading block index...")]
+
+        def getbestblockhash():
+            if errors:
+                raise errors.pop()
+            return f"{3:064x}"
+        node.methods["getbestblockhash"] = getbestblockhash
+        call, timeouts = rpc.call, [asyncio.TimeoutError()]
+
+        async def timing_out(*args, **kwargs):
+            if timeouts:
+                raise timeouts.pop()
+            return await call(*args, **kwargs)
+        monkeypatch.setattr(rpc, "call", timing_out)
+        queue = bus.subscribe("hashblock")
+        poller = await TipPoller(rpc, bus, interval=0.01).start()
+        assert await receive(queue) == ("hashblock", f"{3:064x}")
+        assert not errors and not timeouts
+        await poller.close()